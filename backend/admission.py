@@ -0,0 +1,209 @@
+"""
+Admission control for the inference path.
+A fixed number of slots (one per pooled interpreter) run inference; everything else
+waits in a bounded FIFO queue per priority class and is granted a slot strictly by
+priority. Every request carries a deadline, either from the X-Request-Timeout-Ms
+header or a default. Requests are rejected up front when their class queue is
+full (429) or when the predicted queue wait already exceeds the deadline (503), and are
+dropped if the deadline passes while queued (504). Either way the client gets a fast
+answer with Retry-After instead of joining an ever-growing queue, which keeps tail
+latency bounded under overload.
+"""
+
+import functools
+import math
+import threading
+import time
+from collections import deque
+
+PRIORITY_CLASSES = ('clinician', 'explain', 'anonymous', 'batch')  # highest first
+TIMEOUT_HEADER = 'X-Request-Timeout-Ms'
+SERVICE_SMOOTHING = 0.1   # EWMA weight of the latest service time
+WAIT_SAMPLES = 1000       # recent queue waits kept for percentiles
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; carries the HTTP status and Retry-After"""
+
+    def __init__(self, code, message, status, retry_after=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        return {"success": False, "error": self.message, "code": self.code}
+
+    def headers(self):
+        return {"Retry-After": str(self.retry_after)} if self.retry_after else {}
+
+
+class Deadline:
+    """Point in (monotonic) time by which the client no longer wants the answer"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, stage):
+        """Stop work that nobody will read; raises DEADLINE_EXCEEDED when the deadline has passed"""
+        if self.expired():
+            raise AdmissionRejected(
+                "DEADLINE_EXCEEDED", f"Request deadline passed before {stage}", 504
+            )
+
+
+def deadline_from_headers(headers, default_seconds, max_seconds=None):
+    """Deadline from X-Request-Timeout-Ms (relative, so client clock skew does not matter)"""
+    seconds = default_seconds
+    value = headers.get(TIMEOUT_HEADER)
+    if value:
+        try:
+            seconds = max(float(value) / 1000.0, 0.0)
+        except ValueError:
+            pass
+    if max_seconds is not None:
+        seconds = min(seconds, max_seconds)
+    return Deadline(seconds)
+
+
+class _Waiter:
+    __slots__ = ('event', 'deadline', 'granted', 'enqueued_at')
+
+    def __init__(self, deadline):
+        self.event = threading.Event()
+        self.deadline = deadline
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """Slots plus bounded per-priority queues with deadline-aware shedding"""
+
+    def __init__(self, slots, queue_limits, initial_service_seconds=0.25):
+        self.slots = max(1, slots)
+        self.queue_limits = dict(queue_limits)
+        self.classes = [name for name in PRIORITY_CLASSES if name in self.queue_limits]
+        self.busy = 0
+        self.service_seconds = initial_service_seconds
+        self._queues = {name: deque() for name in self.classes}
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.counters = {name: {"admitted": 0, "queued": 0, "queue_full": 0,
+                                "deadline_unreachable": 0, "expired_in_queue": 0}
+                         for name in self.classes}
+
+    def _retry_after(self):
+        queued = sum(len(q) for q in self._queues.values())
+        return max(1, math.ceil((queued + 1) * self.service_seconds / self.slots))
+
+    def _ahead_of(self, priority):
+        """Waiters that will be served before a new request of `priority`"""
+        rank = self.classes.index(priority)
+        return sum(len(self._queues[name]) for name in self.classes[:rank + 1])
+
+    def acquire(self, priority, deadline):
+        """Block until a slot is granted, or raise AdmissionRejected"""
+        with self._lock:
+            counters = self.counters[priority]
+            if self.busy < self.slots and not any(self._queues.values()):
+                self.busy += 1
+                counters["admitted"] += 1
+                self._waits.append(0.0)
+                return
+
+            queue = self._queues[priority]
+            if len(queue) >= self.queue_limits[priority]:
+                counters["queue_full"] += 1
+                raise AdmissionRejected(
+                    "QUEUE_FULL", f"Too many queued {priority} requests; retry later", 429, self._retry_after()
+                )
+            # Expected wait: everyone ahead, served `slots` at a time, plus our own service time
+            predicted = (self._ahead_of(priority) / self.slots + 1) * self.service_seconds
+            if predicted > deadline.remaining():
+                counters["deadline_unreachable"] += 1
+                raise AdmissionRejected(
+                    "OVERLOADED", "The server cannot answer within the request deadline", 503, self._retry_after()
+                )
+            waiter = _Waiter(deadline)
+            queue.append(waiter)
+            counters["queued"] += 1
+
+        waiter.event.wait(timeout=max(deadline.remaining(), 0))
+        with self._lock:
+            if not waiter.granted:
+                if waiter in queue:
+                    queue.remove(waiter)
+                counters["expired_in_queue"] += 1
+                raise AdmissionRejected(
+                    "DEADLINE_EXCEEDED", "Request deadline passed while queued", 504, self._retry_after()
+                )
+            counters["admitted"] += 1
+            self._waits.append(time.monotonic() - waiter.enqueued_at)
+        if deadline.expired():
+            self.release()
+            deadline.check('inference')
+
+    def _grant_next(self):
+        """Hand a free slot to the highest-priority live waiter; caller holds the lock"""
+        for name in self.classes:
+            queue = self._queues[name]
+            while queue:
+                waiter = queue.popleft()
+                if waiter.deadline.expired():
+                    # Dropped without a slot; its own thread wakes, counts it and raises
+                    waiter.event.set()
+                    continue
+                waiter.granted = True
+                waiter.event.set()
+                return True
+        return False
+
+    def release(self, service_seconds=None):
+        with self._lock:
+            if service_seconds is not None:
+                self.service_seconds += SERVICE_SMOOTHING * (service_seconds - self.service_seconds)
+            if self.busy > self.slots or not self._grant_next():
+                self.busy -= 1
+
+    def set_slots(self, slots):
+        """Follow the interpreter pool size (autotuning, memory-governor shrinking)"""
+        with self._lock:
+            self.slots = max(1, slots)
+            while self.busy < self.slots and self._grant_next():
+                self.busy += 1
+
+    def guard(self, classify, deadline_source):
+        """Decorator: admit the wrapped view by `classify()` priority and `deadline_source()` deadline"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapped(*args, **kwargs):
+                self.acquire(classify(), deadline_source())
+                start = time.monotonic()
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release(time.monotonic() - start)
+            return wrapped
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            percentile = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1) if waits else None
+            return {
+                "slots": self.slots,
+                "busy": self.busy,
+                "queued": {name: len(self._queues[name]) for name in self.classes},
+                "queue_limits": self.queue_limits,
+                "service_ms_ewma": round(self.service_seconds * 1000, 1),
+                "queue_wait_ms": {"p50": percentile(0.50), "p99": percentile(0.99)},
+                "classes": {name: dict(counts) for name, counts in self.counters.items()},
+            }
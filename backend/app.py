@@ -8,7 +8,8 @@ Integrated with Gemini API for enhanced chat capabilities
 import os
 import sys
 import json
-import random
+import time
+import uuid
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -31,21 +32,40 @@ except Exception as e:
 # Constrain memory usage for Render Free Tier (512MB RAM)
 os.environ['OMP_NUM_THREADS'] = '1'
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, g
 from flask_cors import CORS
 import numpy as np
 from PIL import Image
 
+import admission
+import audit_log
+import autotune
+import mock_backend
+import near_duplicate
+import knowledge_base
+import chat_context
+import heatmap_cache
+import profiling
+import shadow
+import tta
+import cascade
+import drift_monitor
+import dicom_io
+import upload_guard
+import quality_gate
+from memory_governor import MemoryGovernor, MemoryPressure, container_limit
+from history_store import PredictionHistory
+from case_index import CaseIndex
+from labels import CLASS_LABELS, CLASS_DESCRIPTIONS, LABELS_VERSION
+import serialization
+from inference import (INPUT_SHAPE, SIGNATURE_CAM, InterpreterPool, SignatureModel, import_tflite,
+                       preprocess_image, run_inference, run_in_place, signature_keys)
+
 # Try to import TFLite runtime (lightweight, ~2MB vs ~620MB for full TensorFlow)
 TFLITE_AVAILABLE = False
 tflite_interpreter = None
 try:
-    try:
-        import tflite_runtime.interpreter as tflite
-    except ImportError:
-        # Fallback: use full TensorFlow's TFLite interpreter if tflite_runtime not available
-        import tensorflow as tf
-        tflite = tf.lite
+    tflite = import_tflite()
     TFLITE_AVAILABLE = True
     print("OK  TFLite runtime loaded")
 except Exception as e:
@@ -58,36 +78,291 @@ TF_AVAILABLE = TFLITE_AVAILABLE
 app = Flask(__name__, static_folder='../frontend/dist', static_url_path='')
 CORS(app)
 
+# Reject oversized bodies while they stream in, before anything is spooled or decoded
+app.config['MAX_CONTENT_LENGTH'] = upload_guard.MAX_CONTENT_LENGTH
+
 # Configuration
 BASE_DIR = Path(__file__).parent
 MODEL_PATH = BASE_DIR / 'model.h5'
 UPLOADS_DIR = BASE_DIR / 'uploads'
 UPLOADS_DIR.mkdir(exist_ok=True)
 
-# Model classes - must match training order (alphabetical)
-CLASS_LABELS = ["COVID-19", "Lung Cancer", "Normal", "Pleural Effusion", "Pneumonia", "Tuberculosis"]
-
-# Class descriptions
-CLASS_DESCRIPTIONS = {
-    "COVID-19": "The X-ray shows signs consistent with COVID-19 pneumonia. Please consult a healthcare provider immediately.",
-    "Lung Cancer": "The X-ray shows signs that may be consistent with lung cancer (nodules, masses, or abnormal growths). This finding requires urgent medical evaluation. Please consult an oncologist or pulmonologist immediately for further diagnostic imaging and biopsy.",
-    "Normal": "The X-ray appears normal with no significant findings. However, a medical professional should review for confirmation.",
-    "Pleural Effusion": "The X-ray shows signs consistent with pleural effusion (fluid accumulation around the lungs). This can be caused by infections, heart failure, or other conditions. Please seek medical evaluation for proper diagnosis and treatment.",
-    "Pneumonia": "The X-ray shows signs consistent with pneumonia. We recommend immediate medical evaluation.",
-    "Tuberculosis": "The X-ray shows signs consistent with Tuberculosis (TB). TB is a serious but treatable infectious disease. Please seek immediate medical attention for proper diagnosis and treatment."
+# Test-time augmentation: 'off', 'on' (always) or 'auto' (only when the top-1 margin is small)
+TTA_MODE = os.getenv('TTA_MODE', 'off').lower()
+TTA_MARGIN_THRESHOLD = float(os.getenv('TTA_MARGIN_THRESHOLD', '0.15'))
+TTA_AGGREGATION = os.getenv('TTA_AGGREGATION', 'mean').lower()
+
+# Per-user prediction history (SQLite, written off the request path)
+HISTORY_ENABLED = os.getenv('HISTORY_ENABLED', 'true').lower() != 'false'
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', str(BASE_DIR / 'history.db'))
+HISTORY_PAGE_SIZE_MAX = 200
+
+# Similar-case search over penultimate-layer embeddings (needs a model exported with embeddings);
+# users search and confirm their own studies, X-Admin-Token holders all of them
+CASE_INDEX_ENABLED = os.getenv('CASE_INDEX_ENABLED', 'true').lower() != 'false'
+CASE_INDEX_DIR = os.getenv('CASE_INDEX_DIR', str(BASE_DIR / 'case_index'))
+CASE_INDEX_IVF_THRESHOLD = int(os.getenv('CASE_INDEX_IVF_THRESHOLD', '50000'))
+CASE_INDEX_NPROBE = int(os.getenv('CASE_INDEX_NPROBE', '8'))
+SIMILAR_CASES_MAX = 50
+
+# Two-stage cascade: a small screening model answers confident cases, DenseNet handles the rest
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'false').lower() == 'true'
+CASCADE_SCREEN_MODEL = os.getenv('CASCADE_SCREEN_MODEL', str(BASE_DIR / 'model_screen.tflite'))
+CASCADE_ACCEPT_CLASSES = [c.strip() for c in os.getenv('CASCADE_ACCEPT_CLASSES', 'Normal').split(',') if c.strip()]
+CASCADE_ACCEPT_CONFIDENCE = float(os.getenv('CASCADE_ACCEPT_CONFIDENCE', '0.95'))
+CASCADE_AUDIT_RATE = float(os.getenv('CASCADE_AUDIT_RATE', '0.02'))
+
+# Interpreter configuration: fixed by environment, or benchmarked at startup by autotune.py
+# PRELOAD_MODEL loads (and tunes) at import, before serving; requests only reuse a cached choice
+PRELOAD_MODEL = os.getenv('PRELOAD_MODEL', 'true').lower() == 'true'
+AUTOTUNE = os.getenv('AUTOTUNE', 'off').lower()  # off | latency | throughput
+AUTOTUNE_CACHE_PATH = os.getenv('AUTOTUNE_CACHE_PATH', str(BASE_DIR / 'autotune.json'))
+AUTOTUNE_TARGET_P95_MS = float(os.getenv('AUTOTUNE_TARGET_P95_MS')) if os.getenv('AUTOTUNE_TARGET_P95_MS') else None
+AUTOTUNE_MAX_POOL = int(os.getenv('AUTOTUNE_MAX_POOL', '4'))
+AUTOTUNE_SECONDS = float(os.getenv('AUTOTUNE_SECONDS', '0.5'))
+# External delegate libraries benchmarked alongside the built-in options (comma-separated paths)
+AUTOTUNE_DELEGATES = [path.strip() for path in os.getenv('AUTOTUNE_DELEGATES', '').split(',') if path.strip()]
+INTERPRETER_THREADS = int(os.getenv('INTERPRETER_THREADS', '1'))
+INTERPRETER_POOL_SIZE = int(os.getenv('INTERPRETER_POOL_SIZE', '1'))
+# Batch sizes with a preallocated interpreter per pooled slot; with TTA on, 8 serves all views in one invoke
+INTERPRETER_BATCH_SIZES = [
+    int(size) for size in os.getenv('INTERPRETER_BATCH_SIZES', '1' if TTA_MODE == 'off' else '1,8').split(',')
+    if size.strip()
+]
+
+# Memory budget: an explicit MEMORY_BUDGET_MB, else the container's cgroup limit, else unlimited
+MEMORY_BUDGET_MB = os.getenv('MEMORY_BUDGET_MB')
+MEMORY_RETRY_AFTER = int(os.getenv('MEMORY_RETRY_AFTER', '5'))
+GRADCAM_MEMORY_MB = float(os.getenv('GRADCAM_MEMORY_MB', '250'))  # TensorFlow fallback dominates
+REPORT_MEMORY_MB = float(os.getenv('REPORT_MEMORY_MB', '40'))
+PREDICT_MEMORY_MB = float(os.getenv('PREDICT_MEMORY_MB', '30'))
+
+# Near-duplicate reuse: a signed-in user's re-upload within this many dHash bits of one of their
+# own recent studies skips inference. Off by default: distinct chest films can hash a few bits apart
+NEAR_DUPLICATE_ENABLED = os.getenv('NEAR_DUPLICATE_ENABLED', 'false').lower() == 'true'
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', '2'))
+NEAR_DUPLICATE_INDEX_SIZE = int(os.getenv('NEAR_DUPLICATE_INDEX_SIZE', '10000'))
+
+# Chat: local FAQ retrieval (knowledge/*.json) and/or Gemini
+CHAT_MODE = os.getenv('CHAT_MODE', 'gemini_first').lower()  # gemini_first | local_first | local_only
+KNOWLEDGE_DIR = os.getenv('KNOWLEDGE_DIR', str(BASE_DIR / 'knowledge'))
+KNOWLEDGE_INDEX_PATH = os.getenv('KNOWLEDGE_INDEX_PATH', str(BASE_DIR / 'knowledge_index.npz'))
+KB_MIN_CONFIDENCE = float(os.getenv('KB_MIN_CONFIDENCE', '0.35'))
+
+# Per-session chat context for signed-in users (token budgets are estimates, ~4 characters per token)
+CHAT_CONTEXT_ENABLED = os.getenv('CHAT_CONTEXT_ENABLED', 'true').lower() != 'false'
+CHAT_MAX_SESSIONS = int(os.getenv('CHAT_MAX_SESSIONS', '5000'))
+CHAT_HISTORY_TOKENS = int(os.getenv('CHAT_HISTORY_TOKENS', '600'))
+CHAT_SUMMARY_TOKENS = int(os.getenv('CHAT_SUMMARY_TOKENS', '200'))
+CHAT_MAX_TURNS = int(os.getenv('CHAT_MAX_TURNS', '12'))
+CHAT_SESSION_IDLE_SECONDS = int(os.getenv('CHAT_SESSION_IDLE_SECONDS', '3600'))
+
+# Grad-CAM overlays: 'inline' returns a base64 data URL, 'resource' an id served by /api/heatmaps/<id>
+HEATMAP_DELIVERY = os.getenv('HEATMAP_DELIVERY', 'inline').lower()
+HEATMAP_CACHE_MB = float(os.getenv('HEATMAP_CACHE_MB', '32'))
+
+# Opt-in request profiling: X-Profile: sample|cprofile plus X-Admin-Token, or a random sample of requests
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sample').lower()  # mode for sampled requests
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+PROFILE_MAX = int(os.getenv('PROFILE_MAX', '50'))
+
+# Shadow evaluation: a candidate model scored off the request path on a sample of predictions
+SHADOW_MODEL_PATH = os.getenv('SHADOW_MODEL_PATH', '')
+SHADOW_SAMPLE_RATE = float(os.getenv('SHADOW_SAMPLE_RATE', '0.1'))
+SHADOW_MAX_PENDING = int(os.getenv('SHADOW_MAX_PENDING', '32'))
+SHADOW_WINDOW = int(os.getenv('SHADOW_WINDOW', '1000'))
+SHADOW_THREADS = int(os.getenv('SHADOW_THREADS', '1'))
+
+# Drift monitoring: input/output histograms per tumbling window, compared with a reference window
+DRIFT_ENABLED = os.getenv('DRIFT_ENABLED', 'true').lower() == 'true'
+DRIFT_WINDOW_SECONDS = int(os.getenv('DRIFT_WINDOW_SECONDS', '3600'))
+DRIFT_MIN_SAMPLES = int(os.getenv('DRIFT_MIN_SAMPLES', '50'))
+DRIFT_THRESHOLD = float(os.getenv('DRIFT_THRESHOLD', '0.1'))  # Jensen-Shannon divergence, base 2
+DRIFT_HISTORY = int(os.getenv('DRIFT_HISTORY', '24'))
+DRIFT_REFERENCE_PATH = os.getenv('DRIFT_REFERENCE_PATH', str(BASE_DIR / 'drift_reference.npz'))
+
+# Pre-inference quality gate: non-radiographs and unusable images are rejected before the classifier
+QUALITY_GATE_ENABLED = os.getenv('QUALITY_GATE_ENABLED', 'true').lower() == 'true'
+QUALITY_GATE_MODEL = os.getenv('QUALITY_GATE_MODEL', '')  # optional tiny TFLite radiograph classifier
+QUALITY_GATE_MODEL_THRESHOLD = float(os.getenv('QUALITY_GATE_MODEL_THRESHOLD', '0.5'))
+QUALITY_GATE_MIN_SHARPNESS = float(os.getenv('QUALITY_GATE_MIN_SHARPNESS', str(quality_gate.DEFAULT_LIMITS['min_sharpness'])))
+
+# Audit log of predictions and report downloads, written by a background writer
+AUDIT_ENABLED = os.getenv('AUDIT_ENABLED', 'true').lower() == 'true'
+AUDIT_DIR = os.getenv('AUDIT_DIR', str(BASE_DIR / 'audit'))
+AUDIT_CAPACITY = int(os.getenv('AUDIT_CAPACITY', '10000'))
+AUDIT_POLICY = os.getenv('AUDIT_POLICY', 'drop_oldest')  # drop_oldest | drop_newest | reject
+AUDIT_SEGMENT_MB = float(os.getenv('AUDIT_SEGMENT_MB', '16'))
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '0.5'))  # seconds
+AUDIT_FSYNC = os.getenv('AUDIT_FSYNC', 'true').lower() == 'true'
+
+# Admission control in front of every endpoint that leases an interpreter: slots follow the pool size.
+# "explain" is Grad-CAM and similar-case follow-ups, served after signed-in predictions
+ADMISSION_QUEUE_LIMITS = {
+    "clinician": int(os.getenv('ADMISSION_QUEUE_CLINICIAN', '32')),
+    "explain": int(os.getenv('ADMISSION_QUEUE_EXPLAIN', '16')),
+    "anonymous": int(os.getenv('ADMISSION_QUEUE_ANONYMOUS', '16')),
+    "batch": int(os.getenv('ADMISSION_QUEUE_BATCH', '8'))
 }
+REQUEST_TIMEOUT_DEFAULT = float(os.getenv('REQUEST_TIMEOUT_DEFAULT', '30'))  # seconds
+REQUEST_TIMEOUT_MAX = float(os.getenv('REQUEST_TIMEOUT_MAX', '120'))
+
+# Simulated inference for load tests: real request path, mock_backend.MockInterpreter cost (see MOCK_* in mock_backend.py)
+MOCK_BACKEND = os.getenv('MOCK_BACKEND', 'false').lower() == 'true'
+
+near_duplicates = near_duplicate.NearDuplicateIndex(
+    NEAR_DUPLICATE_MAX_DISTANCE, NEAR_DUPLICATE_INDEX_SIZE
+) if NEAR_DUPLICATE_ENABLED else None
+
+try:
+    knowledge = knowledge_base.KnowledgeBase.from_directory(KNOWLEDGE_DIR, KNOWLEDGE_INDEX_PATH)
+    print(f"OK  Knowledge base loaded ({len(knowledge.entries)} entries)")
+except Exception as e:
+    knowledge = None
+    print(f"WARN  Knowledge base unavailable: {e}")
 
-# Global model
+chat_contexts = chat_context.ChatContextStore(
+    CHAT_MAX_SESSIONS, CHAT_HISTORY_TOKENS, CHAT_SUMMARY_TOKENS, CHAT_MAX_TURNS, CHAT_SESSION_IDLE_SECONDS
+) if CHAT_CONTEXT_ENABLED else None
+
+admission_control = admission.AdmissionController(INTERPRETER_POOL_SIZE, ADMISSION_QUEUE_LIMITS)
+
+governor = MemoryGovernor(
+    int(float(MEMORY_BUDGET_MB) * 2 ** 20) if MEMORY_BUDGET_MB else container_limit(),
+    retry_after=MEMORY_RETRY_AFTER
+)
+
+def _close_figures():
+    """Shrinker: drop any matplotlib figures left open by heatmap rendering"""
+    pyplot = sys.modules.get('matplotlib.pyplot')
+    if pyplot is not None and pyplot.get_fignums():
+        pyplot.close('all')
+        return "closed figures"
+    return None
+
+governor.register_shrinker('matplotlib', _close_figures)
+
+profiler = profiling.RequestProfiler(
+    profiling.ProfileStore(PROFILE_DIR, PROFILE_MAX) if ADMIN_TOKEN or PROFILE_SAMPLE_RATE > 0 else None,
+    ADMIN_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_MODE, PROFILE_INTERVAL_MS / 1000.0
+)
+
+heatmaps = heatmap_cache.HeatmapCache(int(HEATMAP_CACHE_MB * 2 ** 20))
+governor.register_shrinker('heatmaps', heatmaps.clear)
+
+# Global model (an InterpreterPool; lease an interpreter with model.acquire())
 model = None
 model_loaded = False
+model_digest = ''  # identifies the served weights in heatmap ids; set by load_model
+inference_tuning = None
+
+prediction_history = PredictionHistory(HISTORY_DB_PATH, CLASS_LABELS) if HISTORY_ENABLED else None
+screen_model = None
+screen_model_loaded = False
+cascade_policy = cascade.CascadePolicy(
+    CLASS_LABELS, CASCADE_ACCEPT_CLASSES, CASCADE_ACCEPT_CONFIDENCE, CASCADE_AUDIT_RATE
+) if CASCADE_ENABLED else None
+
+# Opened by load_model() at the width of the model's embedding output
+case_index = None
+
+def load_quality_model():
+    """The quality gate's optional tiny classifier; None when not configured or not loadable"""
+    if not QUALITY_GATE_MODEL:
+        return None
+    if not TFLITE_AVAILABLE or not os.path.exists(QUALITY_GATE_MODEL):
+        print(f"WARN  Quality gate model not found at {QUALITY_GATE_MODEL}; using image statistics only")
+        return None
+    try:
+        interpreter = tflite.Interpreter(model_path=QUALITY_GATE_MODEL, num_threads=1)
+        interpreter.allocate_tensors()
+        print("OK  Quality gate model loaded")
+        return InterpreterPool([interpreter], {"threads": 1})
+    except Exception as e:
+        print(f"ERR Error loading quality gate model: {e}")
+        return None
+
+quality = quality_gate.QualityGate(
+    {"min_sharpness": QUALITY_GATE_MIN_SHARPNESS}, load_quality_model(), QUALITY_GATE_MODEL_THRESHOLD
+) if QUALITY_GATE_ENABLED else None
+
+audit = audit_log.AuditLog(
+    AUDIT_DIR, AUDIT_CAPACITY, AUDIT_POLICY, flush_interval=AUDIT_FLUSH_INTERVAL,
+    segment_bytes=int(AUDIT_SEGMENT_MB * 2 ** 20), fsync=AUDIT_FSYNC
+) if AUDIT_ENABLED else None
+
+drift = drift_monitor.DriftMonitor(
+    CLASS_LABELS, DRIFT_WINDOW_SECONDS, DRIFT_MIN_SAMPLES, DRIFT_THRESHOLD,
+    history=DRIFT_HISTORY, reference_path=DRIFT_REFERENCE_PATH
+) if DRIFT_ENABLED else None
+
+def load_shadow_model():
+    """Candidate model pool for shadow evaluation; runs on the shadow worker thread"""
+    if not MOCK_BACKEND and not TFLITE_AVAILABLE:
+        raise RuntimeError("TFLite not available")
+    if not MOCK_BACKEND and not os.path.exists(SHADOW_MODEL_PATH):
+        raise FileNotFoundError(SHADOW_MODEL_PATH)
+    backend = mock_backend if MOCK_BACKEND else tflite
+    config = {"threads": SHADOW_THREADS, "delegate": "default", "pool_size": 1}
+    return autotune.build_pool(backend, SHADOW_MODEL_PATH, config)
+
+shadow_evaluator = shadow.ShadowEvaluator(
+    load_shadow_model, CLASS_LABELS, SHADOW_SAMPLE_RATE, os.path.basename(SHADOW_MODEL_PATH),
+    max_pending=SHADOW_MAX_PENDING, window=SHADOW_WINDOW
+) if SHADOW_MODEL_PATH else None
+
+def _shrink_pool():
+    """Shrinker: keep a single interpreter under memory pressure"""
+    released = model.shrink(1) if model is not None else 0
+    if released:
+        admission_control.set_slots(len(model))
+    return f"released {released} interpreter(s)" if released else None
+
+def open_case_index(loaded_model):
+    """Open the similar-case index at the model's embedding width; leaves it None when unusable"""
+    global case_index
+    if not CASE_INDEX_ENABLED:
+        return
+    with loaded_model.acquire() as interpreter:
+        _, embeddings = run_inference(interpreter, np.zeros((1,) + INPUT_SHAPE, dtype=np.float32), with_embeddings=True)
+    if embeddings is None:
+        print("WARN  Model exports no embeddings; similar-case search disabled")
+        return
+    try:
+        case_index = CaseIndex(
+            CASE_INDEX_DIR, embeddings.shape[-1], ivf_threshold=CASE_INDEX_IVF_THRESHOLD, nprobe=CASE_INDEX_NPROBE
+        )
+        print(f"OK  Case index opened ({case_index.count} cases, {case_index.dim}-d)")
+    except ValueError as e:
+        print(f"ERR Case index unusable: {e}; similar-case search disabled")
 
-def load_model():
-    """Load the TFLite model into an interpreter"""
-    global model, model_loaded
+def load_model(benchmark=False):
+    """
+    Load the TFLite model into an interpreter pool. Autotuning benchmarks only when
+    `benchmark` (the startup preload); on the request path it is a cache lookup.
+    """
+    global model, model_loaded, model_digest, inference_tuning
     
     if model_loaded:
         return model
     
+    if MOCK_BACKEND:
+        inference_tuning = {
+            "config": {"threads": INTERPRETER_THREADS, "delegate": "default", "pool_size": INTERPRETER_POOL_SIZE},
+            "source": "mock_backend"
+        }
+        model = autotune.build_pool(mock_backend, None, inference_tuning["config"], batch_sizes=INTERPRETER_BATCH_SIZES)
+        model_digest = 'mock_backend'
+        governor.register_shrinker('interpreter_pool', _shrink_pool)
+        admission_control.set_slots(len(model))
+        open_case_index(model)
+        model_loaded = True
+        print(f"WARN  MOCK_BACKEND enabled: simulated inference ({model.describe()})")
+        return model
+    
     if not TFLITE_AVAILABLE:
         print("WARN  TFLite not available. Using mock mode.")
         model_loaded = True
@@ -104,11 +379,29 @@ def load_model():
     
     print("Loading TFLite model...")
     try:
-        interpreter = tflite.Interpreter(model_path=str(tflite_path), num_threads=1)
-        interpreter.allocate_tensors()
-        model = interpreter
+        if AUTOTUNE in autotune.OBJECTIVES:
+            print(f"Autotuning interpreter configuration for {AUTOTUNE}...")
+            inference_tuning = autotune.tune(
+                tflite_path, tflite, AUTOTUNE,
+                cache_path=AUTOTUNE_CACHE_PATH,
+                max_pool=AUTOTUNE_MAX_POOL,
+                seconds_per_config=AUTOTUNE_SECONDS,
+                target_p95_ms=AUTOTUNE_TARGET_P95_MS,
+                external_delegates=AUTOTUNE_DELEGATES,
+                benchmark=benchmark
+            )
+        else:
+            inference_tuning = {
+                "config": {"threads": INTERPRETER_THREADS, "delegate": "default", "pool_size": INTERPRETER_POOL_SIZE},
+                "source": "environment"
+            }
+        model = autotune.build_pool(tflite, tflite_path, inference_tuning["config"], batch_sizes=INTERPRETER_BATCH_SIZES)
+        model_digest = autotune.model_digest(tflite_path)[:16]
+        governor.register_shrinker('interpreter_pool', _shrink_pool)
+        admission_control.set_slots(len(model))
+        open_case_index(model)
         model_loaded = True
-        print("OK  TFLite model loaded successfully!")
+        print(f"OK  TFLite model loaded successfully! ({model.describe()}, {inference_tuning['source']})")
         return model
     except Exception as e:
         print(f"ERR Error loading TFLite model: {e}")
@@ -116,20 +409,153 @@ def load_model():
         model_loaded = True
         return None
 
-def mock_predict():
-    """Generate mock prediction for testing"""
-    import random
-    class_idx = random.randint(0, 5)
-    confidence = random.uniform(0.70, 0.98)
-    return class_idx, confidence
-
-def preprocess_image(image_path):
-    """Preprocess image for TFLite inference using Pillow (no TensorFlow needed)"""
-    img = Image.open(image_path).convert('RGB')
-    img = img.resize((224, 224))
-    img_array = np.array(img, dtype=np.float32) / 255.0
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array
+def load_screen_model():
+    """Load the cascade's screening model; None disables the cascade"""
+    global screen_model, screen_model_loaded
+    
+    if screen_model_loaded:
+        return screen_model
+    screen_model_loaded = True
+    
+    if not TFLITE_AVAILABLE or not os.path.exists(CASCADE_SCREEN_MODEL):
+        print(f"WARN  Cascade screening model not found at {CASCADE_SCREEN_MODEL}; cascade disabled")
+        return None
+    
+    try:
+        interpreter = tflite.Interpreter(model_path=CASCADE_SCREEN_MODEL, num_threads=1)
+        interpreter.allocate_tensors()
+        if signature_keys(interpreter):
+            interpreter = SignatureModel({1: interpreter})
+        width = run_inference(interpreter, np.zeros((1,) + INPUT_SHAPE, dtype=np.float32)).shape[-1]
+        if width != len(CLASS_LABELS):
+            print(f"ERR Screening model has {width} outputs but CLASS_LABELS has {len(CLASS_LABELS)}; cascade disabled")
+            return None
+        screen_model = InterpreterPool([interpreter], {"threads": 1})
+        print("OK  Cascade screening model loaded")
+        return screen_model
+    except Exception as e:
+        print(f"ERR Error loading screening model: {e}")
+        return None
+
+def mock_predict(img_path):
+    """Generate a mock prediction for testing, seeded by the image bytes so repeats agree"""
+    with open(img_path, 'rb') as f:
+        probabilities = mock_backend.seeded_probabilities(f.read(), len(CLASS_LABELS))
+    class_idx = int(np.argmax(probabilities))
+    return class_idx, probabilities[class_idx], probabilities
+
+def predict_dicom(interpreter, image_path):
+    """Stream a DICOM study frame by frame into the interpreter's input buffer"""
+    header = dicom_io.read_header(image_path)
+    pixels = dicom_io.pixel_memmap(header)
+    frame_probabilities = []
+    frame_embeddings = []
+    try:
+        for index in range(header['NumberOfFrames']):
+            probs, embeddings = run_in_place(
+                interpreter, lambda buf: dicom_io.write_frame_into(header, pixels, index, buf), with_embeddings=True
+            )
+            frame_probabilities.append(probs[0])
+            if embeddings is not None:
+                frame_embeddings.append(embeddings[0])
+    finally:
+        del pixels
+    embedding = np.mean(frame_embeddings, axis=0) if frame_embeddings else None
+    return np.mean(frame_probabilities, axis=0), frame_probabilities, embedding
+
+def compact_prediction(response):
+    """
+    Compact response profile: class indices and probabilities as arrays in label-table order.
+    Clients resolve indices through GET /api/labels, keyed by labels_version.
+    """
+    prediction = response["prediction"]
+    probabilities = [prediction["all_predictions"][label] for label in CLASS_LABELS]
+    compact = {
+        "success": True,
+        "labels_version": LABELS_VERSION,
+        "class_index": CLASS_LABELS.index(prediction["class"]),
+        "ranking": np.argsort(probabilities)[::-1],
+        "probabilities": serialization.round_probabilities(probabilities),
+        "mode": response["mode"],
+        "study_id": response.get("study_id")
+    }
+    if "stage" in response:
+        compact["stage"] = response["stage"]
+    if "near_duplicate" in response:
+        compact["near_duplicate"] = response["near_duplicate"]
+    if "tta" in response:
+        tta_info = dict(response["tta"])
+        if "uncertainty" in tta_info:
+            uncertainty = dict(tta_info["uncertainty"])
+            uncertainty["std"] = serialization.round_probabilities([uncertainty["std"][label] for label in CLASS_LABELS])
+            tta_info["uncertainty"] = uncertainty
+        compact["tta"] = tta_info
+    if "frames" in response:
+        compact["frames"] = [
+            [CLASS_LABELS.index(frame["class"]), round(frame["confidence"], serialization.COMPACT_PRECISION)]
+            for frame in response["frames"]
+        ]
+    return compact
+
+def classify_upload(loaded_model, img_path, processed_img, tta_mode):
+    """
+    Run the model path for one upload: DICOM streaming when `processed_img` is None,
+    otherwise cascade screening, the full model and optional TTA.
+    Returns (probabilities, frame_probabilities, embedding, stage, tta_info, processed_img).
+    """
+    frame_probabilities = None
+    stage = None
+    if processed_img is not None:
+        # Cascade: the screening model answers confident cases before a DenseNet lease is taken.
+        # Screened cases carry no embedding (the screener's features live in another space),
+        # so they are not added to the similar-case index
+        screener = load_screen_model() if cascade_policy is not None else None
+        if screener is not None:
+            with screener.acquire() as screen_interpreter:
+                screen_probabilities = run_inference(screen_interpreter, processed_img)[0]
+            stage, audit = cascade_policy.decide(screen_probabilities)
+            if stage == cascade.STAGE_SCREEN:
+                return screen_probabilities, None, None, stage, None, processed_img
+    
+    with loaded_model.acquire() as interpreter:
+        if processed_img is None:
+            probabilities, frame_probabilities, embedding = predict_dicom(interpreter, img_path)
+        else:
+            start = time.perf_counter()
+            probabilities, embeddings = run_inference(interpreter, processed_img, with_embeddings=True)
+            g.primary_latency = time.perf_counter() - start
+            probabilities = probabilities[0]
+            embedding = embeddings[0] if embeddings is not None else None
+            if stage is not None:
+                cascade_policy.record_escalation(screen_probabilities, probabilities, audit=audit)
+    
+        # Optional test-time augmentation, requested per call or enabled globally
+        tta_info = None
+        single_image = frame_probabilities is None or len(frame_probabilities) == 1
+        if tta_mode in tta.TTA_MODES and tta_mode != 'off' and single_image:
+            g.deadline.check('test-time augmentation')
+            tta_info = {"mode": tta_mode, "applied": False}
+            if tta.should_apply(tta_mode, probabilities, TTA_MARGIN_THRESHOLD):
+                if processed_img is None:
+                    processed_img = preprocess_image(img_path)
+                probabilities, uncertainty, num_views = tta.predict_with_tta(
+                    interpreter, processed_img, method=TTA_AGGREGATION, base_probabilities=probabilities
+                )
+                tta_info.update({
+                    "applied": True,
+                    "views": num_views,
+                    "aggregation": TTA_AGGREGATION,
+                    "uncertainty": {
+                        "entropy": uncertainty["entropy"],
+                        "view_agreement": uncertainty["view_agreement"],
+                        "std": {
+                            CLASS_LABELS[i]: float(uncertainty["std"][i])
+                            for i in range(len(CLASS_LABELS))
+                        }
+                    }
+                })
+    
+    return probabilities, frame_probabilities, embedding, stage, tta_info, processed_img
 
 def sanitize_filename(filename):
     """Sanitize filename for cross-platform compatibility"""
@@ -165,6 +591,30 @@ def serve_static(filename):
         except:
             return jsonify({"error": f"File not found: {filename}"}), 404
 
+@app.errorhandler(admission.AdmissionRejected)
+def admission_rejected(error):
+    """Fast 429/503/504 answers from the admission layer"""
+    return jsonify(error.to_dict()), error.status, error.headers()
+
+@app.errorhandler(MemoryPressure)
+def memory_pressure(error):
+    """Refuse expensive work before the kernel OOM-kills the worker"""
+    return jsonify(error.to_dict()), 503, {"Retry-After": str(error.retry_after)}
+
+@app.errorhandler(audit_log.AuditBackpressure)
+def audit_backpressure(error):
+    """Under AUDIT_POLICY=reject, audited work waits until the audit writer catches up"""
+    return jsonify(error.to_dict()), 503, {"Retry-After": str(error.retry_after)}
+
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    """Structured error for bodies larger than MAX_CONTENT_LENGTH"""
+    return jsonify({
+        "success": False,
+        "error": f"File too large. Maximum size: {upload_guard.MAX_UPLOAD_SIZE / 1024 / 1024:.1f}MB",
+        "code": "FILE_TOO_LARGE"
+    }), 413
+
 # API Routes
 @app.route('/api/health', methods=['GET'])
 def health():
@@ -175,68 +625,241 @@ def health():
         "tensorflow_available": TF_AVAILABLE,
         "model_loaded": loaded_model is not None,
         "classes": CLASS_LABELS,
-        "mode": "real" if loaded_model else "mock",
+        "labels_version": LABELS_VERSION,
+        "mode": ("simulated" if MOCK_BACKEND else "real") if loaded_model else "mock",
+        "inference": None if loaded_model is None else {
+            **loaded_model.describe(),
+            "source": inference_tuning.get("source"),
+            "objective": inference_tuning.get("objective"),
+            "measured": inference_tuning.get("measured")
+        },
         "gemini_available": GEMINI_API_KEY is not None
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Runtime statistics for tuning (cascade, memory governor, admission queues, near-duplicates, chat)"""
+    return serialization.json_response({
+        "success": True,
+        "cascade": cascade_policy.stats() if cascade_policy is not None else None,
+        "memory": governor.stats(),
+        "admission": admission_control.stats(),
+        "near_duplicates": near_duplicates.stats() if near_duplicates is not None else None,
+        "knowledge_base": knowledge.stats() if knowledge is not None else None,
+        "chat": chat_contexts.stats() if chat_contexts is not None else None,
+        "heatmaps": heatmaps.stats(),
+        "shadow": shadow_evaluator.stats() if shadow_evaluator is not None else None,
+        "drift": drift.stats() if drift is not None else None,
+        "audit": audit.stats() if audit is not None else None,
+        "quality_gate": quality.stats() if quality is not None else None
+    })
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Stored request profiles, newest first (admin only)"""
+    if not profiler.is_admin(request.headers):
+        return jsonify({"success": False, "error": "Admin token required", "code": "FORBIDDEN"}), 403
+    if profiler.store is None:
+        return jsonify({"success": True, "profiles": []})
+    return jsonify({"success": True, "profiles": profiler.store.list()})
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """One profile file: <id>.folded (collapsed stacks), <id>.prof (pstats) or <id>.json (summary)"""
+    if not profiler.is_admin(request.headers):
+        return jsonify({"success": False, "error": "Admin token required", "code": "FORBIDDEN"}), 403
+    if profiler.store is None or profiler.store.path(name) is None:
+        return jsonify({"success": False, "error": "Unknown profile", "code": "UNKNOWN_PROFILE"}), 404
+    return send_from_directory(profiler.store.directory, name, as_attachment=True)
+
+@app.route('/api/admin/shadow', methods=['GET'])
+def shadow_report():
+    """Rolling comparison of the shadow candidate against the serving model (admin only)"""
+    if not profiler.is_admin(request.headers):
+        return jsonify({"success": False, "error": "Admin token required", "code": "FORBIDDEN"}), 403
+    if shadow_evaluator is None:
+        return jsonify({"success": False, "error": "Shadow evaluation is not configured (SHADOW_MODEL_PATH)", "code": "SHADOW_DISABLED"}), 404
+    return jsonify({"success": True, "shadow": shadow_evaluator.stats()})
+
+@app.route('/api/admin/drift', methods=['GET'])
+def drift_report():
+    """Drift summaries with per-feature divergence and raw histograms (admin only)"""
+    if not profiler.is_admin(request.headers):
+        return jsonify({"success": False, "error": "Admin token required", "code": "FORBIDDEN"}), 403
+    if drift is None:
+        return jsonify({"success": False, "error": "Drift monitoring is disabled", "code": "DRIFT_DISABLED"}), 404
+    return jsonify({"success": True, "drift": drift.stats(detail=True)})
+
+@app.route('/api/admin/drift/reference', methods=['POST'])
+def pin_drift_reference():
+    """Adopt the last closed window as the new drift reference (admin only)"""
+    if not profiler.is_admin(request.headers):
+        return jsonify({"success": False, "error": "Admin token required", "code": "FORBIDDEN"}), 403
+    if drift is None:
+        return jsonify({"success": False, "error": "Drift monitoring is disabled", "code": "DRIFT_DISABLED"}), 404
+    reference = drift.pin_reference()
+    if reference is None:
+        return jsonify({"success": False, "error": "No closed window to use as reference yet", "code": "NO_WINDOW"}), 409
+    return jsonify({"success": True, "reference": reference})
+
+@app.route('/api/labels', methods=['GET'])
+def labels():
+    """Label and description tables for the compact response profile; cacheable by version"""
+    etag = f'"{LABELS_VERSION}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    if etag in request.headers.get('If-None-Match', ''):
+        return "", 304, headers
+    return serialization.json_response({
+        "success": True,
+        "version": LABELS_VERSION,
+        "labels": CLASS_LABELS,
+        "descriptions": [CLASS_DESCRIPTIONS[label] for label in CLASS_LABELS]
+    }, headers=headers)
+
+def request_priority():
+    """Authenticated users are clinicians; anyone may downgrade to batch with X-Priority"""
+    if request.headers.get('X-Priority', '').lower() == 'batch':
+        return 'batch'
+    return 'clinician' if get_current_user() is not None else 'anonymous'
+
+def explain_priority():
+    """Heatmaps and similar cases follow up on a prediction; X-Priority: batch still downgrades"""
+    if request.headers.get('X-Priority', '').lower() == 'batch':
+        return 'batch'
+    return 'explain'
+
+def admin_opt_out(name):
+    """True when `name`=false turns off a per-request safeguard; only honoured with X-Admin-Token"""
+    return request.values.get(name, 'true').lower() == 'false' and profiler.is_admin(request.headers)
+
+def request_deadline():
+    g.deadline = admission.deadline_from_headers(request.headers, REQUEST_TIMEOUT_DEFAULT, REQUEST_TIMEOUT_MAX)
+    return g.deadline
+
 @app.route('/api/predict', methods=['POST'])
+@profiler.guard('predict', lambda: request.headers)
+@admission_control.guard(request_priority, request_deadline)
+@governor.guard('predict', PREDICT_MEMORY_MB)
 def predict():
     """
     Endpoint to receive an image and return AI-generated diagnosis
     """
     print("DEBUG: /api/predict endpoint called")
+    if audit is not None:
+        audit.check_capacity()
     if "image" not in request.files:
         print("DEBUG: No image in request files")
-        return jsonify({"success": False, "error": "Please upload a medical image (X-ray, MRI, CT scan) to get a diagnosis."}), 400
+        return jsonify({"success": False, "error": "Please upload a medical image (X-ray, MRI, CT scan) to get a diagnosis.", "code": "NO_IMAGE"}), 400
     
     file = request.files["image"]
     print(f"DEBUG: Received file: {file.filename}")
     
-    # Sanitize filename
+    # Validate format and dimensions from the header before saving or decoding
+    try:
+        upload_info = upload_guard.admit_upload(file)
+    except upload_guard.UploadRejected as e:
+        print(f"DEBUG: Upload rejected: {e.code}")
+        return jsonify(e.to_dict()), e.status
+    print(f"DEBUG: Admitted {upload_info['format']} {upload_info['width']}x{upload_info['height']}")
+    
+    # Sanitize filename; the study id keeps concurrent uploads with the same name apart on disk
     safe_filename = sanitize_filename(file.filename)
-    img_path = os.path.join(UPLOADS_DIR, safe_filename)
+    study_id = uuid.uuid4().hex
+    img_path = os.path.join(UPLOADS_DIR, f"{study_id}_{safe_filename}")
     file.save(img_path)
+    processed_img = None
 
     try:
         loaded_model = load_model()
         print(f"DEBUG: Processing image. Model loaded? {loaded_model is not None}")
         
-        if TFLITE_AVAILABLE and loaded_model is not None:
-            # Use TFLite model prediction
-            processed_img = preprocess_image(img_path)
-            
-            input_details = loaded_model.get_input_details()
-            output_details = loaded_model.get_output_details()
+        if loaded_model is not None:
+            # Use TFLite model prediction, unless the client has already given up
+            g.deadline.check('inference')
+            tta_mode = request.values.get('tta', TTA_MODE).lower()
+            if tta_mode in ('1', 'true'):
+                tta_mode = 'on'
             
-            # Handle float16 quantized models
-            input_dtype = input_details[0]['dtype']
-            if input_dtype == np.float16:
-                processed_img = processed_img.astype(np.float16)
+            # A near-duplicate of the uploader's own recent study (re-exported, recompressed, resized)
+            # reuses its result; anonymous uploads are never matched or stored
+            uploader = get_current_user()
+            image_hash = None
+            duplicate = None
+            if not dicom_io.is_dicom(img_path):
+                processed_img = preprocess_image(img_path)
+                # Selfies, screenshots and documents stop here instead of costing a full model pass
+                if quality is not None and not admin_opt_out('quality_gate'):
+                    quality.check(processed_img, upload_info['width'], upload_info['height'])
+                if near_duplicates is not None and uploader is not None and not admin_opt_out('dedupe'):
+                    image_hash = near_duplicate.dhash(processed_img[0])
+                    duplicate = near_duplicates.lookup(image_hash, owner=uploader['id'])
+                    if duplicate is not None and tta_mode == 'on' and not duplicate[0]["response"].get("tta", {}).get("applied"):
+                        duplicate = None  # the stored result lacks the TTA this client asked for
             
-            loaded_model.set_tensor(input_details[0]['index'], processed_img)
-            loaded_model.invoke()
-            prediction = loaded_model.get_tensor(output_details[0]['index'])
+            if duplicate is not None:
+                stored, distance = duplicate
+                response = {
+                    **stored["response"],
+                    "filename": safe_filename,
+                    "near_duplicate": {"study_id": stored["study_id"], "distance": distance}
+                }
+                class_idx = CLASS_LABELS.index(response["prediction"]["class"])
+                confidence = response["prediction"]["confidence"]
+            else:
+                probabilities, frame_probabilities, embedding, stage, tta_info, processed_img = classify_upload(
+                    loaded_model, img_path, processed_img, tta_mode
+                )
+                
+                class_idx = int(np.argmax(probabilities))
+                confidence = float(probabilities[class_idx])
             
-            class_idx = np.argmax(prediction[0])
-            confidence = float(np.max(prediction[0]))
+                response = {
+                    "success": True,
+                    "prediction": {
+                        "class": CLASS_LABELS[class_idx],
+                        "confidence": confidence,
+                        "description": CLASS_DESCRIPTIONS[CLASS_LABELS[class_idx]],
+                        "all_predictions": {
+                            CLASS_LABELS[i]: float(probabilities[i])
+                            for i in range(len(CLASS_LABELS))
+                        }
+                    },
+                    "mode": "simulated" if MOCK_BACKEND else "real",
+                    "filename": safe_filename
+                }
+                if tta_info is not None:
+                    response["tta"] = tta_info
+                if stage is not None:
+                    response["stage"] = stage
+                if case_index is not None and embedding is not None:
+                    case_index.add(study_id, embedding, class_idx, owner=uploader['id'] if uploader else '')
+                if frame_probabilities is not None and len(frame_probabilities) > 1:
+                    response["frames"] = [
+                        {
+                            "frame": i,
+                            "class": CLASS_LABELS[int(np.argmax(probs))],
+                            "confidence": float(np.max(probs))
+                        }
+                        for i, probs in enumerate(frame_probabilities)
+                    ]
+                if image_hash is not None:
+                    near_duplicates.add(image_hash, {"study_id": study_id, "response": dict(response)},
+                                        owner=uploader['id'])
+                # Shadow only single-pass full-model answers, so both models see the same input the same way
+                primary_latency = g.get('primary_latency')
+                tta_applied = tta_info is not None and tta_info["applied"]
+                if shadow_evaluator is not None and primary_latency is not None and not tta_applied \
+                        and shadow_evaluator.should_sample():
+                    shadow_evaluator.submit(processed_img, probabilities, primary_latency)
             
-            response = {
-                "success": True,
-                "prediction": {
-                    "class": CLASS_LABELS[class_idx],
-                    "confidence": confidence,
-                    "description": CLASS_DESCRIPTIONS[CLASS_LABELS[class_idx]],
-                    "all_predictions": {
-                        CLASS_LABELS[i]: float(prediction[0][i])
-                        for i in range(len(CLASS_LABELS))
-                    }
-                },
-                "mode": "real",
-                "filename": safe_filename
-            }
+            if drift is not None:
+                drift.observe(
+                    processed_img, upload_info['width'], upload_info['height'],
+                    [response["prediction"]["all_predictions"][label] for label in CLASS_LABELS]
+                )
         else:
             # Mock prediction for testing
-            class_idx, confidence = mock_predict()
+            class_idx, confidence, probabilities = mock_predict(img_path)
             response = {
                 "success": True,
                 "prediction": {
@@ -244,7 +867,7 @@ def predict():
                     "confidence": confidence,
                     "description": CLASS_DESCRIPTIONS[CLASS_LABELS[class_idx]],
                     "all_predictions": {
-                        CLASS_LABELS[i]: random.uniform(0, 1)
+                        CLASS_LABELS[i]: probabilities[i]
                         for i in range(len(CLASS_LABELS))
                     }
                 },
@@ -252,8 +875,49 @@ def predict():
                 "filename": safe_filename
             }
         
-        return jsonify(response)
+        response["study_id"] = study_id
+        user = get_current_user()
+        if user is not None and chat_contexts is not None:
+            chat_contexts.set_prediction(auth_token(), response["prediction"])
+        if user is not None and prediction_history is not None:
+            thumbnail = None
+            if processed_img is not None:
+                thumbnail = np.clip(processed_img[0] * 255, 0, 255).astype(np.uint8)
+            prediction_history.record(
+                study_id,
+                user['id'],
+                class_idx,
+                confidence,
+                [response["prediction"]["all_predictions"][label] for label in CLASS_LABELS],
+                response["mode"],
+                filename=safe_filename,
+                thumbnail=thumbnail
+            )
+        if audit is not None:
+            audit.record(
+                'predict',
+                study_id=study_id,
+                user_id=user['id'] if user is not None else None,
+                client=request.remote_addr,
+                filename=safe_filename,
+                predicted_class=response["prediction"]["class"],
+                confidence=round(float(response["prediction"]["confidence"]), 5),
+                mode=response["mode"],
+                stage=response.get("stage"),
+                tta=bool(response.get("tta", {}).get("applied")),
+                near_duplicate_of=response.get("near_duplicate", {}).get("study_id"),
+                labels_version=LABELS_VERSION
+            )
+        
+        if serialization.wants_compact(request):
+            return serialization.json_response(compact_prediction(response), headers={"Vary": "Accept"})
+        return serialization.json_response(response, headers={"Vary": "Accept"})
     
+    except admission.AdmissionRejected:
+        raise
+    except quality_gate.QualityRejected as e:
+        print(f"DEBUG: Quality gate rejected the image: {e.reason['check']}")
+        return jsonify(e.to_dict()), e.status
     except Exception as e:
         print(f"Error in /api/predict: {e}")
         return jsonify({
@@ -283,6 +947,24 @@ def generate_token():
     import uuid
     return str(uuid.uuid4())
 
+def auth_token():
+    """Return the request's Bearer token if it is a live session, or None"""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    token = auth_header[7:]
+    return token if token in tokens_db else None
+
+def get_current_user():
+    """Return the user for the request's Bearer token, or None"""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    token_data = tokens_db.get(auth_header[7:])
+    if not token_data:
+        return None
+    return users_db.get(token_data['email'])
+
 @app.route('/api/auth/signup', methods=['POST'])
 def signup():
     """User registration endpoint"""
@@ -374,6 +1056,8 @@ def logout():
             token = auth_header[7:]
             if token in tokens_db:
                 del tokens_db[token]
+            if chat_contexts is not None:
+                chat_contexts.drop(token)
         
         return jsonify({"success": True, "message": "Logged out successfully"}), 200
     except Exception as e:
@@ -470,6 +1154,172 @@ def google_login():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# Prediction history endpoints
+@app.route('/api/history', methods=['GET'])
+def prediction_history_list():
+    """Paginated prediction history for the authenticated user (newest first)"""
+    user = get_current_user()
+    if user is None:
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    if prediction_history is None:
+        return jsonify({"success": False, "error": "Prediction history is disabled"}), 503
+    
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), HISTORY_PAGE_SIZE_MAX)
+        class_name = request.args.get('class')
+        class_idx = None
+        if class_name:
+            if class_name not in CLASS_LABELS:
+                return jsonify({"success": False, "error": f"Unknown class: {class_name}"}), 400
+            class_idx = CLASS_LABELS.index(class_name)
+        records, next_cursor = prediction_history.list(
+            user['id'], limit=limit, cursor=request.args.get('cursor'), class_idx=class_idx
+        )
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid limit or cursor"}), 400
+    
+    return serialization.json_response({
+        "success": True,
+        "predictions": records,
+        "next_cursor": next_cursor
+    })
+
+@app.route('/api/history/summary', methods=['GET'])
+def prediction_history_summary():
+    """Per-class prediction counts for the authenticated user"""
+    user = get_current_user()
+    if user is None:
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    if prediction_history is None:
+        return jsonify({"success": False, "error": "Prediction history is disabled"}), 503
+    
+    counts = prediction_history.class_counts(user['id'])
+    return jsonify({
+        "success": True,
+        "total": sum(counts.values()),
+        "class_counts": counts
+    })
+
+@app.route('/api/history/thumbnails/<thumbnail_hash>', methods=['GET'])
+def prediction_history_thumbnail(thumbnail_hash):
+    """Serve a stored study thumbnail; content-addressed, so it can be cached forever"""
+    user = get_current_user()
+    if user is None:
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    if prediction_history is None:
+        return jsonify({"success": False, "error": "Prediction history is disabled"}), 503
+    
+    data = prediction_history.thumbnail(user['id'], thumbnail_hash)
+    if data is None:
+        return jsonify({"success": False, "error": "Thumbnail not found"}), 404
+    
+    return Response(data, mimetype='image/jpeg', headers={
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "ETag": f'"{thumbnail_hash}"'
+    })
+
+
+# Similar-case search
+@app.route('/api/similar', methods=['POST'])
+@admission_control.guard(explain_priority, request_deadline)
+def similar_cases():
+    """
+    Find stored studies with the most similar embeddings among the caller's own cases
+    (all cases with X-Admin-Token). Query by uploaded image or by a previous study_id;
+    optionally restrict to a class and to clinically confirmed cases,
+    e.g. "5 similar confirmed Tuberculosis cases".
+    """
+    user = get_current_user()
+    is_admin = profiler.is_admin(request.headers)
+    if user is None and not is_admin:
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    owner = None if is_admin else user['id']
+    
+    loaded_model = load_model()
+    if case_index is None:
+        return jsonify({"success": False, "error": "Similar-case search is disabled", "code": "CASE_INDEX_DISABLED"}), 503
+    
+    params = request.get_json(silent=True) or request.values
+    try:
+        k = min(max(int(params.get('k', 5)), 1), SIMILAR_CASES_MAX)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "k must be an integer"}), 400
+    class_name = params.get('class')
+    if class_name and class_name not in CLASS_LABELS:
+        return jsonify({"success": False, "error": f"Unknown class: {class_name}"}), 400
+    class_idx = CLASS_LABELS.index(class_name) if class_name else None
+    confirmed_only = str(params.get('confirmed', 'false')).lower() in ('1', 'true', 'yes')
+    
+    study_id = params.get('study_id')
+    if study_id:
+        # Another user's study is reported exactly like a missing one
+        query = case_index.embedding_for(study_id)
+        if query is None or (owner is not None and case_index.owner_of(study_id) != owner):
+            return jsonify({"success": False, "error": "Unknown study_id", "code": "UNKNOWN_STUDY"}), 404
+    elif "image" in request.files:
+        file = request.files["image"]
+        try:
+            upload_guard.admit_upload(file)
+        except upload_guard.UploadRejected as e:
+            return jsonify(e.to_dict()), e.status
+        
+        if loaded_model is None:
+            return jsonify({"success": False, "error": "Model not available", "code": "MODEL_UNAVAILABLE"}), 503
+        img_path = os.path.join(UPLOADS_DIR, f"{uuid.uuid4().hex}_{sanitize_filename(file.filename)}")
+        file.save(img_path)
+        try:
+            with loaded_model.acquire() as interpreter:
+                _, embeddings = run_inference(interpreter, preprocess_image(img_path), with_embeddings=True)
+        finally:
+            if os.path.exists(img_path):
+                os.remove(img_path)
+        if embeddings is None:
+            return jsonify({
+                "success": False,
+                "error": "The deployed model does not export embeddings; reconvert it with convert_to_tflite.py",
+                "code": "NO_EMBEDDINGS"
+            }), 503
+        query = embeddings[0]
+    else:
+        return jsonify({"success": False, "error": "Provide an image or a study_id", "code": "NO_QUERY"}), 400
+    
+    matches = case_index.search(
+        query, k=k, class_idx=class_idx, confirmed_only=confirmed_only, exclude=study_id, owner=owner
+    )
+    for match in matches:
+        match["predicted_class"] = CLASS_LABELS[match["predicted_class"]]
+        if match["confirmed_class"] is not None:
+            match["confirmed_class"] = CLASS_LABELS[match["confirmed_class"]]
+    
+    return serialization.json_response({
+        "success": True,
+        "matches": matches,
+        "index": case_index.stats()
+    })
+
+@app.route('/api/cases/<study_id>/confirm', methods=['POST'])
+def confirm_case(study_id):
+    """Record the clinically confirmed diagnosis of one of the caller's studies (any study with X-Admin-Token)"""
+    user = get_current_user()
+    is_admin = profiler.is_admin(request.headers)
+    if user is None and not is_admin:
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    load_model()
+    if case_index is None:
+        return jsonify({"success": False, "error": "Similar-case search is disabled", "code": "CASE_INDEX_DISABLED"}), 503
+    
+    data = request.get_json(silent=True) or {}
+    class_name = data.get('class')
+    if class_name not in CLASS_LABELS:
+        return jsonify({"success": False, "error": f"Unknown class: {class_name}"}), 400
+    if not is_admin and case_index.owner_of(study_id) != user['id']:
+        return jsonify({"success": False, "error": "Unknown study_id", "code": "UNKNOWN_STUDY"}), 404
+    if not case_index.confirm(study_id, CLASS_LABELS.index(class_name)):
+        return jsonify({"success": False, "error": "Unknown study_id", "code": "UNKNOWN_STUDY"}), 404
+    
+    return jsonify({"success": True, "study_id": study_id, "confirmed_class": class_name})
+
+
 # Chat endpoint
 @app.route("/api/chat", methods=["POST"])
 def chat():
@@ -481,41 +1331,63 @@ def chat():
         if not user_message:
             return jsonify({"success": False, "error": "Message is required"}), 400
         
-        # Try to use Gemini if available
-        if GEMINI_API_KEY:
+        # Signed-in users get a conversation: history, summary of older turns and their latest prediction
+        token = auth_token() if chat_contexts is not None else None
+        session = chat_contexts.session(token) if token is not None else None
+        
+        hits = knowledge.search(user_message, k=1) if knowledge is not None else []
+        hit = hits[0] if hits else None
+        confident = hit is not None and hit["confidence"] >= KB_MIN_CONFIDENCE
+        
+        # Answer locally when configured to and retrieval is confident, otherwise try Gemini first
+        if GEMINI_API_KEY and CHAT_MODE != 'local_only' and not (CHAT_MODE == 'local_first' and confident):
             try:
                 model = genai.GenerativeModel('gemini-2.5-flash')
-                response = model.generate_content(user_message)
+                prompt = user_message
+                if session is not None:
+                    latest = None
+                    if session.prediction is None and prediction_history is not None:
+                        user = get_current_user()
+                        records = prediction_history.list(user['id'], limit=1)[0] if user else []
+                        latest = records[0] if records else None
+                    prompt, uncompressed = chat_contexts.build_prompt(session, user_message, latest)
+                start = time.perf_counter()
+                response = model.generate_content(prompt)
                 ai_response = response.text
+                if session is not None:
+                    usage = getattr(response, 'usage_metadata', None)
+                    chat_contexts.record_turn(
+                        session, user_message, ai_response, time.perf_counter() - start, prompt, uncompressed,
+                        (usage.prompt_token_count, usage.candidates_token_count) if usage else None
+                    )
                 return jsonify({
                     "success": True,
                     "response": ai_response,
-                    "message": user_message
+                    "message": user_message,
+                    "source": "gemini"
                 }), 200
             except Exception as e:
                 print(f"Gemini API error: {e}")
-                # Fall back to keyword-based responses
-        
-        # Fallback: keyword-based responses
-        message_lower = user_message.lower()
-        
-        if any(word in message_lower for word in ['covid', 'coronavirus']):
-            response = "COVID-19 is a viral infection. If you test positive, consult your healthcare provider. Wear masks, maintain distance, and follow local health guidelines."
-        elif any(word in message_lower for word in ['pneumonia', 'lung']):
-            response = "Pneumonia is a lung infection that can be serious. Seek medical attention if you experience persistent cough, fever, or difficulty breathing."
-        elif any(word in message_lower for word in ['fever', 'temperature']):
-            response = "A fever is your body's natural response to infection. Rest, stay hydrated, and monitor your temperature. Seek medical help if fever persists above 103°F (39.4°C)."
-        elif any(word in message_lower for word in ['vaccine', 'vaccination']):
-            response = "Vaccines are safe and effective. Consult your doctor about which vaccines are appropriate for you."
-        elif any(word in message_lower for word in ['mask', 'prevention']):
-            response = "Prevention measures include: wearing masks in crowded areas, washing hands frequently, maintaining distance from sick people, and staying updated with vaccinations."
-        else:
-            response = "I'm an AI health assistant. Please ask about symptoms, prevention, or common health conditions. For serious concerns, always consult a healthcare professional."
+                # Fall back to the local knowledge base
+        
+        # Without a Gemini answer any match beats the generic reply; the confidence is reported either way
+        if hit is not None:
+            if session is not None:
+                chat_contexts.remember(session, user_message, hit["answer"])
+            return jsonify({
+                "success": True,
+                "response": hit["answer"],
+                "message": user_message,
+                "source": "knowledge_base",
+                "topic": hit["topic"],
+                "confidence": round(hit["confidence"], 3)
+            }), 200
         
         return jsonify({
             "success": True,
-            "response": response,
-            "message": user_message
+            "response": "I'm an AI health assistant. Please ask about symptoms, prevention, or common health conditions. For serious concerns, always consult a healthcare professional.",
+            "message": user_message,
+            "source": "fallback"
         }), 200
     except Exception as e:
         return jsonify({
@@ -523,25 +1395,65 @@ def chat():
             "error": str(e)
         }), 500
 
+def heatmap_response(key, class_name, png, cached):
+    """Grad-CAM JSON in the requested delivery mode (?delivery=inline|resource)"""
+    response = {
+        "success": True,
+        "heatmap_id": key,
+        "heatmap_url": f"/api/heatmaps/{key}",
+        "predicted_class": class_name,
+        "cached": cached
+    }
+    if request.args.get('delivery', HEATMAP_DELIVERY).lower() != 'resource':
+        import base64
+        response["heatmap"] = f"data:image/png;base64,{base64.b64encode(png).decode('utf-8')}"
+    return jsonify(response)
+
 # Grad-CAM Heatmap Endpoint (Feature 2)
+def render_heatmap(key, img_path, heatmap, class_idx):
+    """Superimpose the jet-coloured heatmap on the image and cache the result"""
+    overlay = heatmap_cache.render_overlay(Image.open(img_path), heatmap)
+    class_name = CLASS_LABELS[class_idx]
+    png = heatmaps.put(key, overlay, class_name)
+    return heatmap_response(key, class_name, png, cached=False)
+
 @app.route('/api/gradcam', methods=['POST'])
+@admission_control.guard(explain_priority, request_deadline)
+@governor.guard('heatmap', GRADCAM_MEMORY_MB)
 def gradcam():
     """Generate Grad-CAM heatmap for the uploaded image"""
     if "image" not in request.files:
-        return jsonify({"success": False, "error": "No image provided"}), 400
+        return jsonify({"success": False, "error": "No image provided", "code": "NO_IMAGE"}), 400
     
     file = request.files["image"]
+    try:
+        upload_guard.admit_upload(file)
+    except upload_guard.UploadRejected as e:
+        return jsonify(e.to_dict()), e.status
+    
     safe_filename = sanitize_filename(file.filename)
-    img_path = os.path.join(UPLOADS_DIR, safe_filename)
+    img_path = os.path.join(UPLOADS_DIR, f"{uuid.uuid4().hex}_{safe_filename}")
     file.save(img_path)
     
     try:
+        # Overlays are keyed by the upload bytes and the served model: a refresh or report re-uses
+        # the rendered image, while a model swap gets new ids instead of stale immutable URLs
         loaded_model = load_model()
+        with open(img_path, 'rb') as f:
+            key = heatmap_cache.heatmap_id(f.read(), f"{LABELS_VERSION}|{model_digest}")
+        cached = heatmaps.get(key)
+        if cached is not None:
+            return heatmap_response(key, cached["predicted_class"], cached["variants"]["png"][0], cached=True)
+        
+        if loaded_model is not None and SIGNATURE_CAM in loaded_model.signatures:
+            # The exported model computes Grad-CAM in-graph: no TensorFlow needed at serve time
+            with loaded_model.acquire() as interpreter:
+                probabilities, cams = interpreter.cam(preprocess_image(img_path)[:1])
+            return render_heatmap(key, img_path, cams[0], int(np.argmax(probabilities[0])))
         if not TF_AVAILABLE or loaded_model is None:
             return jsonify({"success": False, "error": "Model not available for heatmap generation"}), 503
         
-        import base64
-        from io import BytesIO
+        import tensorflow as tf
         
         # Preprocess image
         processed_img = preprocess_image(img_path)
@@ -574,40 +1486,7 @@ def gradcam():
         heatmap = conv_outputs @ pooled_grads[..., tf.newaxis]
         heatmap = tf.squeeze(heatmap)
         heatmap = tf.maximum(heatmap, 0) / (tf.math.reduce_max(heatmap) + 1e-8)
-        heatmap = heatmap.numpy()
-        
-        # Resize heatmap to image size and create overlay
-        from PIL import Image as PILImage
-        import matplotlib
-        matplotlib.use('Agg')
-        import matplotlib.pyplot as plt
-        import matplotlib.cm as cm
-        
-        original_img = PILImage.open(img_path).resize((224, 224))
-        
-        # Apply colormap to heatmap
-        heatmap_resized = np.uint8(255 * heatmap)
-        jet = cm.get_cmap('jet')
-        jet_colors = jet(np.arange(256))[:, :3]
-        jet_heatmap = jet_colors[heatmap_resized]
-        
-        # Resize heatmap to match image
-        jet_heatmap_img = PILImage.fromarray(np.uint8(jet_heatmap * 255)).resize((224, 224))
-        
-        # Superimpose
-        superimposed = PILImage.blend(original_img.convert('RGB'), jet_heatmap_img.convert('RGB'), alpha=0.4)
-        
-        # Convert to base64
-        buffer = BytesIO()
-        superimposed.save(buffer, format='PNG')
-        buffer.seek(0)
-        heatmap_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        return jsonify({
-            "success": True,
-            "heatmap": f"data:image/png;base64,{heatmap_base64}",
-            "predicted_class": CLASS_LABELS[int(predicted_class)]
-        })
+        return render_heatmap(key, img_path, heatmap.numpy(), int(predicted_class))
     except Exception as e:
         print(f"Grad-CAM error: {e}")
         import traceback
@@ -621,10 +1500,37 @@ def gradcam():
                 pass
 
 
+@app.route('/api/heatmaps/<heatmap_id>', methods=['GET'])
+def heatmap_image(heatmap_id):
+    """
+    Rendered overlay as raw bytes. PNG by default, WebP when the client lists image/webp
+    in Accept (or asks with ?format=). Content-hash ETag, conditional GET and Range supported.
+    """
+    fmt = request.args.get('format', '').lower()
+    if fmt not in heatmap_cache.MIME_TYPES:
+        accepts_webp = any(value == 'image/webp' for value in request.accept_mimetypes.values())
+        fmt = 'webp' if accepts_webp and heatmap_cache.WEBP_AVAILABLE else 'png'
+    variant = heatmaps.variant(heatmap_id, fmt)
+    if variant is None:
+        return jsonify({"success": False, "error": "Heatmap not found or expired; request it again from /api/gradcam", "code": "HEATMAP_NOT_FOUND"}), 404
+    
+    data, etag = variant
+    response = Response(data, mimetype=heatmap_cache.MIME_TYPES[fmt])
+    response.set_etag(etag)
+    # The id names the input image, so the bytes behind a URL never change while cached
+    response.headers["Cache-Control"] = "private, max-age=86400, immutable"
+    response.vary.add("Accept")
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+
 # PDF Report Endpoint (Feature 3)
 @app.route('/api/report', methods=['POST'])
+@profiler.guard('report', lambda: request.headers)
+@governor.guard('report', REPORT_MEMORY_MB)
 def generate_report():
     """Generate a PDF diagnosis report"""
+    if audit is not None:
+        audit.check_capacity()
     try:
         data = request.get_json()
         prediction = data.get('prediction', {})
@@ -640,6 +1546,7 @@ def generate_report():
             from reportlab.lib.units import inch
             from reportlab.lib import colors
             from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+            from reportlab.platypus import Image as ReportImage
             from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
         except ImportError:
             return jsonify({"success": False, "error": "reportlab not installed. Run: pip install reportlab"}), 500
@@ -712,6 +1619,14 @@ def generate_report():
             story.append(breakdown_table)
             story.append(Spacer(1, 30))
         
+        # Grad-CAM overlay, when the client passes the id of one still in the cache
+        heatmap = heatmaps.get(data.get('heatmap_id')) if data.get('heatmap_id') else None
+        if heatmap is not None:
+            story.append(Paragraph("Grad-CAM Heatmap", header_style))
+            story.append(Spacer(1, 10))
+            story.append(ReportImage(BytesIO(heatmap["variants"]["png"][0]), width=3*inch, height=3*inch))
+            story.append(Spacer(1, 30))
+        
         # Disclaimer
         disclaimer_style = ParagraphStyle('disclaimer', parent=styles['Normal'], fontSize=9, textColor=colors.gray)
         story.append(Paragraph(
@@ -725,6 +1640,18 @@ def generate_report():
         
         doc.build(story)
         buffer.seek(0)
+        if audit is not None:
+            user = get_current_user()
+            audit.record(
+                'report',
+                study_id=data.get('study_id'),
+                user_id=user['id'] if user is not None else None,
+                client=request.remote_addr,
+                predicted_class=prediction.get('class'),
+                confidence=prediction.get('confidence'),
+                heatmap_id=data.get('heatmap_id') if heatmap is not None else None,
+                bytes=buffer.getbuffer().nbytes
+            )
         
         from flask import send_file
         return send_file(
@@ -740,6 +1667,14 @@ def generate_report():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# Pay model loading and autotuning before the first request, not inside its deadline
+# (gunicorn workers import this module before serving, as does `python app.py`)
+if PRELOAD_MODEL:
+    load_model(benchmark=True)
+    if cascade_policy is not None:
+        load_screen_model()
+
+
 if __name__ == "__main__":
     # Ensure uploads directory exists
     os.makedirs("uploads", exist_ok=True)
@@ -747,10 +1682,18 @@ if __name__ == "__main__":
     print("Starting Medical AI Bot...")
     print("Frontend will be available at: http://localhost:5003")
     print("API endpoints:")
-    print("   - POST /api/predict - Upload medical images for diagnosis")
-    print("   - POST /api/gradcam - Generate Grad-CAM heatmap")
+    print("   - POST /api/predict - Upload medical images for diagnosis (?profile=compact)")
+    print("   - GET  /api/labels - Label table for compact responses")
+    print("   - GET  /api/metrics - Runtime metrics (cascade, memory governor, admission)")
+    print("   - POST /api/gradcam - Generate Grad-CAM heatmap (?delivery=resource)")
+    print("   - GET  /api/heatmaps/<id> - Rendered heatmap (PNG/WebP, ETag, Range)")
     print("   - POST /api/report - Download PDF report")
     print("   - POST /api/chat - Chat with the AI")
+    print("   - GET  /api/admin/profiles - Request profiles (X-Admin-Token)")
+    print("   - GET  /api/admin/shadow - Shadow model comparison (X-Admin-Token)")
+    print("   - GET  /api/admin/drift - Input/output drift (X-Admin-Token)")
+    print("   - GET  /api/history - Paginated prediction history")
+    print("   - POST /api/similar - Similar-case search over your own studies")
     print("   - POST /api/auth/signup - Register new user")
     print("   - POST /api/auth/login - Login user")
     app.run(debug=True, host='0.0.0.0', port=5003)
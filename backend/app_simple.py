@@ -2,7 +2,6 @@
 # app_simple.py - Simplified Flask backend without TensorFlow (for now)
 import os
 import sys
-import random
 import json
 import hashlib
 import uuid
@@ -13,6 +12,9 @@ from datetime import datetime, timedelta
 from functools import wraps
 from collections import defaultdict
 
+import upload_guard
+from mock_backend import seeded_probabilities
+
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
 try:
@@ -33,6 +35,9 @@ logger = logging.getLogger(__name__)
 # Don't use static_folder so we can handle all routing manually
 app = Flask(__name__)
 
+# Reject oversized bodies while they stream in, before anything is spooled or decoded
+app.config['MAX_CONTENT_LENGTH'] = upload_guard.MAX_CONTENT_LENGTH
+
 # Configure CORS with specific origins
 CORS(app, resources={
     r"/api/*": {
@@ -45,9 +50,7 @@ CORS(app, resources={
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_PATH = os.path.join(BASE_DIR, 'model.h5')
 
-# Configuration
-ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
-MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+# Configuration (upload format and size limits live in upload_guard.py)
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 
 # Mock predictions
@@ -83,10 +86,6 @@ def is_valid_phone(phone):
     pattern = r'^\+?1?\d{9,15}$'
     return re.match(pattern, phone.replace('-', '').replace(' ', '').replace('(', '').replace(')', '')) is not None
 
-def allowed_file(filename):
-    """Check if file extension is allowed"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 def sanitize_filename(filename):
     """Sanitize filename to prevent path traversal attacks"""
     # Remove path separators and special characters
@@ -151,11 +150,12 @@ def verify_token(token):
     """Verify if a token is valid"""
     return token in tokens_db
 
-def mock_predict():
-    """Generate mock predictions for testing"""
-    class_idx = random.randint(0, 2)
-    confidence = random.uniform(0.75, 0.95)
-    return class_idx, confidence
+def mock_predict(img_path):
+    """Generate mock predictions for testing, seeded by the image bytes so repeats agree"""
+    with open(img_path, 'rb') as f:
+        all_scores = seeded_probabilities(f.read(), len(labels), peak=(0.75, 0.95))
+    class_idx = all_scores.index(max(all_scores))
+    return class_idx, all_scores[class_idx], all_scores
 
 # Routes
 
@@ -194,35 +194,12 @@ def predict():
         
         file = request.files['image']
         
-        if file.filename == '':
-            logger.warning("Empty filename provided")
-            return jsonify({
-                "success": False,
-                "error": "No file selected",
-                "code": "NO_FILE_SELECTED"
-            }), 400
-        
-        # Validate file type
-        if not allowed_file(file.filename):
-            logger.warning(f"Invalid file type: {file.filename}")
-            return jsonify({
-                "success": False,
-                "error": f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}",
-                "code": "INVALID_FILE_TYPE"
-            }), 400
-        
-        # Check file size
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        if file_size > MAX_UPLOAD_SIZE:
-            logger.warning(f"File too large: {file_size} bytes")
-            return jsonify({
-                "success": False,
-                "error": f"File too large. Maximum size: {MAX_UPLOAD_SIZE / 1024 / 1024:.1f}MB",
-                "code": "FILE_TOO_LARGE"
-            }), 413
+        # Validate format (magic bytes), size and dimensions from the header before saving
+        try:
+            upload_guard.admit_upload(file)
+        except upload_guard.UploadRejected as e:
+            logger.warning(f"Upload rejected ({e.code}): {file.filename}")
+            return jsonify(e.to_dict()), e.status
         
         # Create uploads directory if it doesn't exist
         os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -236,18 +213,10 @@ def predict():
         file.save(img_path)
         logger.info(f"Saved uploaded file: {safe_filename}")
         
-        # Use mock prediction
-        class_idx = random.randint(0, 2)
-        confidence = random.uniform(0.75, 0.95)
+        # Use mock prediction (deterministic per image)
+        class_idx, confidence, all_scores = mock_predict(img_path)
         diagnosis = labels[class_idx]
         
-        # Generate confidence scores for all classes
-        all_scores = [random.uniform(0.01, 0.3) for _ in labels]
-        all_scores[class_idx] = confidence
-        # Normalize to sum to 1
-        total = sum(all_scores)
-        all_scores = [s / total for s in all_scores]
-        
         description_map = {
             "COVID-19": "Signs of pneumonia detected. Seek immediate medical attention and follow isolation protocols.",
             "Normal": "No significant findings detected. Results appear normal.",
@@ -661,6 +630,16 @@ def bad_request(error):
         "code": "BAD_REQUEST"
     }), 400
 
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    """Handle bodies larger than MAX_CONTENT_LENGTH"""
+    logger.warning(f"Request body too large: {error}")
+    return jsonify({
+        "success": False,
+        "error": f"File too large. Maximum size: {upload_guard.MAX_UPLOAD_SIZE / 1024 / 1024:.1f}MB",
+        "code": "FILE_TOO_LARGE"
+    }), 413
+
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 Not Found"""
@@ -710,15 +689,15 @@ if __name__ == "__main__":
         print("\n🔒 Security Features:")
         print("   • Email validation with regex")
         print("   • Strong password validation")
-        print("   • File type & size validation")
+        print("   • File type (magic bytes), size & dimension validation")
         print("   • Filename sanitization")
         print("   • Rate limiting on endpoints")
         print("   • CORS configured")
         print("   • Comprehensive error handling")
         print("   • Request logging & debugging")
         print("\n📝 Configuration:")
-        print(f"   • Max upload size: {MAX_UPLOAD_SIZE / 1024 / 1024:.1f}MB")
-        print(f"   • Allowed formats: {', '.join(ALLOWED_EXTENSIONS)}")
+        print(f"   • Max upload size: {upload_guard.MAX_UPLOAD_SIZE / 1024 / 1024:.1f}MB")
+        print(f"   • Allowed formats: {', '.join(upload_guard.ALLOWED_FORMATS)}")
         print(f"   • Token expiry: 7 days")
         print("   • Rate limits: auth=50/hr, predict=20/hr, chat=100/hr")
         print("\n📋 Deployment:")
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Non-blocking audit log for predictions and report downloads.
+Request threads append records to a bounded in-memory buffer under a short lock
+and return; a background writer drains it in batches to JSONL segment files,
+fsyncing once per batch. Every line is "<crc32> <json>", so a torn or altered
+line is detected on its own, and a rotated segment gets a <segment>.sum sidecar
+with its record count, sequence range and SHA-256. Records carry a sequence
+number assigned on append, so records shed under pressure show up as gaps.
+
+When the buffer is full the policy decides what gives:
+
+    drop_oldest  overwrite the oldest buffered records (default)
+    drop_newest  discard incoming records
+    reject       refuse new audited requests with 503 while the buffer is above
+                 its high-water mark, so nothing served goes unaudited
+
+Query or verify the log offline with:
+
+    python audit_log.py query --event predict --user 42 --since 2026-10-01
+    python audit_log.py verify
+"""
+
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+
+import serialization
+
+POLICIES = ('drop_oldest', 'drop_newest', 'reject')
+SEGMENT_PATTERN = re.compile(r'^audit-(\d{8})\.jsonl$')
+TAIL_BYTES = 1 << 16  # enough of the last segment to find its last complete record
+
+
+class AuditBackpressure(Exception):
+    """Raised under the 'reject' policy while the writer is behind"""
+
+    def __init__(self, retry_after):
+        super().__init__("Audit log is behind")
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        return {
+            "success": False,
+            "error": f"The audit log is catching up; retry in {self.retry_after}s",
+            "code": "AUDIT_BACKPRESSURE",
+        }
+
+
+def encode_line(record):
+    payload = serialization.dumps(record)
+    return b'%08x ' % zlib.crc32(payload) + payload + b'\n'
+
+
+def decode_line(line):
+    """The record of one line, or None if it is torn or fails its checksum"""
+    line = line.rstrip(b'\n')
+    if len(line) < 10 or line[8:9] != b' ':
+        return None
+    payload = line[9:]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def segment_paths(directory):
+    """Segment files in write order"""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory) if SEGMENT_PATTERN.match(name))
+    return [os.path.join(directory, name) for name in names]
+
+
+def _last_seq(path):
+    with open(path, 'rb') as f:
+        f.seek(max(0, os.path.getsize(path) - TAIL_BYTES))
+        lines = f.read().split(b'\n')
+    for line in reversed(lines):
+        record = decode_line(line)
+        if record is not None:
+            return record["seq"]
+    return 0
+
+
+class AuditLog:
+    """Bounded append buffer drained to checksummed, rotating JSONL segments by a background writer"""
+
+    def __init__(self, directory, capacity=10000, policy='drop_oldest', batch_size=500, flush_interval=0.5,
+                 segment_bytes=16 * 2 ** 20, high_water=0.8, fsync=True, retry_after=2):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        self.directory = directory
+        self.capacity = capacity
+        self.policy = policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.high_water = int(capacity * high_water)
+        self.fsync = fsync
+        self.retry_after = retry_after
+        os.makedirs(directory, exist_ok=True)
+
+        existing = segment_paths(directory)
+        self._seq = _last_seq(existing[-1]) if existing else 0
+        # Each process starts a fresh segment rather than appending after a possibly torn tail
+        self._next_segment = int(SEGMENT_PATTERN.match(os.path.basename(existing[-1])).group(1)) + 1 if existing else 1
+        self._segment = None
+
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._writing = False
+        self.appended = 0
+        self.shed = 0
+        self.rejected = 0
+        self.written = 0
+        self.batches = 0
+        self.write_errors = 0
+        self.last_batch_ms = None
+
+        self._writer = threading.Thread(target=self._write_loop, name='audit-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # Request side
+
+    def check_capacity(self):
+        """Under the 'reject' policy, refuse new audited work while the buffer is above its high-water mark"""
+        if self.policy == 'reject' and len(self._buffer) >= self.high_water:
+            self.rejected += 1
+            raise AuditBackpressure(self.retry_after)
+
+    def record(self, event, **fields):
+        """Append one record; never waits for the writer. Returns False if the record was shed."""
+        with self._cond:
+            self._seq += 1
+            if len(self._buffer) >= self.capacity:
+                self.shed += 1
+                if self.policy != 'drop_oldest':
+                    return False
+                self._buffer.popleft()
+            self._buffer.append({"seq": self._seq, "ts": round(time.time(), 3), "event": event, **fields})
+            self.appended += 1
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    # Writer side
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.batch_size and not self._closing:
+                    self._cond.wait(self.flush_interval)
+                batch = list(self._buffer)
+                self._buffer.clear()
+                self._writing = bool(batch)
+                closing = self._closing
+            if batch:
+                self._write_batch(batch)
+                self._writing = False
+            if closing:
+                self._close_segment()
+                return
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"audit-{self._next_segment:08d}.jsonl")
+        self._next_segment += 1
+        self._segment = {
+            "path": path,
+            "file": open(path, 'ab'),
+            "sha256": hashlib.sha256(),
+            "bytes": 0,
+            "records": 0,
+            "first_seq": None,
+            "last_seq": None,
+        }
+        if self.fsync:
+            self._fsync_directory()
+
+    def _fsync_directory(self):
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _close_segment(self):
+        segment, self._segment = self._segment, None
+        if segment is None:
+            return
+        try:
+            segment["file"].close()
+            summary = {
+                "segment": os.path.basename(segment["path"]),
+                "records": segment["records"],
+                "first_seq": segment["first_seq"],
+                "last_seq": segment["last_seq"],
+                "bytes": segment["bytes"],
+                "sha256": segment["sha256"].hexdigest(),
+            }
+            with open(segment["path"] + '.sum', 'w') as f:
+                json.dump(summary, f)
+        except OSError as e:
+            print(f"ERR Audit segment {segment['path']} could not be sealed: {e}")
+
+    def _write_batch(self, batch):
+        start = time.perf_counter()
+        data = b''.join(encode_line(record) for record in batch)
+        try:
+            if self._segment is None:
+                self._open_segment()
+            segment = self._segment
+            segment["file"].write(data)
+            segment["file"].flush()
+            if self.fsync:
+                os.fsync(segment["file"].fileno())
+        except OSError as e:
+            self.write_errors += 1
+            print(f"ERR Audit write failed ({len(batch)} records lost): {e}")
+            self._close_segment()
+            return
+        segment["sha256"].update(data)
+        segment["bytes"] += len(data)
+        segment["records"] += len(batch)
+        if segment["first_seq"] is None:
+            segment["first_seq"] = batch[0]["seq"]
+        segment["last_seq"] = batch[-1]["seq"]
+        self.written += len(batch)
+        self.batches += 1
+        self.last_batch_ms = round((time.perf_counter() - start) * 1000, 2)
+        if segment["bytes"] >= self.segment_bytes:
+            self._close_segment()
+
+    def flush(self, timeout=5.0):
+        """Wait until buffered records have been written"""
+        deadline = time.time() + timeout
+        with self._cond:
+            self._cond.notify()
+        while (self._buffer or self._writing) and time.time() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        if self._writer.is_alive():
+            with self._cond:
+                self._closing = True
+                self._cond.notify()
+            self._writer.join(timeout=5)
+
+    def stats(self):
+        with self._cond:
+            buffered = len(self._buffer)
+            oldest = self._buffer[0]["ts"] if self._buffer else None
+        return {
+            "policy": self.policy,
+            "capacity": self.capacity,
+            "buffered": buffered,
+            "lag_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+            "appended": self.appended,
+            "shed": self.shed,
+            "rejected": self.rejected,
+            "written": self.written,
+            "batches": self.batches,
+            "write_errors": self.write_errors,
+            "last_batch_ms": self.last_batch_ms,
+            "segment": os.path.basename(self._segment["path"]) if self._segment else None,
+            "segments": len(segment_paths(self.directory)),
+        }
+
+
+# Offline tools
+
+def read_segment(path):
+    """Yield (line_number, record or None) for every line of a segment"""
+    with open(path, 'rb') as f:
+        for number, line in enumerate(f, 1):
+            yield number, decode_line(line)
+
+
+def parse_time(value):
+    """Epoch seconds from an epoch number or an ISO date/time (UTC unless it carries an offset)"""
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+def query(directory, event=None, user=None, study=None, since=None, until=None):
+    """Yield matching records in write order, skipping lines that fail their checksum"""
+    for path in segment_paths(directory):
+        for _, record in read_segment(path):
+            if record is None:
+                continue
+            if event is not None and record.get("event") != event:
+                continue
+            if user is not None and str(record.get("user_id")) != str(user):
+                continue
+            if study is not None and record.get("study_id") != study:
+                continue
+            if since is not None and record["ts"] < since:
+                continue
+            if until is not None and record["ts"] >= until:
+                continue
+            yield record
+
+
+def verify(directory):
+    """Check every line's CRC, every sealed segment's SHA-256, and sequence gaps; returns a report dict"""
+    report = {"segments": 0, "records": 0, "corrupt_lines": [], "checksum_mismatches": [], "gaps": []}
+    previous_seq = None
+    for path in segment_paths(directory):
+        report["segments"] += 1
+        name = os.path.basename(path)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for number, line in enumerate(f, 1):
+                digest.update(line)
+                record = decode_line(line)
+                if record is None:
+                    report["corrupt_lines"].append(f"{name}:{number}")
+                    continue
+                report["records"] += 1
+                if previous_seq is not None and record["seq"] != previous_seq + 1:
+                    report["gaps"].append({"after": previous_seq, "next": record["seq"], "missing": record["seq"] - previous_seq - 1})
+                previous_seq = record["seq"]
+        if os.path.exists(path + '.sum'):
+            with open(path + '.sum') as f:
+                expected = json.load(f).get("sha256")
+            if expected != digest.hexdigest():
+                report["checksum_mismatches"].append(name)
+    report["ok"] = not report["corrupt_lines"] and not report["checksum_mismatches"]
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audit'))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    query_parser = commands.add_parser('query', help='print matching records as JSON lines')
+    query_parser.add_argument('--event', choices=('predict', 'report'))
+    query_parser.add_argument('--user')
+    query_parser.add_argument('--study')
+    query_parser.add_argument('--since', help='epoch seconds or ISO date/time (UTC)')
+    query_parser.add_argument('--until', help='epoch seconds or ISO date/time (UTC), exclusive')
+    query_parser.add_argument('--limit', type=int)
+
+    commands.add_parser('verify', help='check line CRCs, segment checksums and sequence gaps')
+    args = parser.parse_args(argv)
+
+    if args.command == 'verify':
+        report = verify(args.dir)
+        print(json.dumps(report, indent=2))
+        return 0 if report["ok"] else 1
+
+    records = query(
+        args.dir, args.event, args.user, args.study,
+        parse_time(args.since) if args.since else None,
+        parse_time(args.until) if args.until else None,
+    )
+    for count, record in enumerate(records, 1):
+        print(json.dumps(record, separators=(',', ':')))
+        if args.limit and count >= args.limit:
+            break
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Startup autotuner for the TFLite interpreter configuration.
+Benchmarks candidate configurations on the actual model and CPU: interpreter threads,
+the default XNNPACK delegate on or off (plus any external delegate libraries), and the
+number of pooled interpreters serving requests in parallel. The best one for the
+objective is picked:
+
+    latency     lowest p95 latency per image
+    throughput  most images/s, among configurations within the optional p95 target
+
+Choices are cached in a JSON file keyed by model hash, CPU signature and objective, so
+the benchmark only runs the first time a model is deployed on a given machine type.
+A winning external delegate is cached with its library path, so the server rebuilds
+exactly the configuration that was measured. Run it ahead of a deploy with:
+
+    python autotune.py --objective throughput --target-p95-ms 400 [--delegate libfoo_delegate.so]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import numpy as np
+
+from inference import (INPUT_SHAPE, FixedBatchModel, InterpreterPool, SignatureModel, import_tflite, run_inference,
+                       signature_keys)
+
+OBJECTIVES = ('latency', 'throughput')
+DEFAULT_CONFIG = {"threads": 1, "delegate": "default", "pool_size": 1}
+WARMUP_RUNS = 2
+
+
+def cpu_signature():
+    """Identify the machine type: architecture, CPU model and usable core count"""
+    model_name = platform.processor() or ''
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    model_name = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{platform.machine()}|{model_name}|{usable_cpus()}"
+
+
+def usable_cpus():
+    """Cores this process may run on (respects container CPU affinity)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def model_digest(model_path):
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def delegate_options(tflite, external_libraries=()):
+    """
+    Map delegate name -> Interpreter keyword arguments.
+    'xnnpack' uses the built-in default delegate, 'none' disables it; without the
+    op-resolver API only the interpreter's default behaviour can be measured.
+    """
+    resolver = getattr(tflite, 'OpResolverType', None)
+    if resolver is None:
+        resolver = getattr(getattr(tflite, 'experimental', None), 'OpResolverType', None)
+    if resolver is None:
+        options = {"default": {}}
+    else:
+        options = {
+            "xnnpack": {"experimental_op_resolver_type": resolver.AUTO},
+            "none": {"experimental_op_resolver_type": resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES},
+        }
+    load_delegate = getattr(tflite, 'load_delegate', None) or getattr(getattr(tflite, 'experimental', None), 'load_delegate', None)
+    for library in external_libraries:
+        if load_delegate is not None:
+            options[os.path.basename(library)] = {"_library": library}
+    return options
+
+
+def make_interpreter(tflite, model_path, threads, delegate, options):
+    kwargs = dict(options.get(delegate, {}))
+    library = kwargs.pop('_library', None)
+    if library is not None:
+        load_delegate = getattr(tflite, 'load_delegate', None) or tflite.experimental.load_delegate
+        kwargs['experimental_delegates'] = [load_delegate(library)]
+    interpreter = tflite.Interpreter(model_path=str(model_path), num_threads=threads, **kwargs)
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+def build_pool(tflite, model_path, config, options=None, batch_sizes=(1,)):
+    """
+    An InterpreterPool built to `config` (threads, delegate, pool_size and, for an external
+    delegate, delegate_library). Each slot holds an interpreter preallocated for each of
+    `batch_sizes`: a SignatureModel for models with signatures, a FixedBatchModel of
+    resized plain interpreters otherwise.
+    """
+    if options is None:
+        library = config.get("delegate_library")
+        options = delegate_options(tflite, [library] if library else ())
+    delegate = config["delegate"]
+    if delegate not in options:
+        fallback = next(iter(options))
+        if delegate != "default":
+            print(f"WARN  Delegate {delegate} is not available with this runtime; using {fallback}")
+        delegate = fallback
+    batch_sizes = sorted(set(batch_sizes)) or [1]
+
+    def slot():
+        interpreter = make_interpreter(tflite, model_path, config["threads"], delegate, options)
+        interpreters = {batch_sizes[0]: interpreter}
+        for size in batch_sizes[1:]:
+            interpreters[size] = make_interpreter(tflite, model_path, config["threads"], delegate, options)
+        return SignatureModel(interpreters) if signature_keys(interpreter) else FixedBatchModel(interpreters)
+
+    members = [slot() for _ in range(config["pool_size"])]
+    pool_config = {**config, "delegate": delegate, "batch_sizes": members[0].batch_sizes}
+    if "_library" not in options[delegate]:
+        pool_config.pop("delegate_library", None)
+    return InterpreterPool(members, pool_config)
+
+
+def candidate_configs(cpus, delegates, max_pool):
+    """Thread counts (powers of two and the full core count) x delegates x pool sizes that fit the cores"""
+    thread_counts = sorted({t for t in (1, 2, 4, 8, 16, 32) if t <= cpus} | {cpus})
+    configs = []
+    for threads in thread_counts:
+        for pool_size in range(1, max_pool + 1):
+            if pool_size > 1 and threads * pool_size > cpus:
+                break
+            for delegate in delegates:
+                configs.append({"threads": threads, "delegate": delegate, "pool_size": pool_size})
+    return configs
+
+
+def benchmark(pool, seconds):
+    """Drive every pooled interpreter from its own thread for `seconds`; return latency and throughput"""
+    batch = np.random.default_rng(0).random((1,) + INPUT_SHAPE).astype(np.float32)
+    for interpreter in pool.interpreters:
+        for _ in range(WARMUP_RUNS):
+            run_inference(interpreter, batch)
+
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def drive(interpreter):
+        local = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            run_inference(interpreter, batch)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=drive, args=(interpreter,)) for interpreter in pool.interpreters]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "images_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def choose(results, objective, target_p95_ms=None):
+    """Pick the winning result for the objective"""
+    if objective == 'latency':
+        return min(results, key=lambda r: r["p95_ms"])
+    within_target = [r for r in results if target_p95_ms is None or r["p95_ms"] <= target_p95_ms]
+    if not within_target:
+        print(f"WARN  Autotune: no configuration meets p95 <= {target_p95_ms} ms; using the fastest")
+        return min(results, key=lambda r: r["p95_ms"])
+    return max(within_target, key=lambda r: r["images_per_second"])
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(cache_path, cache):
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, cache_path)
+
+
+def tune(model_path, tflite=None, objective='throughput', cache_path=None, max_pool=4,
+         seconds_per_config=0.5, target_p95_ms=None, external_delegates=(), force=False, benchmark=True):
+    """
+    Return the tuning record for this model and machine: {"key", "config", "source", ...}.
+    A cached choice is reused unless `force`; otherwise every candidate is benchmarked, or
+    with benchmark=False the defaults are returned untuned.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"objective must be one of {OBJECTIVES}")
+    tflite = tflite or import_tflite()
+    key = f"{model_digest(model_path)[:16]}|{cpu_signature()}|{objective}"
+
+    cache = _read_cache(cache_path) if cache_path else {}
+    if key in cache and not force:
+        return {**cache[key], "key": key, "source": "cache"}
+    if not benchmark:
+        print(f"WARN  Autotune: no cached choice for {key}; using defaults (run autotune.py to tune)")
+        return {"key": key, "config": dict(DEFAULT_CONFIG), "source": "untuned"}
+
+    options = delegate_options(tflite, external_delegates)
+    results = []
+    for config in candidate_configs(usable_cpus(), list(options), max_pool):
+        try:
+            pool = build_pool(tflite, model_path, config, options)
+            results.append({**config, **benchmark(pool, seconds_per_config)})
+            del pool
+        except Exception as e:
+            print(f"WARN  Autotune: skipping {config}: {e}")
+            continue
+        last = results[-1]
+        print(f"  threads={config['threads']} delegate={config['delegate']} pool={config['pool_size']}: "
+              f"{last['images_per_second']:.1f} img/s, p95 {last['p95_ms']:.1f} ms")
+    if not results:
+        return {"key": key, "config": dict(DEFAULT_CONFIG), "source": "default"}
+
+    best = choose(results, objective, target_p95_ms)
+    config = {name: best[name] for name in DEFAULT_CONFIG}
+    if "_library" in options[best["delegate"]]:
+        config["delegate_library"] = options[best["delegate"]]["_library"]
+    record = {
+        "config": config,
+        "measured": {name: best[name] for name in ("images_per_second", "p50_ms", "p95_ms")},
+        "objective": objective,
+        "target_p95_ms": target_p95_ms,
+        "candidates": len(results),
+        "tuned_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    if cache_path:
+        cache[key] = record
+        _write_cache(cache_path, cache)
+    return {**record, "key": key, "source": "benchmark"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model.tflite'))
+    parser.add_argument('--objective', choices=OBJECTIVES, default='throughput')
+    parser.add_argument('--target-p95-ms', type=float)
+    parser.add_argument('--max-pool', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=1.0, help='benchmark time per configuration')
+    parser.add_argument('--delegate', action='append', default=[], help='external delegate library to include')
+    parser.add_argument('--cache', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'autotune.json'))
+    args = parser.parse_args(argv)
+
+    record = tune(args.model, objective=args.objective, cache_path=args.cache, max_pool=args.max_pool,
+                  seconds_per_config=args.seconds, target_p95_ms=args.target_p95_ms,
+                  external_delegates=args.delegate, force=True)
+    print(json.dumps(record, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
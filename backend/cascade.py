@@ -0,0 +1,95 @@
+"""
+Two-stage inference cascade.
+A small screening model runs first; its answer is returned directly when its top
+class is in the accept set with confidence at or above the accept threshold.
+Everything else escalates to the full DenseNet121 model. A small audit sample of
+accepted images is escalated anyway, so agreement can be measured on both paths.
+"""
+
+import random
+import threading
+
+import numpy as np
+
+STAGE_SCREEN = 'screen'
+STAGE_FULL = 'full'
+
+LOG_EVERY = 100  # decisions between summary log lines
+
+
+class CascadePolicy:
+    """Accept/escalate decisions plus escalation and agreement statistics"""
+
+    def __init__(self, class_labels, accept_classes, accept_confidence, audit_rate=0.0):
+        self.class_labels = list(class_labels)
+        self.accept_indices = {self.class_labels.index(name) for name in accept_classes if name in self.class_labels}
+        self.accept_confidence = accept_confidence
+        self.audit_rate = audit_rate
+        self._lock = threading.Lock()
+
+        num_classes = len(self.class_labels)
+        self.decisions = 0
+        self.accepted = 0
+        self.escalated = 0
+        self.audited = 0
+        # Rows: screener top-1, columns: full-model top-1 (escalated and audited images)
+        self.agreement = np.zeros((num_classes, num_classes), dtype=np.int64)
+        self.audit_agreement = np.zeros((num_classes, num_classes), dtype=np.int64)
+
+    def screen_accepts(self, screen_probabilities):
+        """True when the screener's answer falls inside the configured accept bounds"""
+        top = int(np.argmax(screen_probabilities))
+        return top in self.accept_indices and float(screen_probabilities[top]) >= self.accept_confidence
+
+    def decide(self, screen_probabilities):
+        """Return (stage, audit) for one image"""
+        accepted = self.screen_accepts(screen_probabilities)
+        audit = accepted and self.audit_rate > 0 and random.random() < self.audit_rate
+        with self._lock:
+            self.decisions += 1
+            if accepted and not audit:
+                self.accepted += 1
+            else:
+                self.escalated += 1
+            if audit:
+                self.audited += 1
+            log_now = self.decisions % LOG_EVERY == 0
+        if log_now:
+            self.log_summary()
+        return (STAGE_SCREEN if accepted and not audit else STAGE_FULL), audit
+
+    def record_escalation(self, screen_probabilities, full_probabilities, audit=False):
+        """Compare both stages' top-1 for an image that reached the full model"""
+        screen_top = int(np.argmax(screen_probabilities))
+        full_top = int(np.argmax(full_probabilities))
+        with self._lock:
+            self.agreement[screen_top, full_top] += 1
+            if audit:
+                self.audit_agreement[screen_top, full_top] += 1
+
+    def stats(self):
+        with self._lock:
+            compared = int(self.agreement.sum())
+            audited = int(self.audit_agreement.sum())
+            return {
+                "decisions": self.decisions,
+                "accepted_by_screen": self.accepted,
+                "escalated": self.escalated,
+                "escalation_rate": self.escalated / self.decisions if self.decisions else 0.0,
+                "audited": self.audited,
+                "agreement_rate": float(np.trace(self.agreement) / compared) if compared else None,
+                "audit_agreement_rate": float(np.trace(self.audit_agreement) / audited) if audited else None,
+                "agreement_matrix": self.agreement.tolist(),
+                "accept_classes": sorted(self.class_labels[i] for i in self.accept_indices),
+                "accept_confidence": self.accept_confidence,
+            }
+
+    def log_summary(self):
+        stats = self.stats()
+        agreement = stats["agreement_rate"]
+        audit = stats["audit_agreement_rate"]
+        print(
+            f"CASCADE decisions={stats['decisions']} escalation_rate={stats['escalation_rate']:.3f} "
+            f"agreement={'n/a' if agreement is None else f'{agreement:.3f}'} "
+            f"audit_agreement={'n/a' if audit is None else f'{audit:.3f}'}"
+        )
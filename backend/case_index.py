@@ -0,0 +1,307 @@
+"""
+Similar-case retrieval over penultimate-layer embeddings.
+Embeddings are L2-normalised and appended to a memory-mapped float16 matrix, with
+per-case predicted and confirmed labels kept in parallel int8 memmaps. Small stores
+are searched exactly with chunked matrix products; once the store passes a size
+threshold an IVF (inverted file) index is trained once in the background, and new
+cases are assigned to their nearest centroid on insert, so it never needs a rebuild.
+Each case records the user who uploaded it, and searches can be scoped to one owner.
+The embedding width is fixed when the store is created; opening it with a model of
+another width raises instead of failing on every insert.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+UNCONFIRMED = -1
+SEARCH_CHUNK_ROWS = 65536
+INITIAL_CAPACITY = 1024
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 100_000
+
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores, ids, k):
+    """Highest-scoring k (id, score) pairs, best first"""
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[keep], ids[keep]
+    order = np.argsort(-scores)
+    return ids[order], scores[order]
+
+
+def kmeans(vectors, num_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means with vectorised assignment; returns unit-norm centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = (vectors @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=num_clusters)
+        empty = counts == 0
+        # Re-seed empty clusters from random points so every list stays useful
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = _normalise(sums)
+    return centroids
+
+
+class CaseIndex:
+    """Append-only embedding store with exact and IVF search"""
+
+    def __init__(self, directory, dim, ivf_threshold=50_000, nprobe=8):
+        self.directory = str(directory)
+        self.dim = int(dim)
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._training = False
+        os.makedirs(self.directory, exist_ok=True)
+
+        meta = self._read_meta()
+        if meta.get("count") and meta.get("dim", self.dim) != self.dim:
+            raise ValueError(
+                f"{self.directory} holds {meta['dim']}-d embeddings but the model produces {self.dim}-d; "
+                f"move it aside or point CASE_INDEX_DIR elsewhere"
+            )
+        self.count = meta.get("count", 0)
+        self.capacity = max(meta.get("capacity", INITIAL_CAPACITY), INITIAL_CAPACITY)
+        self._open_arrays()
+
+        # study_id -> row; ids.txt ("<study_id>\t<owner>" per line) is the source of truth
+        # if meta.json lags behind a crash
+        self.study_ids = []
+        self.owners = []
+        ids_path = self._path('ids.txt')
+        if os.path.exists(ids_path):
+            with open(ids_path) as f:
+                for line in list(f)[:self.count]:
+                    study_id, _, owner = line.rstrip('\n').partition('\t')
+                    self.study_ids.append(study_id)
+                    self.owners.append(owner)
+        self.count = len(self.study_ids)
+        self.rows = {study_id: row for row, study_id in enumerate(self.study_ids)}
+        self.owner_rows = {}
+        for row, owner in enumerate(self.owners):
+            self.owner_rows.setdefault(owner, []).append(row)
+
+        self.centroids = None
+        self.lists = None
+        centroid_path = self._path('ivf_centroids.npy')
+        if os.path.exists(centroid_path):
+            self.centroids = np.load(centroid_path)
+            self._rebuild_lists()
+
+    # Storage
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._path('meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self):
+        tmp_path = self._path('meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({"count": self.count, "capacity": self.capacity, "dim": self.dim}, f)
+        os.replace(tmp_path, self._path('meta.json'))
+
+    def _memmap(self, name, dtype, shape):
+        path = self._path(name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if not os.path.exists(path) or os.path.getsize(path) < size:
+            with open(path, 'ab') as f:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode='r+', shape=shape)
+
+    def _open_arrays(self):
+        self.embeddings = self._memmap('embeddings.f16', np.float16, (self.capacity, self.dim))
+        self.predicted = self._memmap('predicted.i8', np.int8, (self.capacity,))
+        self.confirmed = self._memmap('confirmed.i8', np.int8, (self.capacity,))
+        self.assignment = self._memmap('ivf_assign.i32', np.int32, (self.capacity,))
+
+    def _grow(self):
+        """Double the capacity; files are extended in place and re-mapped"""
+        for array in (self.embeddings, self.predicted, self.confirmed, self.assignment):
+            array.flush()
+        self.capacity *= 2
+        self._open_arrays()
+
+    # Writes
+
+    def add(self, study_id, embedding, predicted_class, owner=''):
+        """Append one case uploaded by `owner` ('' for anonymous); assigned to its IVF list if trained"""
+        vector = _normalise(embedding).ravel()
+        if vector.shape != (self.dim,):
+            raise ValueError(f"embedding has {vector.size} values, the case index stores {self.dim}")
+        owner = owner or ''
+        with self._lock:
+            if study_id in self.rows:
+                return self.rows[study_id]
+            if self.count >= self.capacity:
+                self._grow()
+            row = self.count
+            self.embeddings[row] = vector
+            self.predicted[row] = predicted_class
+            self.confirmed[row] = UNCONFIRMED
+
+            with open(self._path('ids.txt'), 'a') as f:
+                f.write(f"{study_id}\t{owner}\n")
+            self.study_ids.append(study_id)
+            self.owners.append(owner)
+            self.rows[study_id] = row
+            # Published to the search structures only once the row is fully stored
+            if self.centroids is not None:
+                cluster = int((self.centroids @ vector).argmax())
+                self.assignment[row] = cluster
+                self.lists[cluster].append(row)
+            self.owner_rows.setdefault(owner, []).append(row)
+            self.count += 1
+            self._write_meta()
+
+            train = self.centroids is None and self.count >= self.ivf_threshold and not self._training
+            if train:
+                self._training = True
+        if train:
+            threading.Thread(target=self.train_ivf, name='case-index-ivf', daemon=True).start()
+        return row
+
+    def confirm(self, study_id, class_idx):
+        """Record the clinically confirmed class of a stored case"""
+        with self._lock:
+            row = self.rows.get(study_id)
+            if row is None:
+                return False
+            self.confirmed[row] = class_idx
+            self.confirmed.flush()
+            return True
+
+    def owner_of(self, study_id):
+        """The uploading user of a stored case ('' for anonymous), or None if unknown"""
+        row = self.rows.get(study_id)
+        return None if row is None else self.owners[row]
+
+    def embedding_for(self, study_id):
+        row = self.rows.get(study_id)
+        return None if row is None else np.asarray(self.embeddings[row], dtype=np.float32)
+
+    # IVF
+
+    def train_ivf(self):
+        """Train IVF centroids on a sample of the store and assign every existing row once"""
+        try:
+            count = self.count
+            num_lists = int(min(4096, max(16, 4 * np.sqrt(count))))
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(count, min(count, KMEANS_SAMPLE), replace=False))
+            sample = np.asarray(self.embeddings[sample_rows], dtype=np.float32)
+            centroids = kmeans(sample, num_lists)
+
+            for start in range(0, count, SEARCH_CHUNK_ROWS):
+                stop = min(start + SEARCH_CHUNK_ROWS, count)
+                chunk = np.asarray(self.embeddings[start:stop], dtype=np.float32)
+                self.assignment[start:stop] = (chunk @ centroids.T).argmax(axis=1)
+
+            with self._lock:
+                # Rows added while training get assigned here so none are missed
+                for row in range(count, self.count):
+                    self.assignment[row] = int((centroids @ np.asarray(self.embeddings[row], dtype=np.float32)).argmax())
+                self.assignment.flush()
+                np.save(self._path('ivf_centroids.npy'), centroids)
+                self.centroids = centroids
+                self._rebuild_lists()
+            print(f"OK  Case index: trained IVF with {num_lists} lists over {count} cases")
+        except Exception as e:
+            print(f"ERR Case index IVF training failed: {e}")
+        finally:
+            self._training = False
+
+    def _rebuild_lists(self):
+        """Group row ids by IVF list with one argsort instead of a Python loop"""
+        assignment = np.asarray(self.assignment[:self.count])
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(len(self.centroids) + 1))
+        self.lists = [list(order[bounds[i]:bounds[i + 1]]) for i in range(len(self.centroids))]
+
+    # Search
+
+    def _candidate_mask(self, rows, class_idx, confirmed_only):
+        mask = np.ones(len(rows), dtype=bool)
+        if confirmed_only:
+            confirmed = np.asarray(self.confirmed[rows])
+            mask &= confirmed != UNCONFIRMED
+            if class_idx is not None:
+                mask &= confirmed == class_idx
+        elif class_idx is not None:
+            mask &= np.asarray(self.predicted[rows]) == class_idx
+        return mask
+
+    def search(self, query, k=5, class_idx=None, confirmed_only=False, exclude=None, owner=None):
+        """
+        Return up to k (study_id, cosine similarity) pairs, most similar first.
+        With `owner`, only that user's cases are candidates; they are scored exactly.
+        """
+        query = _normalise(query).reshape(self.dim)
+        # Snapshot under the lock: concurrent adds only ever append rows at or past `count`
+        with self._lock:
+            count = self.count
+            embeddings, study_ids = self.embeddings, self.study_ids
+            if count == 0:
+                return []
+            if owner is None and self.centroids is not None and self.lists is not None:
+                probes = np.argsort(-(self.centroids @ query))[:self.nprobe]
+                rows = np.array(sorted(row for cluster in probes for row in self.lists[cluster]), dtype=np.int64)
+            elif owner is not None:
+                rows = np.array(self.owner_rows.get(owner, ()), dtype=np.int64)
+            else:
+                rows = None
+
+        if rows is not None:
+            rows = rows[rows < count]
+            chunks = (rows[start:start + SEARCH_CHUNK_ROWS] for start in range(0, len(rows), SEARCH_CHUNK_ROWS))
+        else:
+            chunks = (np.arange(start, min(start + SEARCH_CHUNK_ROWS, count)) for start in range(0, count, SEARCH_CHUNK_ROWS))
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for rows in chunks:
+            rows = rows[self._candidate_mask(rows, class_idx, confirmed_only)]
+            scores = np.asarray(embeddings[rows], dtype=np.float32) @ query
+            best_rows, best_scores = _top_k(
+                np.concatenate([best_scores, scores]),
+                np.concatenate([best_rows, rows]),
+                k + 1,
+            )
+
+        results = []
+        for row, score in zip(best_rows, best_scores):
+            study_id = study_ids[row]
+            if study_id == exclude:
+                continue
+            results.append({
+                "study_id": study_id,
+                "similarity": float(score),
+                "predicted_class": int(self.predicted[row]),
+                "confirmed_class": None if self.confirmed[row] == UNCONFIRMED else int(self.confirmed[row]),
+            })
+        return results[:k]
+
+    def stats(self):
+        return {
+            "cases": self.count,
+            "index": "ivf" if self.centroids is not None else "exact",
+            "ivf_lists": 0 if self.centroids is None else len(self.centroids),
+            "training": self._training,
+        }
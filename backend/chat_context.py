@@ -0,0 +1,197 @@
+"""
+Bounded-memory conversational context for /api/chat.
+Each session (keyed by a hash of the auth token) keeps a ring buffer of recent
+turns under a fixed token budget. Turns that no longer fit are folded into a
+short extractive summary, itself capped, so the prompt sent upstream stays
+roughly constant in size however long the conversation runs. The user's most
+recent prediction is injected as one line of context. Sessions live in an LRU
+table capped by count and idle time, so memory stays flat across thousands of
+chatters. Per-turn upstream token usage and latency are recorded next to what
+the uncompressed history would have cost.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+CHARS_PER_TOKEN = 4        # rough estimate for English text; upstream usage is recorded when reported
+SUMMARY_SNIPPET_CHARS = 160
+TURN_SAMPLES = 1000        # recent turns kept for percentiles
+SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+SYSTEM_PREAMBLE = (
+    "You are a medical imaging assistant for chest X-ray screening results. "
+    "Answer briefly, never give a definitive diagnosis and recommend a healthcare professional for medical decisions."
+)
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def session_key(token):
+    """Sessions are keyed by a digest so raw bearer tokens are not kept in memory twice"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+
+
+def prediction_summary(prediction):
+    """One line describing a prediction dict ({class, confidence, ...}) for the prompt"""
+    if not prediction:
+        return None
+    line = f"The user's most recent chest X-ray was classified as {prediction['class']} ({prediction['confidence']:.0%} confidence)"
+    runner_up = sorted(
+        ((p, label) for label, p in prediction.get('all_predictions', {}).items() if label != prediction['class']),
+        reverse=True
+    )
+    if runner_up:
+        line += f", next most likely {runner_up[0][1]} ({runner_up[0][0]:.0%})"
+    return line + "."
+
+
+def _snippet(text):
+    """First sentence, clipped: the extractive summary of one turn"""
+    first = SENTENCE_END.split(text.strip(), 1)[0]
+    return first if len(first) <= SUMMARY_SNIPPET_CHARS else first[:SUMMARY_SNIPPET_CHARS - 3].rstrip() + "..."
+
+
+class ChatSession:
+    """Recent turns plus a running summary of older ones"""
+
+    __slots__ = ('turns', 'turn_tokens', 'summary', 'summary_tokens', 'prediction', 'last_used', 'full_history_tokens', 'lock')
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)  # (role, text, tokens)
+        self.turn_tokens = 0
+        self.summary = deque()                # (line, tokens), oldest first
+        self.summary_tokens = 0
+        self.prediction = None
+        self.last_used = time.monotonic()
+        self.full_history_tokens = 0          # what resending everything would cost
+        self.lock = threading.Lock()
+
+
+class ChatContextStore:
+    """LRU table of chat sessions with token-budgeted prompt building"""
+
+    def __init__(self, max_sessions=5000, history_tokens=600, summary_tokens=200, max_turns=12, idle_seconds=3600):
+        self.max_sessions = max_sessions
+        self.history_tokens = history_tokens
+        self.summary_budget = summary_tokens
+        self.max_turns = max_turns
+        self.idle_seconds = idle_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._turns = deque(maxlen=TURN_SAMPLES)
+        self.evicted = 0
+        self.totals = {"turns": 0, "prompt_tokens": 0, "response_tokens": 0,
+                       "estimated_prompt_tokens": 0, "uncompressed_prompt_tokens": 0}
+
+    def session(self, token):
+        """Get or create the session for an auth token, evicting idle and least recently used ones"""
+        key = session_key(token)
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is None:
+                session = ChatSession(self.max_turns)
+            session.last_used = now
+            self._sessions[key] = session
+            while self._sessions:
+                oldest_key, oldest = next(iter(self._sessions.items()))
+                if len(self._sessions) <= self.max_sessions and now - oldest.last_used < self.idle_seconds:
+                    break
+                del self._sessions[oldest_key]
+                self.evicted += 1
+            return session
+
+    def drop(self, token):
+        with self._lock:
+            self._sessions.pop(session_key(token), None)
+
+    def set_prediction(self, token, prediction):
+        session = self.session(token)
+        with session.lock:
+            session.prediction = prediction_summary(prediction)
+
+    def _append(self, session, role, text):
+        tokens = estimate_tokens(text)
+        if len(session.turns) == session.turns.maxlen:
+            self._fold(session, session.turns[0])
+        session.turns.append((role, text, tokens))
+        session.turn_tokens += tokens
+        session.full_history_tokens += tokens
+        while session.turn_tokens > self.history_tokens and len(session.turns) > 1:
+            self._fold(session, session.turns[0])
+            session.turns.popleft()
+
+    def _fold(self, session, turn):
+        """Move one turn out of the ring buffer into the capped summary"""
+        role, text, tokens = turn
+        session.turn_tokens -= tokens
+        line = f"{'User' if role == 'user' else 'Assistant'}: {_snippet(text)}"
+        line_tokens = estimate_tokens(line)
+        session.summary.append((line, line_tokens))
+        session.summary_tokens += line_tokens
+        while session.summary_tokens > self.summary_budget and len(session.summary) > 1:
+            session.summary_tokens -= session.summary.popleft()[1]
+
+    def build_prompt(self, session, message, prediction=None):
+        """Prompt text for the next turn; `prediction` fills in when the session has none yet"""
+        with session.lock:
+            if session.prediction is None and prediction is not None:
+                session.prediction = prediction_summary(prediction)
+            parts = [SYSTEM_PREAMBLE]
+            if session.prediction:
+                parts.append(session.prediction)
+            if session.summary:
+                parts.append("Earlier in this conversation:\n" + "\n".join(line for line, _ in session.summary))
+            if session.turns:
+                parts.append("\n".join(f"{'User' if role == 'user' else 'Assistant'}: {text}" for role, text, _ in session.turns))
+            parts.append(f"User: {message}\nAssistant:")
+            prompt = "\n\n".join(parts)
+            uncompressed = (estimate_tokens(SYSTEM_PREAMBLE) + estimate_tokens(session.prediction or "")
+                            + session.full_history_tokens + estimate_tokens(message))
+            return prompt, uncompressed
+
+    def remember(self, session, message, reply):
+        """Add an exchange to the history without upstream cost (e.g. a local knowledge-base answer)"""
+        with session.lock:
+            self._append(session, 'user', message)
+            self._append(session, 'assistant', reply)
+
+    def record_turn(self, session, message, reply, latency, prompt, uncompressed, usage=None):
+        """Store the exchange and its cost; `usage` is (prompt_tokens, response_tokens) when upstream reports it"""
+        prompt_tokens, response_tokens = usage if usage else (estimate_tokens(prompt), estimate_tokens(reply))
+        self.remember(session, message, reply)
+        with self._lock:
+            self._turns.append((latency, prompt_tokens))
+            self.totals["turns"] += 1
+            self.totals["prompt_tokens"] += prompt_tokens
+            self.totals["response_tokens"] += response_tokens
+            self.totals["estimated_prompt_tokens"] += estimate_tokens(prompt)
+            self.totals["uncompressed_prompt_tokens"] += uncompressed
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(latency for latency, _ in self._turns)
+            prompts = sorted(tokens for _, tokens in self._turns)
+            percentile = lambda values, q: values[min(len(values) - 1, int(q * len(values)))] if values else None
+            p50_latency, p95_latency = percentile(latencies, 0.50), percentile(latencies, 0.95)
+            uncompressed = self.totals["uncompressed_prompt_tokens"]
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "evicted": self.evicted,
+                "history_token_budget": self.history_tokens,
+                "summary_token_budget": self.summary_budget,
+                **self.totals,
+                # Both sides estimated the same way, so upstream tokenizer differences cancel out
+                "prompt_compression": round(self.totals["estimated_prompt_tokens"] / uncompressed, 3) if uncompressed else None,
+                "prompt_tokens_p50": percentile(prompts, 0.50),
+                "latency_ms": {
+                    "p50": round(p50_latency * 1000, 1) if p50_latency is not None else None,
+                    "p95": round(p95_latency * 1000, 1) if p95_latency is not None else None,
+                },
+            }
@@ -3,61 +3,202 @@
 Convert the trained DenseNet121 model.h5 to TFLite format for low-memory deployment.
 Run this LOCALLY (not on Render) since it requires full TensorFlow:
     python convert_to_tflite.py
+
+The model is exported through a SavedModel with a dynamic batch dimension and
+named signatures, each taking `images` (N, 224, 224, 3) in [0, 1]:
+
+    classify                -> probabilities
+    classify_with_features  -> probabilities, features (the 512-d penultimate layer,
+                               used by the similar-case search as an embedding)
+    cam                     -> probabilities, heatmap (N, 7, 7 Grad-CAM of the top class)
+
+cam backpropagates through the classification head by hand (BatchNorm folded, ReLU
+mask), so the TFLite graph needs no gradient ops and /api/gradcam runs without
+TensorFlow. Pass --no-embeddings to leave out classify_with_features.
+
+--arch mobilenetv3small builds the cascade's screening model (same head on a
+MobileNetV3Small backbone); train it separately, then export it with
+    python convert_to_tflite.py --arch mobilenetv3small --model model_screen.h5 --output model_screen.tflite --no-embeddings
 """
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
+import argparse
+import shutil
+import tempfile
+
 import tensorflow as tf
 import numpy as np
 
+from labels import CLASS_LABELS
+from inference import INPUT_NAME, SIGNATURE_CAM, SIGNATURE_CLASSIFY, SIGNATURE_FEATURES
+from training import ARCHITECTURES, IMG_SIZE, build_model  # single definition of the architecture
+
 MODEL_PATH = 'model.h5'
 TFLITE_PATH = 'model.tflite'
 
-print("Step 1: Reconstructing model architecture...")
-base_model = tf.keras.applications.DenseNet121(
-    include_top=False,
-    weights=None,
-    input_shape=(224, 224, 3)
-)
-
-inputs = tf.keras.Input(shape=(224, 224, 3))
-x = base_model(inputs)
-x = tf.keras.layers.GlobalAveragePooling2D()(x)
-x = tf.keras.layers.BatchNormalization()(x)
-x = tf.keras.layers.Dropout(0.5)(x)
-x = tf.keras.layers.Dense(512, activation='relu')(x)
-x = tf.keras.layers.BatchNormalization()(x)
-x = tf.keras.layers.Dropout(0.3)(x)
-outputs = tf.keras.layers.Dense(4, activation='softmax')(x)
-model = tf.keras.Model(inputs, outputs)
-
-print("Step 2: Loading weights...")
-try:
-    model.load_weights(MODEL_PATH, by_name=True, skip_mismatch=True)
-    print("  Weights loaded successfully!")
-except Exception as e:
-    print(f"  Warning: {e}")
-    print("  Trying direct load...")
-    model = tf.keras.models.load_model(MODEL_PATH, compile=False)
-    print("  Direct load succeeded!")
-
-print("Step 3: Converting to TFLite...")
-converter = tf.lite.TFLiteConverter.from_keras_model(model)
-converter.optimizations = [tf.lite.Optimize.DEFAULT]
-
-# Use float16 quantization for smaller size while keeping accuracy
-converter.target_spec.supported_types = [tf.float16]
-
-tflite_model = converter.convert()
-
-print(f"Step 4: Saving to {TFLITE_PATH}...")
-with open(TFLITE_PATH, 'wb') as f:
-    f.write(tflite_model)
-
-original_size = os.path.getsize(MODEL_PATH) / (1024 * 1024)
-tflite_size = os.path.getsize(TFLITE_PATH) / (1024 * 1024)
-print(f"\nDone!")
-print(f"  Original model.h5:  {original_size:.1f} MB")
-print(f"  Converted model.tflite: {tflite_size:.1f} MB")
-print(f"  Size reduction: {((original_size - tflite_size) / original_size * 100):.0f}%")
-print(f"\nNow commit model.tflite to your repo and push to GitHub.")
+
+def load_weights(model, model_path):
+    """Load trained weights, falling back to a direct load of the saved model"""
+    try:
+        model.load_weights(model_path, by_name=True, skip_mismatch=True)
+        print("  Weights loaded successfully!")
+        return model
+    except Exception as e:
+        print(f"  Warning: {e}")
+        print("  Trying direct load...")
+        model = tf.keras.models.load_model(model_path, compile=False)
+        print("  Direct load succeeded!")
+        return model
+
+
+def head_layers(model):
+    """
+    (global pooling, [BatchNorm, Dense relu, BatchNorm, Dense softmax]) of the
+    classification head, or None when the model does not have that shape
+    """
+    pooling = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D)]
+    if len(pooling) != 1:
+        return None
+    after = model.layers[model.layers.index(pooling[0]) + 1:]
+    head = [layer for layer in after if not isinstance(layer, tf.keras.layers.Dropout)]
+    kinds = [type(layer) for layer in head]
+    expected = [tf.keras.layers.BatchNormalization, tf.keras.layers.Dense] * 2
+    activations = [getattr(head[i].activation, '__name__', '') for i in (1, 3)]
+    if kinds != expected or activations != ['relu', 'softmax']:
+        return None
+    return pooling[0], head
+
+
+def _bn_scale(layer):
+    """Per-channel multiplier of an inference-mode BatchNorm layer"""
+    scale = tf.math.rsqrt(layer.moving_variance + layer.epsilon)
+    return scale * layer.gamma if layer.scale else scale
+
+
+def make_cam(model):
+    """
+    Batched Grad-CAM of the top class as a function of the images, or None.
+    The gradient of the softmax score with respect to the pooled feature maps is
+    derived through the head in closed form; by the chain rule through the
+    average pooling it is proportional to the spatially averaged gradient that
+    classic Grad-CAM weights the last feature maps with.
+    """
+    layers = head_layers(model)
+    if layers is None:
+        return None
+    pooling, (bn1, dense1, bn2, dense2) = layers
+    feature_maps = tf.keras.Model(model.input, pooling.input)
+
+    def cam(images):
+        maps = feature_maps(images, training=False)
+        pooled = tf.reduce_mean(maps, axis=[1, 2])
+        hidden = dense1(bn1(pooled, training=False))
+        probabilities = dense2(bn2(hidden, training=False))
+
+        top = tf.one_hot(tf.argmax(probabilities, axis=-1), tf.shape(probabilities)[-1])
+        top_score = tf.reduce_sum(probabilities * top, axis=-1, keepdims=True)
+        grad_logits = top_score * (top - probabilities)  # d softmax_c / d logits
+        grad_hidden = tf.matmul(grad_logits, dense2.kernel, transpose_b=True) * _bn_scale(bn2)
+        grad_hidden *= tf.cast(hidden > 0, hidden.dtype)
+        grad_pooled = tf.matmul(grad_hidden, dense1.kernel, transpose_b=True) * _bn_scale(bn1)
+
+        heatmap = tf.nn.relu(tf.reduce_sum(maps * grad_pooled[:, tf.newaxis, tf.newaxis, :], axis=-1))
+        heatmap /= tf.reduce_max(heatmap, axis=[1, 2], keepdims=True) + 1e-8
+        return {"probabilities": probabilities, "heatmap": heatmap}
+    return cam
+
+
+def export_saved_model(model, embedding_model, export_dir):
+    """Write a SavedModel with dynamic-batch signatures; returns the signature names"""
+    spec = tf.TensorSpec([None] + list(IMG_SIZE) + [3], tf.float32, name=INPUT_NAME)
+    module = tf.Module()
+    module.model = model
+    signatures = {}
+
+    @tf.function(input_signature=[spec])
+    def classify(images):
+        return {"probabilities": model(images, training=False)}
+    signatures[SIGNATURE_CLASSIFY] = classify
+
+    if embedding_model is not None:
+        module.embedding_model = embedding_model
+
+        @tf.function(input_signature=[spec])
+        def classify_with_features(images):
+            probabilities, features = embedding_model(images, training=False)
+            return {"probabilities": probabilities, "features": features}
+        signatures[SIGNATURE_FEATURES] = classify_with_features
+
+    cam = make_cam(model)
+    if cam is None:
+        print("  Warning: classification head not recognised; exporting without the cam signature")
+    else:
+        signatures[SIGNATURE_CAM] = tf.function(cam, input_signature=[spec])
+
+    tf.saved_model.save(module, export_dir, signatures=signatures)
+    return list(signatures)
+
+
+def convert(model, tflite_path, embedding_model=None):
+    """Convert a Keras model with float16 weights and dynamic-batch signatures and write it to `tflite_path`"""
+    export_dir = tempfile.mkdtemp(prefix='saved_model_')
+    try:
+        signature_keys = export_saved_model(model, embedding_model, export_dir)
+        print(f"  Signatures: {', '.join(signature_keys)}")
+        converter = tf.lite.TFLiteConverter.from_saved_model(export_dir, signature_keys=signature_keys)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+        # Use float16 quantization for smaller size while keeping accuracy
+        converter.target_spec.supported_types = [tf.float16]
+
+        tflite_model = converter.convert()
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+    with open(tflite_path, 'wb') as f:
+        f.write(tflite_model)
+    return tflite_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--output', default=TFLITE_PATH)
+    parser.add_argument('--num-classes', type=int, default=len(CLASS_LABELS))
+    parser.add_argument('--arch', choices=ARCHITECTURES, default='densenet121')
+    parser.add_argument('--no-embeddings', action='store_true', help='leave out the classify_with_features signature')
+    args = parser.parse_args()
+
+    print("Step 1: Reconstructing model architecture...")
+    model, embedding_model = build_model(args.num_classes, args.arch)
+
+    print("Step 2: Loading weights...")
+    loaded = load_weights(model, args.model)
+    if loaded is not model:
+        # A directly loaded model has its own layers; rebuild the two-output view from them
+        dense_512 = [layer for layer in loaded.layers if isinstance(layer, tf.keras.layers.Dense) and layer.units == 512]
+        embedding_model = tf.keras.Model(loaded.input, [loaded.output, dense_512[-1].output]) if dense_512 else None
+        model = loaded
+
+    if args.no_embeddings:
+        embedding_model = None
+    elif embedding_model is None:
+        print("  Warning: no 512-unit Dense layer found; exporting probabilities only")
+    else:
+        print("  Exporting the 512-d penultimate layer as the features output")
+
+    print("Step 3: Converting to TFLite...")
+    print(f"Step 4: Saving to {args.output}...")
+    convert(model, args.output, embedding_model)
+
+    original_size = os.path.getsize(args.model) / (1024 * 1024)
+    tflite_size = os.path.getsize(args.output) / (1024 * 1024)
+    print(f"\nDone!")
+    print(f"  Original model.h5:  {original_size:.1f} MB")
+    print(f"  Converted model.tflite: {tflite_size:.1f} MB")
+    print(f"  Size reduction: {((original_size - tflite_size) / original_size * 100):.0f}%")
+    print(f"\nNow commit model.tflite to your repo and push to GitHub.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+DICOM and 16-bit radiograph ingestion without pydicom.
+Headers are parsed element by element and stop at PixelData, so no pixel bytes are
+read up front. Uncompressed pixel data is memory-mapped and converted to the model's
+224x224 input one strip of rows at a time, so no full-size float copy is ever built.
+
+Inspect a file:          python dicom_io.py study.dcm
+Write a test fixture:    python dicom_io.py --make-fixture fixture.dcm [--frames 3]
+"""
+
+import os
+import struct
+import numpy as np
+
+TARGET_SIZE = 224
+STRIP_ROWS = 28  # output rows converted per strip
+
+IMPLICIT_VR_LE = '1.2.840.10008.1.2'
+EXPLICIT_VR_LE = '1.2.840.10008.1.2.1'
+SUPPORTED_TRANSFER_SYNTAXES = {IMPLICIT_VR_LE, EXPLICIT_VR_LE}
+
+# Explicit VRs that use a 2-byte reserved field followed by a 4-byte length
+LONG_VRS = {b'OB', b'OD', b'OF', b'OL', b'OV', b'OW', b'SQ', b'SV', b'UC', b'UN', b'UR', b'UT', b'UV'}
+
+PIXEL_DATA = (0x7FE0, 0x0010)
+ITEM = (0xFFFE, 0xE000)
+ITEM_DELIMITER = (0xFFFE, 0xE00D)
+SEQUENCE_DELIMITER = (0xFFFE, 0xE0DD)
+UNDEFINED_LENGTH = 0xFFFFFFFF
+
+# Only these elements are decoded; everything else is skipped with a seek
+HEADER_TAGS = {
+    (0x0002, 0x0010): 'TransferSyntaxUID',
+    (0x0008, 0x0060): 'Modality',
+    (0x0028, 0x0002): 'SamplesPerPixel',
+    (0x0028, 0x0004): 'PhotometricInterpretation',
+    (0x0028, 0x0008): 'NumberOfFrames',
+    (0x0028, 0x0010): 'Rows',
+    (0x0028, 0x0011): 'Columns',
+    (0x0028, 0x0100): 'BitsAllocated',
+    (0x0028, 0x0101): 'BitsStored',
+    (0x0028, 0x0103): 'PixelRepresentation',
+    (0x0028, 0x1050): 'WindowCenter',
+    (0x0028, 0x1051): 'WindowWidth',
+    (0x0028, 0x1052): 'RescaleIntercept',
+    (0x0028, 0x1053): 'RescaleSlope',
+}
+NUMERIC_US = {'SamplesPerPixel', 'Rows', 'Columns', 'BitsAllocated', 'BitsStored', 'PixelRepresentation'}
+NUMERIC_TEXT = {'NumberOfFrames', 'WindowCenter', 'WindowWidth', 'RescaleIntercept', 'RescaleSlope'}
+
+
+class DicomError(ValueError):
+    """Raised for DICOM files this reader cannot handle"""
+
+
+def is_dicom(path):
+    """Check the 'DICM' magic after the 128-byte preamble"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(128)
+            return f.read(4) == b'DICM'
+    except OSError:
+        return False
+
+
+def _decode_value(name, raw):
+    """Decode the handful of header values the pipeline needs"""
+    if name in NUMERIC_US:
+        return struct.unpack('<H', raw[:2])[0]
+    text = raw.decode('ascii', errors='ignore').strip('\x00 ')
+    if name in NUMERIC_TEXT:
+        # Multi-valued strings such as window presets use backslash separators; keep the first
+        first = text.split('\\')[0].strip()
+        return float(first) if first else None
+    return text
+
+
+class _ElementReader:
+    """Sequential reader for one DICOM element stream"""
+
+    def __init__(self, f, explicit):
+        self.f = f
+        self.explicit = explicit
+
+    def read_tag(self):
+        raw = self.f.read(4)
+        if len(raw) < 4:
+            return None
+        group, element = struct.unpack('<HH', raw)
+        return group, element
+
+    def read_element_header(self, tag):
+        """Return (vr, length) for the element whose tag was just read"""
+        if tag[0] == 0xFFFE:
+            # Item and delimiter tags never carry a VR
+            return None, struct.unpack('<I', self.f.read(4))[0]
+        if self.explicit or tag[0] == 0x0002:
+            vr = self.f.read(2)
+            if vr in LONG_VRS:
+                self.f.read(2)
+                return vr, struct.unpack('<I', self.f.read(4))[0]
+            return vr, struct.unpack('<H', self.f.read(2))[0]
+        return None, struct.unpack('<I', self.f.read(4))[0]
+
+    def skip_undefined(self):
+        """Skip a sequence or item of undefined length up to its delimiter"""
+        while True:
+            tag = self.read_tag()
+            if tag is None:
+                raise DicomError("Unexpected end of file inside a sequence")
+            vr, length = self.read_element_header(tag)
+            if tag in (SEQUENCE_DELIMITER, ITEM_DELIMITER):
+                return
+            if length == UNDEFINED_LENGTH:
+                self.skip_undefined()
+            else:
+                self.f.seek(length, os.SEEK_CUR)
+
+
+def read_header(path):
+    """Parse the DICOM header up to PixelData without reading any pixel bytes"""
+    with open(path, 'rb') as f:
+        header = read_header_from(f)
+    header['path'] = str(path)
+    return header
+
+
+def read_header_from(f):
+    """Parse a DICOM header from an open binary stream positioned at the preamble"""
+    header = {
+        'SamplesPerPixel': 1,
+        'NumberOfFrames': 1,
+        'PixelRepresentation': 0,
+        'PhotometricInterpretation': 'MONOCHROME2',
+        'RescaleSlope': 1.0,
+        'RescaleIntercept': 0.0,
+    }
+    start = f.tell()
+    f.seek(start + 128)
+    if f.read(4) != b'DICM':
+        raise DicomError("Missing DICM magic")
+
+    reader = _ElementReader(f, explicit=True)
+    in_dataset = False
+    while True:
+        tag = reader.read_tag()
+        if tag is None:
+            raise DicomError("No PixelData element found")
+
+        # The file meta group is always explicit VR; the dataset follows the transfer syntax
+        if not in_dataset and tag[0] != 0x0002:
+            in_dataset = True
+            reader.explicit = header.get('TransferSyntaxUID', IMPLICIT_VR_LE) != IMPLICIT_VR_LE
+
+        try:
+            vr, length = reader.read_element_header(tag)
+        except struct.error:
+            raise DicomError("Truncated element header")
+        if tag == PIXEL_DATA:
+            if length == UNDEFINED_LENGTH:
+                raise DicomError("Encapsulated (compressed) pixel data is not supported")
+            header['PixelDataOffset'] = f.tell() - start
+            header['PixelDataLength'] = length
+            break
+
+        if length == UNDEFINED_LENGTH:
+            reader.skip_undefined()
+        elif tag in HEADER_TAGS:
+            name = HEADER_TAGS[tag]
+            header[name] = _decode_value(name, f.read(length))
+        else:
+            f.seek(length, os.SEEK_CUR)
+
+    syntax = header.get('TransferSyntaxUID', IMPLICIT_VR_LE)
+    if syntax not in SUPPORTED_TRANSFER_SYNTAXES:
+        raise DicomError(f"Unsupported transfer syntax {syntax}")
+    for required in ('Rows', 'Columns', 'BitsAllocated'):
+        if required not in header:
+            raise DicomError(f"Missing {required}")
+    header['NumberOfFrames'] = int(header.get('NumberOfFrames') or 1)
+    if header['RescaleSlope'] is None:
+        header['RescaleSlope'] = 1.0
+    if header['RescaleIntercept'] is None:
+        header['RescaleIntercept'] = 0.0
+    return header
+
+
+def pixel_memmap(header):
+    """Memory-map the raw pixel data as (frames, rows, cols[, samples])"""
+    bits = header['BitsAllocated']
+    if bits not in (8, 16):
+        raise DicomError(f"Unsupported BitsAllocated {bits}")
+    signed = header['PixelRepresentation'] == 1
+    dtype = {8: ('<i1' if signed else '<u1'), 16: ('<i2' if signed else '<u2')}[bits]
+
+    shape = (header['NumberOfFrames'], header['Rows'], header['Columns'])
+    if header['SamplesPerPixel'] > 1:
+        shape += (header['SamplesPerPixel'],)
+    expected = int(np.prod(shape)) * (bits // 8)
+    if header['PixelDataLength'] < expected:
+        raise DicomError("PixelData is shorter than Rows x Columns x Frames")
+    if os.path.getsize(header['path']) < header['PixelDataOffset'] + expected:
+        raise DicomError("File is truncated inside PixelData")
+    return np.memmap(header['path'], dtype=dtype, mode='r', offset=header['PixelDataOffset'], shape=shape)
+
+
+def _bin_edges(size, target):
+    """Integer bin edges that split `size` source pixels into `target` output pixels"""
+    return np.linspace(0, size, target + 1).astype(np.int64)
+
+
+def _voi_lut(values, center, width, invert):
+    """Apply the DICOM linear VOI window in place, mapping to [0, 1]"""
+    width = max(float(width), 1.0)
+    lower = center - 0.5 - (width - 1) / 2
+    np.subtract(values, lower, out=values)
+    np.divide(values, width - 1 if width > 1 else 1.0, out=values)
+    np.clip(values, 0.0, 1.0, out=values)
+    if invert:
+        np.subtract(1.0, values, out=values)
+    return values
+
+
+def window_and_resize(pixels, slope=1.0, intercept=0.0, center=None, width=None, invert=False, out=None):
+    """
+    Rescale, window and area-downsample a 2-D integer array to TARGET_SIZE x TARGET_SIZE.
+    Works on `STRIP_ROWS` output rows at a time so only a thin float strip is materialised.
+    """
+    rows, cols = pixels.shape[:2]
+    if out is None:
+        out = np.empty((TARGET_SIZE, TARGET_SIZE), dtype=np.float32)
+
+    if center is None or width is None:
+        # No VOI preset: window to the full stored range (integer reductions, no float copy)
+        low = float(pixels.min()) * slope + intercept
+        high = float(pixels.max()) * slope + intercept
+        center, width = (low + high) / 2 + 0.5, max(high - low, 1.0) + 1
+
+    if rows < TARGET_SIZE or cols < TARGET_SIZE:
+        # Upsampling: nearest-neighbour sampling is already cheap
+        r_idx = np.arange(TARGET_SIZE) * rows // TARGET_SIZE
+        c_idx = np.arange(TARGET_SIZE) * cols // TARGET_SIZE
+        sample = pixels[r_idx[:, None], c_idx[None, :]].astype(np.float32)
+        sample *= slope
+        sample += intercept
+        out[...] = _voi_lut(sample, center, width, invert)
+        return out
+
+    r_edges = _bin_edges(rows, TARGET_SIZE)
+    c_edges = _bin_edges(cols, TARGET_SIZE)
+    c_counts = np.diff(c_edges).astype(np.float32)
+    for start in range(0, TARGET_SIZE, STRIP_ROWS):
+        stop = min(start + STRIP_ROWS, TARGET_SIZE)
+        r0, r1 = r_edges[start], r_edges[stop]
+        strip = np.asarray(pixels[r0:r1], dtype=np.float32)
+        strip *= slope
+        strip += intercept
+        _voi_lut(strip, center, width, invert)
+
+        # Area average: sum each block of rows, then each block of columns
+        row_sums = np.add.reduceat(strip, r_edges[start:stop] - r0, axis=0)
+        block_sums = np.add.reduceat(row_sums, c_edges[:-1], axis=1)
+        r_counts = np.diff(r_edges[start:stop + 1]).astype(np.float32)
+        out[start:stop] = block_sums / (r_counts[:, None] * c_counts[None, :])
+    return out
+
+
+def _frame_to_gray(header, frame, out=None):
+    """Convert one memory-mapped frame to a 224x224 float32 image in [0, 1]"""
+    if frame.ndim == 3:
+        # Colour DICOM: chest radiographs are grey, so the first sample carries the image
+        frame = frame[..., 0]
+    return window_and_resize(
+        frame,
+        slope=header['RescaleSlope'],
+        intercept=header['RescaleIntercept'],
+        center=header.get('WindowCenter'),
+        width=header.get('WindowWidth'),
+        invert=header['PhotometricInterpretation'] == 'MONOCHROME1',
+        out=out,
+    )
+
+
+def iter_frames(header):
+    """Yield each frame as a (224, 224) float32 array, one frame at a time"""
+    pixels = pixel_memmap(header)
+    try:
+        for index in range(header['NumberOfFrames']):
+            yield index, _frame_to_gray(header, pixels[index])
+    finally:
+        del pixels
+
+
+def write_frame_into(header, pixels, index, buffer):
+    """Write frame `index` straight into a (224, 224, 3) input buffer, e.g. the interpreter's tensor"""
+    gray = _frame_to_gray(header, pixels[index])
+    buffer[...] = gray[:, :, None]
+
+
+def load_dicom(path, frame=0):
+    """Load a single DICOM frame as a (1, 224, 224, 3) float32 batch"""
+    header = read_header(path)
+    pixels = pixel_memmap(header)
+    gray = _frame_to_gray(header, pixels[frame])
+    del pixels
+    return np.repeat(gray[None, :, :, None], 3, axis=3)
+
+
+def load_high_bit_depth(img):
+    """Convert a 16-bit or 32-bit integer Pillow image into a (1, 224, 224, 3) float32 batch"""
+    pixels = np.asarray(img)
+    if pixels.ndim == 3:
+        pixels = pixels[..., 0]
+    gray = window_and_resize(pixels)
+    return np.repeat(gray[None, :, :, None], 3, axis=3)
+
+
+def write_synthetic_dicom(path, rows=512, cols=512, frames=1, bits=16, explicit=True,
+                          slope=1.0, intercept=0.0, window=None, monochrome1=False, seed=0):
+    """Write a small uncompressed DICOM fixture with a smooth gradient plus noise"""
+    rng = np.random.default_rng(seed)
+    max_value = (1 << (12 if bits == 16 else 8)) - 1
+    yy, xx = np.mgrid[0:rows, 0:cols]
+    base = (yy / max(rows - 1, 1) * 0.6 + xx / max(cols - 1, 1) * 0.4) * max_value
+    data = np.stack([
+        np.clip(base + rng.normal(0, max_value * 0.02, base.shape) + i * 10, 0, max_value)
+        for i in range(frames)
+    ]).astype('<u2' if bits == 16 else 'u1')
+
+    def element(group, elem, vr, value, force_explicit=False):
+        if isinstance(value, str):
+            value = value.encode('ascii')
+            if len(value) % 2:
+                value += b'\x00' if vr == b'UI' else b' '
+        tag = struct.pack('<HH', group, elem)
+        if not (explicit or force_explicit):
+            return tag + struct.pack('<I', len(value)) + value
+        if vr in LONG_VRS:
+            return tag + vr + b'\x00\x00' + struct.pack('<I', len(value)) + value
+        return tag + vr + struct.pack('<H', len(value)) + value
+
+    syntax = EXPLICIT_VR_LE if explicit else IMPLICIT_VR_LE
+    meta_body = element(0x0002, 0x0010, b'UI', syntax, force_explicit=True)
+    meta = element(0x0002, 0x0000, b'UL', struct.pack('<I', len(meta_body)), force_explicit=True) + meta_body
+
+    dataset = element(0x0008, 0x0060, b'CS', 'DX')
+    dataset += element(0x0028, 0x0002, b'US', struct.pack('<H', 1))
+    dataset += element(0x0028, 0x0004, b'CS', 'MONOCHROME1' if monochrome1 else 'MONOCHROME2')
+    if frames > 1:
+        dataset += element(0x0028, 0x0008, b'IS', str(frames))
+    dataset += element(0x0028, 0x0010, b'US', struct.pack('<H', rows))
+    dataset += element(0x0028, 0x0011, b'US', struct.pack('<H', cols))
+    dataset += element(0x0028, 0x0100, b'US', struct.pack('<H', bits))
+    dataset += element(0x0028, 0x0101, b'US', struct.pack('<H', 12 if bits == 16 else 8))
+    dataset += element(0x0028, 0x0103, b'US', struct.pack('<H', 0))
+    if window is not None:
+        dataset += element(0x0028, 0x1050, b'DS', str(window[0]))
+        dataset += element(0x0028, 0x1051, b'DS', str(window[1]))
+    dataset += element(0x0028, 0x1052, b'DS', str(intercept))
+    dataset += element(0x0028, 0x1053, b'DS', str(slope))
+    dataset += element(0x7FE0, 0x0010, b'OW' if bits == 16 else b'OB', data.tobytes())
+
+    with open(path, 'wb') as f:
+        f.write(b'\x00' * 128 + b'DICM' + meta + dataset)
+    return data
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path')
+    parser.add_argument('--make-fixture', action='store_true', help='write a synthetic DICOM to PATH first')
+    parser.add_argument('--frames', type=int, default=1)
+    parser.add_argument('--size', type=int, default=512)
+    args = parser.parse_args()
+
+    if args.make_fixture:
+        write_synthetic_dicom(args.path, rows=args.size, cols=args.size, frames=args.frames)
+        print(f"OK  Wrote {args.frames}-frame {args.size}x{args.size} fixture to {args.path}")
+
+    header = read_header(args.path)
+    for key in sorted(header):
+        print(f"  {key}: {header[key]}")
+    start = time.perf_counter()
+    for index, gray in iter_frames(header):
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"  frame {index}: min={gray.min():.3f} max={gray.max():.3f} mean={gray.mean():.3f} ({elapsed:.1f} ms)")
+        start = time.perf_counter()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Knowledge distillation: train a compact student on the DenseNet121 teacher's soft labels.
+Run this LOCALLY (it needs full TensorFlow); training runs on CPU.
+
+    python distill.py dataset --teacher model.tflite --output model_student.tflite
+
+The image directory does not need labels: every image under it is scored by the
+teacher (model.tflite, the deployed model) and the student (MobileNetV3Small with the
+same head, see training.build_model) learns to match the temperature-softened
+teacher distribution. The student is exported through convert_to_tflite.convert() and
+then checked against the teacher on a held-out split: top-1 agreement and per-image
+latency of both TFLite models.
+
+For a quick end-to-end check on tiny synthetic data (random-weight teacher if
+model.tflite is missing):
+
+    python distill.py --synthetic 64 --epochs 1 --output /tmp/student.tflite
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+
+import numpy as np
+from PIL import Image
+
+from evaluate import IMAGE_EXTENSIONS
+from inference import import_tflite, preprocess_image, run_inference
+from labels import CLASS_LABELS
+
+TEMPERATURE = 4.0
+SOFT_LABEL_CACHE = 'distill_soft_labels.npz'
+LATENCY_SAMPLES = 50
+
+
+def list_images(data_dir):
+    """All images under `data_dir` in a deterministic order; labels are not needed"""
+    paths = []
+    for root, _, files in os.walk(data_dir):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def make_synthetic_dataset(directory, count, seed=0):
+    """Write `count` small grayscale radiograph-like PNGs (noise plus soft blobs)"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    yy, xx = np.mgrid[0:256, 0:256] / 256.0
+    for i in range(count):
+        image = rng.normal(0.3, 0.05, (256, 256))
+        for _ in range(rng.integers(1, 4)):
+            cy, cx, radius = rng.random(3) * [1.0, 1.0, 0.2] + [0, 0, 0.05]
+            image += 0.5 * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * radius ** 2))
+        pixels = (np.clip(image, 0, 1) * 255).astype(np.uint8)
+        Image.fromarray(pixels, mode='L').save(os.path.join(directory, f"synthetic_{i:05d}.png"))
+    return directory
+
+
+def soften(probabilities, temperature):
+    """Re-temper softmax outputs: softmax(log(p) / T), computed stably"""
+    logits = np.log(np.clip(probabilities, 1e-7, 1.0)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def teacher_probabilities(teacher_path, paths, batch_size=16, threads=None, cache_path=SOFT_LABEL_CACHE):
+    """Teacher class probabilities for every image, cached per (teacher, image list)"""
+    key = hashlib.sha256((_file_digest(teacher_path) + '\n' + '\n'.join(paths)).encode('utf-8')).hexdigest()
+    if cache_path and os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        if str(cached['key']) == key:
+            print(f"OK  Reusing teacher outputs from {cache_path}")
+            return cached['probabilities']
+
+    tflite = import_tflite()
+    interpreter = tflite.Interpreter(model_path=str(teacher_path), num_threads=threads or os.cpu_count() or 1)
+    interpreter.allocate_tensors()
+
+    outputs = []
+    for start in range(0, len(paths), batch_size):
+        batch = np.concatenate([preprocess_image(path) for path in paths[start:start + batch_size]])
+        outputs.append(run_inference(interpreter, batch))
+        print(f"  teacher: {min(start + batch_size, len(paths))}/{len(paths)} images")
+    probabilities = np.concatenate(outputs).astype(np.float32)
+
+    if cache_path:
+        np.savez(cache_path, key=key, probabilities=probabilities)
+    return probabilities
+
+
+def split_holdout(count, fraction, seed=0):
+    """Deterministic (train, holdout) index split"""
+    order = np.random.default_rng(seed).permutation(count)
+    holdout = max(1, int(round(count * fraction))) if count > 1 else 0
+    return np.sort(order[holdout:]), np.sort(order[:holdout])
+
+
+def train_student(paths, soft_targets, num_classes, epochs, batch_size, learning_rate, temperature):
+    """Fit a MobileNetV3Small student to the softened teacher targets; returns the Keras model"""
+    import tensorflow as tf
+    from training import build_model
+
+    class SoftLabelSequence(tf.keras.utils.Sequence):
+        """Decodes each batch with the serving preprocess_image(), so train and serve inputs match"""
+
+        def __init__(self, indices, shuffle):
+            super().__init__()
+            self.indices = np.array(indices)
+            self.shuffle = shuffle
+            self.on_epoch_end()
+
+        def __len__(self):
+            return int(np.ceil(len(self.indices) / batch_size))
+
+        def __getitem__(self, i):
+            rows = self.order[i * batch_size:(i + 1) * batch_size]
+            images = np.concatenate([preprocess_image(paths[row]) for row in rows])
+            return images, soft_targets[rows]
+
+        def on_epoch_end(self):
+            self.order = np.random.permutation(self.indices) if self.shuffle else self.indices
+
+    def distillation_loss(teacher_soft, student_probabilities):
+        # KL(teacher_T || student_T), scaled by T^2 so gradients keep their magnitude (Hinton et al.)
+        student_log = tf.math.log(tf.clip_by_value(student_probabilities, 1e-7, 1.0)) / temperature
+        student_log_soft = tf.nn.log_softmax(student_log)
+        teacher_log_soft = tf.math.log(tf.clip_by_value(teacher_soft, 1e-7, 1.0))
+        return tf.reduce_sum(teacher_soft * (teacher_log_soft - student_log_soft), axis=-1) * temperature ** 2
+
+    student, _ = build_model(num_classes, arch='mobilenetv3small')
+    student.compile(optimizer=tf.keras.optimizers.Adam(learning_rate), loss=distillation_loss)
+    student.fit(SoftLabelSequence(np.arange(len(paths)), shuffle=True), epochs=epochs, verbose=2)
+    return student
+
+
+def compare(teacher_path, student_path, paths, teacher_probs, threads=1, latency_samples=LATENCY_SAMPLES):
+    """Top-1 agreement on the holdout images plus single-image latency of both TFLite models"""
+    tflite = import_tflite()
+    interpreters = {}
+    for name, path in (('teacher', teacher_path), ('student', student_path)):
+        interpreters[name] = tflite.Interpreter(model_path=str(path), num_threads=threads)
+        interpreters[name].allocate_tensors()
+
+    student_top1 = []
+    latency = {'teacher': [], 'student': []}
+    for i, path in enumerate(paths):
+        image = preprocess_image(path)
+        start = time.perf_counter()
+        student_top1.append(int(run_inference(interpreters['student'], image)[0].argmax()))
+        latency['student'].append(time.perf_counter() - start)
+        if i < latency_samples:
+            start = time.perf_counter()
+            run_inference(interpreters['teacher'], image)
+            latency['teacher'].append(time.perf_counter() - start)
+
+    agreement = float(np.mean(np.array(student_top1) == teacher_probs.argmax(axis=1))) if paths else 0.0
+    # Skip the first call of each model; it includes tensor allocation
+    teacher_ms = float(np.median(latency['teacher'][1:] or latency['teacher']) * 1000)
+    student_ms = float(np.median(latency['student'][1:] or latency['student']) * 1000)
+    return {
+        "holdout_images": len(paths),
+        "top1_agreement": agreement,
+        "teacher_ms_per_image": teacher_ms,
+        "student_ms_per_image": student_ms,
+        "speedup": teacher_ms / student_ms if student_ms else 0.0,
+        "teacher_mb": os.path.getsize(teacher_path) / (1024 * 1024),
+        "student_mb": os.path.getsize(student_path) / (1024 * 1024),
+        "threads": threads,
+    }
+
+
+def _random_teacher(directory, num_classes):
+    """Export an untrained DenseNet121 teacher so the synthetic run needs no model files"""
+    from convert_to_tflite import convert
+    from training import build_model
+    print("  No teacher model found; exporting a random-weight DenseNet121 for the synthetic run")
+    model, _ = build_model(num_classes)
+    return convert(model, os.path.join(directory, 'teacher.tflite'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data_dir', nargs='?', help='directory of training images (sub-folders are searched)')
+    parser.add_argument('--teacher', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model.tflite'))
+    parser.add_argument('--output', default='model_student.tflite')
+    parser.add_argument('--synthetic', type=int, default=0, metavar='N', help='generate N synthetic images instead of reading data_dir')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--temperature', type=float, default=TEMPERATURE)
+    parser.add_argument('--holdout', type=float, default=0.1, help='fraction of images kept for validation')
+    parser.add_argument('--threads', type=int, default=1, help='interpreter threads for the latency comparison')
+    parser.add_argument('--cache', default=SOFT_LABEL_CACHE, help="teacher output cache ('' to disable)")
+    parser.add_argument('--min-agreement', type=float, help='exit non-zero if holdout top-1 agreement is below this')
+    parser.add_argument('--report', help='write the validation results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix='distill_') if args.synthetic else None
+    try:
+        if args.synthetic:
+            data_dir = make_synthetic_dataset(os.path.join(scratch, 'images'), args.synthetic)
+        elif args.data_dir:
+            data_dir = args.data_dir
+        else:
+            parser.error('data_dir is required unless --synthetic is given')
+
+        teacher_path = args.teacher
+        if not os.path.exists(teacher_path):
+            if not args.synthetic:
+                raise SystemExit(f"ERR Teacher model not found: {teacher_path}")
+            teacher_path = _random_teacher(scratch, len(CLASS_LABELS))
+
+        paths = list_images(data_dir)
+        if len(paths) < 2:
+            raise SystemExit(f"ERR Need at least two images under {data_dir}")
+        print(f"Step 1: Scoring {len(paths)} images with the teacher ({teacher_path})...")
+        teacher_probs = teacher_probabilities(teacher_path, paths, cache_path=args.cache)
+        if teacher_probs.shape[1] != len(CLASS_LABELS):
+            raise SystemExit(f"ERR Teacher has {teacher_probs.shape[1]} outputs but CLASS_LABELS has {len(CLASS_LABELS)}")
+
+        train_rows, holdout_rows = split_holdout(len(paths), args.holdout)
+        train_paths = [paths[i] for i in train_rows]
+        holdout_paths = [paths[i] for i in holdout_rows]
+
+        print(f"Step 2: Training the student on {len(train_paths)} images (T={args.temperature})...")
+        student = train_student(
+            train_paths, soften(teacher_probs[train_rows], args.temperature), len(CLASS_LABELS),
+            args.epochs, args.batch_size, args.learning_rate, args.temperature,
+        )
+
+        print(f"Step 3: Exporting the student to {args.output}...")
+        from convert_to_tflite import convert
+        convert(student, args.output)
+
+        print(f"Step 4: Comparing student and teacher on {len(holdout_paths)} held-out images...")
+        report = compare(teacher_path, args.output, holdout_paths, teacher_probs[holdout_rows], threads=args.threads)
+        print(f"\nTop-1 agreement: {report['top1_agreement']:.4f}")
+        print(f"Latency: teacher {report['teacher_ms_per_image']:.1f} ms, student {report['student_ms_per_image']:.1f} ms "
+              f"({report['speedup']:.1f}x faster, {args.threads} thread(s))")
+        print(f"Size: teacher {report['teacher_mb']:.1f} MB, student {report['student_mb']:.1f} MB")
+
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"\nOK  Report written to {args.report}")
+        if args.min_agreement is not None and report['top1_agreement'] < args.min_agreement:
+            print(f"ERR Top-1 agreement {report['top1_agreement']:.4f} is below --min-agreement {args.min_agreement}")
+            return 1
+        return 0
+    finally:
+        # The synthetic dataset and random teacher only exist for this run
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+Streaming input/output drift monitor for /api/predict.
+The request thread hands over references to the preprocessed tensor, the upload
+dimensions and the served probabilities with a non-blocking queue put; a
+background worker turns them into features and adds them to fixed-bin histograms.
+Each tumbling time window (aligned to multiples of the window length) has one
+set of histograms, so memory is constant whatever the traffic. When a window
+closes it is compared with a reference window by Jensen-Shannon divergence per
+feature. The reference is the first window with enough samples unless one is
+pinned; it is persisted so restarts keep comparing against the same baseline.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+INTENSITY_BINS = 32
+DARK_LEVEL = 0.05
+BRIGHT_LEVEL = 0.95
+SMOOTHING = 0.5  # pseudo-count per bin so empty bins do not make the divergence blow up
+
+# name -> (low, high, bins); values outside the range land in the edge bins
+SCALAR_FEATURES = {
+    "intensity_mean": (0.0, 1.0, 20),
+    "intensity_std": (0.0, 0.5, 20),
+    "dark_fraction": (0.0, 1.0, 20),
+    "bright_fraction": (0.0, 1.0, 20),
+    "log2_width": (7.0, 13.0, 12),
+    "log2_height": (7.0, 13.0, 12),
+    "log2_aspect_ratio": (-1.5, 1.5, 12),
+    "top1_margin": (0.0, 1.0, 20),
+}
+PROBABILITY_BINS = 20
+
+
+def js_divergence(p_counts, q_counts):
+    """Jensen-Shannon divergence (base 2, in [0, 1]) between two histograms of counts"""
+    p = np.asarray(p_counts, dtype=np.float64) + SMOOTHING
+    q = np.asarray(q_counts, dtype=np.float64) + SMOOTHING
+    p /= p.sum()
+    q /= q.sum()
+    m = (p + q) / 2
+    return float(0.5 * np.sum(p * np.log2(p / m)) + 0.5 * np.sum(q * np.log2(q / m)))
+
+
+def _bin(value, low, high, bins):
+    return min(bins - 1, max(0, int((value - low) / (high - low) * bins)))
+
+
+class WindowSketch:
+    """Histograms of every feature over one time window"""
+
+    def __init__(self, class_labels, start):
+        self.start = start
+        self.samples = 0
+        self.histograms = {name: np.zeros(bins, dtype=np.int64) for name, (_, _, bins) in SCALAR_FEATURES.items()}
+        self.histograms["intensity"] = np.zeros(INTENSITY_BINS, dtype=np.int64)
+        self.histograms["top1_class"] = np.zeros(len(class_labels), dtype=np.int64)
+        for label in class_labels:
+            self.histograms[f"probability:{label}"] = np.zeros(PROBABILITY_BINS, dtype=np.int64)
+
+    def add(self, scalars, intensity_counts, probabilities, class_labels):
+        self.samples += 1
+        for name, value in scalars.items():
+            low, high, bins = SCALAR_FEATURES[name]
+            self.histograms[name][_bin(value, low, high, bins)] += 1
+        if intensity_counts is not None:
+            self.histograms["intensity"] += intensity_counts
+        if probabilities is not None:
+            self.histograms["top1_class"][int(np.argmax(probabilities))] += 1
+            for label, p in zip(class_labels, probabilities):
+                self.histograms[f"probability:{label}"][_bin(p, 0.0, 1.0, PROBABILITY_BINS)] += 1
+
+    def divergence(self, reference):
+        """Per-feature JS divergence against another window (features with data on both sides)"""
+        return {
+            name: round(js_divergence(counts, reference.histograms[name]), 4)
+            for name, counts in self.histograms.items()
+            if counts.any() and name in reference.histograms and reference.histograms[name].any()
+        }
+
+
+def image_features(batch, width=None, height=None):
+    """(scalar features, pooled intensity histogram) of a preprocessed (1, 224, 224, 3) batch"""
+    scalars = {}
+    intensity_counts = None
+    if batch is not None:
+        gray = batch[0].mean(axis=-1)[::2, ::2]
+        scalars["intensity_mean"] = float(gray.mean())
+        scalars["intensity_std"] = float(gray.std())
+        scalars["dark_fraction"] = float((gray < DARK_LEVEL).mean())
+        scalars["bright_fraction"] = float((gray > BRIGHT_LEVEL).mean())
+        levels = np.clip((gray * INTENSITY_BINS).astype(np.int64), 0, INTENSITY_BINS - 1)
+        intensity_counts = np.bincount(levels.ravel(), minlength=INTENSITY_BINS)
+    if width and height:
+        scalars["log2_width"] = float(np.log2(width))
+        scalars["log2_height"] = float(np.log2(height))
+        scalars["log2_aspect_ratio"] = float(np.log2(width / height))
+    return scalars, intensity_counts
+
+
+class DriftMonitor:
+    """Tumbling-window feature histograms, divergence from a reference window, off the request path"""
+
+    def __init__(self, class_labels, window_seconds=3600, min_samples=50, threshold=0.1,
+                 history=24, reference_path=None, max_pending=256):
+        self.class_labels = list(class_labels)
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.threshold = threshold
+        self.reference_path = reference_path
+        self.current = WindowSketch(self.class_labels, self._window_start(time.time()))
+        self.reference = None
+        self.reference_source = None
+        self.last_closed = None
+        self.closed = deque(maxlen=history)  # summaries of closed windows, newest last
+        self.observed = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._load_reference()
+
+        self._worker = threading.Thread(target=self._run, name='drift-monitor', daemon=True)
+        self._worker.start()
+
+    def _window_start(self, now):
+        return now - now % self.window_seconds
+
+    def observe(self, batch, width, height, probabilities):
+        """Queue one prediction's inputs and outputs; never blocks, False when dropped"""
+        try:
+            self._queue.put_nowait((time.time(), batch, width, height, probabilities))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            observed_at, batch, width, height, probabilities = self._queue.get()
+            try:
+                scalars, intensity_counts = image_features(batch, width, height)
+                if probabilities is not None:
+                    probabilities = np.asarray(probabilities, dtype=np.float64)
+                    top2 = np.sort(probabilities)[-2:]
+                    scalars["top1_margin"] = float(top2[-1] - top2[0])
+                with self._lock:
+                    self._roll(observed_at)
+                    self.current.add(scalars, intensity_counts, probabilities, self.class_labels)
+                    self.observed += 1
+            except Exception as e:
+                print(f"WARN  Drift monitor could not record a sample: {e}")
+
+    def _roll(self, now):
+        """Close the current window once `now` is past it; the caller holds the lock"""
+        start = self._window_start(now)
+        if start <= self.current.start:
+            return
+        closed = self.current
+        self.current = WindowSketch(self.class_labels, start)
+        if closed.samples == 0:
+            return
+        self.last_closed = closed
+        if self.reference is None and closed.samples >= self.min_samples:
+            self._set_reference(closed, "first_window")
+            print(f"OK  Drift reference set from the window starting {time.strftime('%Y-%m-%d %H:%M', time.gmtime(closed.start))} UTC ({closed.samples} samples)")
+        summary = self._summary(closed)
+        self.closed.append(summary)
+        if summary["drifted_features"]:
+            print(f"WARN  Drift in window of {summary['samples']} samples: max JS {summary['max_divergence']} "
+                  f"({', '.join(summary['drifted_features'])})")
+
+    def _summary(self, sketch, detail=False):
+        summary = {
+            "start": sketch.start,
+            "samples": sketch.samples,
+            "max_divergence": None,
+            "drifted_features": [],
+        }
+        if self.reference is not None and sketch is not self.reference and sketch.samples >= self.min_samples:
+            divergence = sketch.divergence(self.reference)
+            summary["max_divergence"] = max(divergence.values()) if divergence else None
+            summary["drifted_features"] = sorted(name for name, value in divergence.items() if value > self.threshold)
+            if detail:
+                summary["divergence"] = divergence
+        return summary
+
+    def _set_reference(self, sketch, source):
+        self.reference = sketch
+        self.reference_source = source
+        if not self.reference_path:
+            return
+        try:
+            tmp_path = f"{self.reference_path}.tmp.npz"
+            np.savez(tmp_path, start=sketch.start, samples=sketch.samples,
+                     **{f"h_{name}": counts for name, counts in sketch.histograms.items()})
+            os.replace(tmp_path, self.reference_path)
+        except OSError as e:
+            print(f"WARN  Could not save drift reference to {self.reference_path}: {e}")
+
+    def _load_reference(self):
+        if not self.reference_path or not os.path.exists(self.reference_path):
+            return
+        try:
+            with np.load(self.reference_path) as data:
+                sketch = WindowSketch(self.class_labels, float(data["start"]))
+                sketch.samples = int(data["samples"])
+                for name, counts in sketch.histograms.items():
+                    stored = data[f"h_{name}"]
+                    if stored.shape != counts.shape:
+                        raise ValueError(f"{name} has {stored.shape} bins, expected {counts.shape}")
+                    sketch.histograms[name] = stored.astype(np.int64)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"WARN  Ignoring drift reference {self.reference_path}: {e}")
+            return
+        self.reference = sketch
+        self.reference_source = "file"
+        print(f"OK  Drift reference loaded ({sketch.samples} samples)")
+
+    def pin_reference(self):
+        """Make the last closed window the reference (e.g. after onboarding a new site); returns it or None"""
+        with self._lock:
+            self._roll(time.time())
+            sketch = self.last_closed
+            if sketch is None:
+                return None
+            self._set_reference(sketch, "pinned")
+            return {"start": sketch.start, "samples": sketch.samples}
+
+    def stats(self, detail=False):
+        with self._lock:
+            self._roll(time.time())
+            return {
+                "window_seconds": self.window_seconds,
+                "threshold": self.threshold,
+                "observed": self.observed,
+                "dropped": self.dropped,
+                "pending": self._queue.qsize(),
+                "reference": {
+                    "start": self.reference.start,
+                    "samples": self.reference.samples,
+                    "source": self.reference_source,
+                } if self.reference is not None else None,
+                "current": self._summary(self.current, detail=True),
+                "last_window": self._summary(self.last_closed, detail=True) if self.last_closed is not None else None,
+                "windows": list(self.closed),
+                **({"histograms": {
+                    "current": {name: counts.tolist() for name, counts in self.current.histograms.items()},
+                    "reference": {name: counts.tolist() for name, counts in self.reference.histograms.items()}
+                    if self.reference is not None else None,
+                }} if detail else {}),
+            }
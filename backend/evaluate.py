@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Offline evaluation of model.tflite against a labelled image directory.
+Expects the class-per-folder layout used by the training notebooks:
+
+    dataset/
+        COVID-19/*.png
+        Normal/*.png
+        ...
+
+Images are decoded and preprocessed in parallel worker processes with the same
+preprocess_image() used by /api/predict, then scored in batches on one interpreter.
+Progress is checkpointed, so an interrupted run resumes where it stopped:
+
+    python evaluate.py dataset --model model.tflite --workers 8 --batch-size 32
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+
+import numpy as np
+
+from inference import import_tflite, preprocess_image, run_inference
+from labels import CLASS_LABELS
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.dcm')
+ECE_BINS = 15
+CHECKPOINT_EVERY = 1000  # images
+
+
+def discover(data_dir, class_labels):
+    """List (path, class_idx) pairs in a deterministic order; unknown folders are skipped"""
+    samples = []
+    for class_idx, label in enumerate(class_labels):
+        class_dir = os.path.join(data_dir, label)
+        if not os.path.isdir(class_dir):
+            print(f"WARN  No folder for class '{label}' in {data_dir}")
+            continue
+        for root, _, files in os.walk(class_dir):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    samples.append((os.path.join(root, name), class_idx))
+    samples.sort()
+    for entry in sorted(os.listdir(data_dir)):
+        if os.path.isdir(os.path.join(data_dir, entry)) and entry not in class_labels:
+            print(f"WARN  Skipping folder '{entry}': not in CLASS_LABELS")
+    return samples
+
+
+def _load(sample):
+    """Worker: decode and preprocess one image; errors are returned, not raised"""
+    path, class_idx = sample
+    try:
+        return path, class_idx, preprocess_image(path)[0], None
+    except Exception as e:
+        return path, class_idx, None, str(e)
+
+
+class EvaluationState:
+    """Running counts that are enough to rebuild every metric, so they can be checkpointed"""
+
+    def __init__(self, num_classes, fingerprint):
+        self.fingerprint = fingerprint
+        self.next_index = 0
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        self.bin_count = np.zeros(ECE_BINS, dtype=np.int64)
+        self.bin_confidence = np.zeros(ECE_BINS, dtype=np.float64)
+        self.bin_correct = np.zeros(ECE_BINS, dtype=np.float64)
+        self.failures = []
+        self.decode_wait_seconds = 0.0
+        self.inference_seconds = 0.0
+        self.wall_seconds = 0.0
+
+    def update(self, labels, probabilities):
+        predicted = probabilities.argmax(axis=1)
+        confidence = probabilities.max(axis=1)
+        np.add.at(self.confusion, (labels, predicted), 1)
+        bins = np.minimum((confidence * ECE_BINS).astype(np.int64), ECE_BINS - 1)
+        np.add.at(self.bin_count, bins, 1)
+        np.add.at(self.bin_confidence, bins, confidence)
+        np.add.at(self.bin_correct, bins, (predicted == labels).astype(np.float64))
+
+    def to_dict(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "next_index": self.next_index,
+            "confusion": self.confusion.tolist(),
+            "bin_count": self.bin_count.tolist(),
+            "bin_confidence": self.bin_confidence.tolist(),
+            "bin_correct": self.bin_correct.tolist(),
+            "failures": self.failures,
+            "decode_wait_seconds": self.decode_wait_seconds,
+            "inference_seconds": self.inference_seconds,
+            "wall_seconds": self.wall_seconds,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(len(data["confusion"]), data["fingerprint"])
+        state.next_index = data["next_index"]
+        state.confusion = np.array(data["confusion"], dtype=np.int64)
+        state.bin_count = np.array(data["bin_count"], dtype=np.int64)
+        state.bin_confidence = np.array(data["bin_confidence"], dtype=np.float64)
+        state.bin_correct = np.array(data["bin_correct"], dtype=np.float64)
+        state.failures = data["failures"]
+        state.decode_wait_seconds = data["decode_wait_seconds"]
+        state.inference_seconds = data["inference_seconds"]
+        state.wall_seconds = data["wall_seconds"]
+        return state
+
+
+def save_checkpoint(path, state):
+    """Write the checkpoint atomically so an interruption never leaves a torn file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state.to_dict(), f)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, fingerprint, num_classes):
+    """Resume from a checkpoint if it belongs to the same model and dataset"""
+    if path and os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("fingerprint") == fingerprint:
+            print(f"OK  Resuming from {path} at image {data['next_index']}")
+            return EvaluationState.from_dict(data)
+        print(f"WARN  Ignoring {path}: it was written for a different model or dataset")
+    return EvaluationState(num_classes, fingerprint)
+
+
+def fingerprint_run(model_path, samples):
+    """Identify a (model, dataset) pair so checkpoints are never applied to the wrong run"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    for path, class_idx in samples:
+        digest.update(f"{path}\0{class_idx}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def compute_metrics(state, class_labels):
+    """Accuracy, per-class precision/recall/F1, expected calibration error and throughput"""
+    confusion = state.confusion
+    total = int(confusion.sum())
+    true_positive = np.diag(confusion).astype(np.float64)
+    predicted_totals = confusion.sum(axis=0)
+    actual_totals = confusion.sum(axis=1)
+    precision = np.divide(true_positive, predicted_totals, out=np.zeros_like(true_positive), where=predicted_totals > 0)
+    recall = np.divide(true_positive, actual_totals, out=np.zeros_like(true_positive), where=actual_totals > 0)
+    f1_denominator = precision + recall
+    f1 = np.divide(2 * precision * recall, f1_denominator, out=np.zeros_like(precision), where=f1_denominator > 0)
+
+    occupied = state.bin_count > 0
+    bin_confidence = np.divide(state.bin_confidence, state.bin_count, out=np.zeros(ECE_BINS), where=occupied)
+    bin_accuracy = np.divide(state.bin_correct, state.bin_count, out=np.zeros(ECE_BINS), where=occupied)
+    ece = float((state.bin_count / max(total, 1) * np.abs(bin_accuracy - bin_confidence)).sum())
+
+    return {
+        "images": total,
+        "failures": len(state.failures),
+        "accuracy": float(true_positive.sum() / total) if total else 0.0,
+        "per_class": {
+            label: {
+                "precision": float(precision[i]),
+                "recall": float(recall[i]),
+                "f1": float(f1[i]),
+                "support": int(actual_totals[i]),
+            }
+            for i, label in enumerate(class_labels)
+        },
+        "confusion_matrix": confusion.tolist(),
+        "ece": ece,
+        "calibration": {
+            "bin_count": state.bin_count.tolist(),
+            "bin_confidence": bin_confidence.tolist(),
+            "bin_accuracy": bin_accuracy.tolist(),
+        },
+        "throughput": {
+            "wall_seconds": state.wall_seconds,
+            "images_per_second": total / state.wall_seconds if state.wall_seconds else 0.0,
+            "decode_wait_seconds": state.decode_wait_seconds,
+            "inference_seconds": state.inference_seconds,
+            "inference_ms_per_image": state.inference_seconds / total * 1000 if total else 0.0,
+        },
+    }
+
+
+def print_report(metrics, class_labels):
+    print(f"\nImages: {metrics['images']}  (failed to decode: {metrics['failures']})")
+    print(f"Accuracy: {metrics['accuracy']:.4f}   ECE: {metrics['ece']:.4f}")
+    print(f"\n{'Class':<18}{'Precision':>10}{'Recall':>10}{'F1':>10}{'Support':>10}")
+    for label in class_labels:
+        row = metrics['per_class'][label]
+        print(f"{label:<18}{row['precision']:>10.4f}{row['recall']:>10.4f}{row['f1']:>10.4f}{row['support']:>10}")
+
+    print("\nConfusion matrix (rows = actual, columns = predicted):")
+    width = max(len(label) for label in class_labels) + 2
+    print(" " * width + "".join(f"{i:>8}" for i in range(len(class_labels))))
+    for i, label in enumerate(class_labels):
+        print(f"{label:<{width}}" + "".join(f"{n:>8}" for n in metrics['confusion_matrix'][i]))
+
+    throughput = metrics['throughput']
+    print(f"\nThroughput: {throughput['images_per_second']:.1f} images/s "
+          f"({throughput['inference_ms_per_image']:.1f} ms/image inference, "
+          f"{throughput['wall_seconds']:.1f}s wall)")
+
+
+def evaluate(data_dir, model_path, workers, batch_size, threads, checkpoint_path, class_labels=CLASS_LABELS):
+    """Run the evaluation and return the metrics dict"""
+    samples = discover(data_dir, class_labels)
+    if not samples:
+        raise SystemExit(f"ERR No images found under {data_dir}")
+    print(f"OK  Found {len(samples)} images in {len(class_labels)} classes")
+
+    fingerprint = fingerprint_run(model_path, samples)
+    state = load_checkpoint(checkpoint_path, fingerprint, len(class_labels))
+    remaining = samples[state.next_index:]
+
+    tflite = import_tflite()
+    interpreter = tflite.Interpreter(model_path=str(model_path), num_threads=threads)
+    interpreter.allocate_tensors()
+
+    def score(batch):
+        images = np.stack([item[2] for item in batch])
+        labels = np.array([item[1] for item in batch], dtype=np.int64)
+        start = time.perf_counter()
+        probabilities = run_inference(interpreter, images)
+        state.inference_seconds += time.perf_counter() - start
+        state.update(labels, probabilities)
+
+    run_start = time.perf_counter()
+    wall_before = state.wall_seconds
+    last_checkpoint = state.next_index
+    batch = []
+    with Pool(processes=workers) as pool:
+        decode_start = time.perf_counter()
+        # imap keeps input order, so next_index always marks a contiguous processed prefix
+        for path, class_idx, image, error in pool.imap(_load, remaining, chunksize=8):
+            state.decode_wait_seconds += time.perf_counter() - decode_start
+            state.next_index += 1
+            if error is not None:
+                state.failures.append({"path": path, "error": error})
+            else:
+                batch.append((path, class_idx, image))
+
+            if len(batch) == batch_size:
+                score(batch)
+                batch = []
+            if checkpoint_path and state.next_index - last_checkpoint >= CHECKPOINT_EVERY and not batch:
+                state.wall_seconds = wall_before + time.perf_counter() - run_start
+                save_checkpoint(checkpoint_path, state)
+                last_checkpoint = state.next_index
+                print(f"  {state.next_index}/{len(samples)} images")
+            decode_start = time.perf_counter()
+        if batch:
+            score(batch)
+
+    state.wall_seconds = wall_before + time.perf_counter() - run_start
+    if checkpoint_path:
+        save_checkpoint(checkpoint_path, state)
+    return compute_metrics(state, class_labels)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data_dir', help='directory with one sub-folder per class')
+    parser.add_argument('--model', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model.tflite'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='decode processes')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='interpreter threads')
+    parser.add_argument('--checkpoint', default='eval_checkpoint.json', help="resume file ('' to disable)")
+    parser.add_argument('--output', help='write the metrics as JSON to this path')
+    args = parser.parse_args(argv)
+
+    metrics = evaluate(args.data_dir, args.model, args.workers, args.batch_size, args.threads, args.checkpoint)
+    print_report(metrics, CLASS_LABELS)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(metrics, f, indent=2)
+        print(f"\nOK  Metrics written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
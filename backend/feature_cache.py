@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Frozen-backbone feature cache for fast head retraining.
+Run this LOCALLY (extraction needs full TensorFlow).
+
+    python feature_cache.py extract dataset --cache features
+    python feature_cache.py train --cache features --epochs 50 --output model.tflite
+
+`extract` runs the DenseNet121 backbone (from --model, or ImageNet weights) once
+per image and appends the pooled 1024-d features to features.f16, a float16 array
+read back through a memory map, with one index.jsonl line per row (path, content
+digest, label). Re-running it over a grown dataset only computes the images that
+are new or whose content changed. Folders that are not in labels.CLASS_LABELS become
+extra classes after the known ones.
+
+`train` fits the classifier head (BatchNorm, Dense(512), BatchNorm, Dense(n), as in
+training.build_model) on the cached features, which takes seconds instead of
+hours, then grafts it onto the backbone and exports through convert_to_tflite.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from multiprocessing.pool import ThreadPool
+
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+
+import numpy as np
+
+from evaluate import discover
+from inference import preprocess_image
+from labels import CLASS_LABELS
+
+FEATURE_DIM = 1024  # DenseNet121 channels after global average pooling
+EXTRACT_BATCH = 32
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FeatureStore:
+    """Append-only float16 feature rows plus a JSON-lines index, in one directory"""
+
+    def __init__(self, directory, backbone, dim=FEATURE_DIM):
+        self.directory = directory
+        self.features_path = os.path.join(directory, 'features.f16')
+        self.index_path = os.path.join(directory, 'index.jsonl')
+        meta_path = os.path.join(directory, 'meta.json')
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["backbone"] != backbone or meta["dim"] != dim:
+                raise SystemExit(f"ERR {directory} holds features of another backbone ({meta['backbone']}); use a new --cache")
+        else:
+            with open(meta_path, 'w') as f:
+                json.dump({"backbone": backbone, "dim": dim, "dtype": "float16"}, f)
+        self.dim = dim
+        self.records = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.records = [json.loads(line) for line in f if line.strip()]
+        # Rows are written before their index lines, so a crash can only leave unindexed rows behind
+        row_bytes = dim * 2
+        stored_rows = os.path.getsize(self.features_path) // row_bytes if os.path.exists(self.features_path) else 0
+        self.records = self.records[:stored_rows]
+        if stored_rows > len(self.records):
+            with open(self.features_path, 'r+b') as f:
+                f.truncate(len(self.records) * row_bytes)
+        self._latest = {record["path"]: row for row, record in enumerate(self.records)}
+
+    def __len__(self):
+        return len(self.records)
+
+    def is_current(self, path, digest):
+        row = self._latest.get(path)
+        return row is not None and self.records[row]["digest"] == digest
+
+    def append(self, features, records):
+        features = np.asarray(features, dtype=np.float16).reshape(len(records), self.dim)
+        with open(self.features_path, 'ab') as f:
+            features.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.index_path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        for record in records:
+            self._latest[record["path"]] = len(self.records)
+            self.records.append(record)
+
+    def features(self):
+        """All rows as a read-only memory map (no copy)"""
+        if not self.records:
+            return np.zeros((0, self.dim), dtype=np.float16)
+        return np.memmap(self.features_path, dtype=np.float16, mode='r', shape=(len(self.records), self.dim))
+
+    def training_set(self, class_names):
+        """(float32 features, class indices) of the current row for every path whose label is known"""
+        rows = sorted(row for row in self._latest.values() if self.records[row]["label"] in class_names)
+        labels = np.array([class_names.index(self.records[row]["label"]) for row in rows], dtype=np.int64)
+        return np.asarray(self.features()[rows], dtype=np.float32), labels
+
+    def labels(self):
+        return sorted({self.records[row]["label"] for row in self._latest.values()})
+
+
+def class_names_for(labels):
+    """CLASS_LABELS first (their indices must not move), then extra classes alphabetically"""
+    return list(CLASS_LABELS) + sorted(set(labels) - set(CLASS_LABELS))
+
+
+def backbone_name(model_path, weights):
+    if model_path and os.path.exists(model_path):
+        return f"densenet121:{file_digest(model_path)[:16]}"
+    return f"densenet121:{weights}"
+
+
+def build_feature_model(model_path, weights):
+    """Keras model image -> pooled backbone features, and the full model it came from"""
+    import tensorflow as tf
+    from training import build_model
+
+    model, _ = build_model(len(CLASS_LABELS), weights=None if model_path and os.path.exists(model_path) else weights)
+    if model_path and os.path.exists(model_path):
+        from convert_to_tflite import load_weights
+        model = load_weights(model, model_path)
+    pooling = next(layer for layer in model.layers if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D))
+    return tf.keras.Model(model.input, pooling.output), model
+
+
+def _decode(path):
+    try:
+        return preprocess_image(path)[0]
+    except Exception as e:
+        print(f"WARN  Skipping {path}: {e}")
+        return None
+
+
+def extract(data_dir, store, feature_model, batch_size=EXTRACT_BATCH, workers=None):
+    """Append features for images that are new or changed; returns (computed, skipped)"""
+    folders = sorted(entry for entry in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, entry)))
+    class_names = class_names_for(folders)
+    samples = discover(data_dir, class_names)
+    pending = []
+    for path, class_idx in samples:
+        digest = file_digest(path)
+        if not store.is_current(os.path.abspath(path), digest):
+            pending.append({"path": os.path.abspath(path), "digest": digest, "label": class_names[class_idx]})
+
+    computed = 0
+    # PIL decoding releases the GIL, so threads overlap it with the backbone
+    with ThreadPool(workers or os.cpu_count()) as pool:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            images = pool.map(_decode, [record["path"] for record in batch])
+            kept = [(record, image) for record, image in zip(batch, images) if image is not None]
+            if not kept:
+                continue
+            features = feature_model.predict_on_batch(np.stack([image for _, image in kept]))
+            store.append(np.asarray(features), [record for record, _ in kept])
+            computed += len(kept)
+            print(f"  {computed}/{len(pending)} new images")
+    return computed, len(samples) - len(pending)
+
+
+# Heads
+
+def build_head(num_classes, dim=FEATURE_DIM):
+    """The classifier head of training.build_model, on pooled features instead of images"""
+    import tensorflow as tf
+
+    inputs = tf.keras.Input(shape=(dim,))
+    x = tf.keras.layers.BatchNormalization()(inputs)
+    x = tf.keras.layers.Dropout(0.5)(x)
+    x = tf.keras.layers.Dense(512, activation='relu')(x)
+    x = tf.keras.layers.BatchNormalization()(x)
+    x = tf.keras.layers.Dropout(0.3)(x)
+    outputs = tf.keras.layers.Dense(num_classes, activation='softmax')(x)
+    return tf.keras.Model(inputs, outputs)
+
+
+def _weighted_head_layers(model):
+    """BatchNorm, Dense(512), BatchNorm, Dense(n) of a full model or a head, in order"""
+    import tensorflow as tf
+
+    head_types = (tf.keras.layers.BatchNormalization, tf.keras.layers.Dense)
+    layers = [layer for layer in model.layers if isinstance(layer, head_types)]
+    return layers[-4:]
+
+
+def init_head_from(head, model):
+    """
+    Start from an existing model's head. With extra classes, the known classes keep their
+    output weights and only the new columns start fresh.
+    """
+    for target, source in zip(_weighted_head_layers(head), _weighted_head_layers(model)):
+        weights = source.get_weights()
+        current = target.get_weights()
+        if [w.shape for w in weights] != [w.shape for w in current]:
+            known = weights[0].shape[-1]
+            current[0][:, :known] = weights[0]
+            current[1][:known] = weights[1]
+            weights = current
+        target.set_weights(weights)
+
+
+def train_head(features, labels, num_classes, epochs, batch_size=256, learning_rate=1e-3, holdout=0.1, source_model=None):
+    """Fit a head on cached features; returns (head, validation accuracy or None)"""
+    import tensorflow as tf
+    from distill import split_holdout
+
+    head = build_head(num_classes, features.shape[1])
+    if source_model is not None:
+        init_head_from(head, source_model)
+    head.compile(optimizer=tf.keras.optimizers.Adam(learning_rate), loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    train_rows, val_rows = split_holdout(len(labels), holdout) if holdout else (np.arange(len(labels)), [])
+    validation = (features[val_rows], labels[val_rows]) if len(val_rows) else None
+    head.fit(features[train_rows], labels[train_rows], epochs=epochs, batch_size=batch_size,
+             validation_data=validation, verbose=2,
+             callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy' if validation else 'accuracy',
+                                                         patience=10, restore_best_weights=True)])
+    accuracy = head.evaluate(*validation, verbose=0)[1] if validation else None
+    return head, accuracy
+
+
+def graft(head, backbone_model, num_classes):
+    """Full (model, embedding_model) with the source backbone and the new head"""
+    import tensorflow as tf
+    from training import build_model
+
+    model, embedding_model = build_model(num_classes)
+    source_backbone = next(layer for layer in backbone_model.layers if isinstance(layer, tf.keras.Model))
+    target_backbone = next(layer for layer in model.layers if isinstance(layer, tf.keras.Model))
+    target_backbone.set_weights(source_backbone.get_weights())
+    for target, source in zip(_weighted_head_layers(model), _weighted_head_layers(head)):
+        target.set_weights(source.get_weights())
+    return model, embedding_model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    extract_parser = commands.add_parser('extract', help='compute backbone features for new or changed images')
+    extract_parser.add_argument('data_dir', nargs='?', help='dataset with one folder per class')
+    extract_parser.add_argument('--synthetic', type=int, default=0, metavar='N', help='generate N synthetic images per class')
+
+    train_parser = commands.add_parser('train', help='fit a head on cached features and export it')
+    train_parser.add_argument('--epochs', type=int, default=50)
+    train_parser.add_argument('--batch-size', type=int, default=256)
+    train_parser.add_argument('--learning-rate', type=float, default=1e-3)
+    train_parser.add_argument('--holdout', type=float, default=0.1)
+    train_parser.add_argument('--fresh', action='store_true', help="don't start from the --model head")
+    train_parser.add_argument('--output', default='model.tflite', help="TFLite export ('' to skip)")
+    train_parser.add_argument('--save', help='also save the grafted Keras model (.h5)')
+    train_parser.add_argument('--no-embeddings', action='store_true', help='export class probabilities only')
+
+    for sub in (extract_parser, train_parser):
+        sub.add_argument('--cache', default='feature_cache', help='feature cache directory')
+        sub.add_argument('--model', default='model.h5', help='trained model whose backbone is frozen')
+        sub.add_argument('--weights', choices=('imagenet', 'none'), default='imagenet',
+                         help='backbone weights when --model does not exist')
+    args = parser.parse_args(argv)
+
+    weights = None if args.weights == 'none' else args.weights
+    feature_model, model = build_feature_model(args.model, weights)
+    store = FeatureStore(args.cache, backbone_name(args.model, args.weights))
+
+    if args.command == 'extract':
+        data_dir = args.data_dir
+        if args.synthetic:
+            import tempfile
+            from distill import make_synthetic_dataset
+            data_dir = os.path.join(tempfile.mkdtemp(prefix='features_'), 'dataset')
+            for class_idx, label in enumerate(CLASS_LABELS):
+                make_synthetic_dataset(os.path.join(data_dir, label), args.synthetic, seed=class_idx)
+        if not data_dir:
+            parser.error('data_dir is required unless --synthetic is given')
+        computed, skipped = extract(data_dir, store, feature_model)
+        print(f"OK  {computed} images extracted, {skipped} already cached; {len(store)} rows in {args.cache}")
+        return 0
+
+    class_names = class_names_for(store.labels())
+    features, labels = store.training_set(class_names)
+    if len(labels) < 2:
+        raise SystemExit(f"ERR Need at least two cached images in {args.cache}; run extract first")
+    print(f"Step 1: Training a {len(class_names)}-class head on {len(labels)} cached feature rows...")
+    head, accuracy = train_head(features, labels, len(class_names), args.epochs, args.batch_size,
+                                args.learning_rate, args.holdout, None if args.fresh else model)
+    if accuracy is not None:
+        print(f"  Validation accuracy: {accuracy:.4f}")
+    if class_names != CLASS_LABELS:
+        print(f"WARN  Classes differ from labels.CLASS_LABELS; deploy with CLASS_LABELS = {class_names}")
+
+    full_model, embedding_model = graft(head, model, len(class_names))
+    if args.save:
+        full_model.save(args.save)
+    if args.output:
+        from convert_to_tflite import convert
+        print(f"Step 2: Exporting to {args.output}...")
+        convert(full_model, args.output, None if args.no_embeddings else embedding_model)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
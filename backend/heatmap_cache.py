@@ -0,0 +1,151 @@
+"""
+Rendered Grad-CAM overlays as cacheable binary resources.
+An overlay is stored once under an id derived from the uploaded image bytes, so
+re-running an explanation (UI refresh, report generation) reuses it instead of
+recomputing gradients. Entries hold the PNG plus a lazily encoded WebP variant,
+each with a content-hash ETag, in an LRU bounded by total bytes.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, features
+
+OVERLAY_SIZE = (224, 224)
+OVERLAY_ALPHA = 0.4
+WEBP_QUALITY = 90
+MIME_TYPES = {"png": "image/png", "webp": "image/webp"}
+WEBP_AVAILABLE = features.check('webp')
+
+
+def heatmap_id(image_bytes, model_tag=""):
+    """Resource id for the overlay of these upload bytes under a given model"""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(model_tag.encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def render_overlay(original_img, heatmap):
+    """Blend a [0, 1] (h, w) Grad-CAM map, jet-coloured, over a PIL image; returns an RGB PIL image"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import cm
+
+    jet = matplotlib.colormaps['jet'] if hasattr(matplotlib, 'colormaps') else cm.get_cmap('jet')
+    jet_colors = jet(np.arange(256))[:, :3]
+    jet_heatmap = jet_colors[np.uint8(255 * np.clip(heatmap, 0, 1))]
+    jet_heatmap_img = Image.fromarray(np.uint8(jet_heatmap * 255)).resize(OVERLAY_SIZE)
+    base = original_img.convert('RGB').resize(OVERLAY_SIZE)
+    return Image.blend(base, jet_heatmap_img.convert('RGB'), alpha=OVERLAY_ALPHA)
+
+
+def encode(image, fmt):
+    buffer = BytesIO()
+    if fmt == 'webp':
+        image.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def etag_for(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class HeatmapCache:
+    """Byte-bounded LRU of rendered overlays: id -> {png, webp, class, ...}"""
+
+    def __init__(self, max_bytes=32 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def put(self, key, image, predicted_class=None):
+        """Store an overlay (PIL image) and return its PNG bytes"""
+        png = encode(image, 'png')
+        entry = {
+            "image": None,  # kept only until the WebP variant is encoded
+            "variants": {"png": (png, etag_for(png))},
+            "predicted_class": predicted_class,
+            "created_at": time.time(),
+        }
+        if WEBP_AVAILABLE:
+            entry["image"] = image
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = entry
+            self.bytes += self._size(entry)
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                self._discard(next(iter(self._entries)))
+                self.evicted += 1
+        return png
+
+    def get(self, key):
+        """The entry for `key` (and mark it recently used), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def variant(self, key, fmt):
+        """(bytes, etag) of one encoding, encoding WebP on first request; None if unknown"""
+        entry = self.get(key)
+        if entry is None or (fmt == 'webp' and not WEBP_AVAILABLE):
+            return None
+        with self._lock:
+            # Check and encode together: a concurrent request must not drop the image mid-encode
+            if fmt not in entry["variants"] and entry["image"] is not None:
+                data = encode(entry["image"], fmt)
+                tracked = self._entries.get(key) is entry
+                if tracked:
+                    self.bytes -= self._size(entry)
+                entry["variants"][fmt] = (data, etag_for(data))
+                entry["image"] = None
+                if tracked:
+                    self.bytes += self._size(entry)
+            return entry["variants"].get(fmt)
+
+    def _size(self, entry):
+        pixels = entry["image"].width * entry["image"].height * 3 if entry["image"] is not None else 0
+        return pixels + sum(len(data) for data, _ in entry["variants"].values())
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= self._size(entry)
+
+    def clear(self):
+        """Memory-governor shrinker"""
+        with self._lock:
+            if not self._entries:
+                return None
+            released = f"dropped {len(self._entries)} overlays ({self.bytes / 2 ** 20:.1f} MB)"
+            self._entries.clear()
+            self.bytes = 0
+            return released
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evicted": self.evicted,
+                "webp": WEBP_AVAILABLE,
+            }
@@ -0,0 +1,263 @@
+"""
+Per-user prediction history backed by SQLite.
+Records are queued by the request thread and written in batches by a background
+writer, so saving history never adds latency to /api/predict. Listing uses keyset
+pagination over (created_at, id) and per-class totals are kept in a counter table
+that is updated in the same transaction as each insert.
+"""
+
+import atexit
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+THUMBNAIL_SIZE = (96, 96)
+WRITE_BATCH_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    study_id TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    class_idx INTEGER NOT NULL,
+    confidence REAL NOT NULL,
+    probabilities BLOB NOT NULL,
+    mode TEXT NOT NULL,
+    filename TEXT,
+    thumbnail_hash TEXT REFERENCES thumbnails(hash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_predictions_user_time
+    ON predictions (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_predictions_user_class_time
+    ON predictions (user_id, class_idx, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_predictions_thumbnail
+    ON predictions (thumbnail_hash, user_id);
+
+CREATE TABLE IF NOT EXISTS class_counts (
+    user_id TEXT NOT NULL,
+    class_idx INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, class_idx)
+) WITHOUT ROWID;
+"""
+
+
+def encode_cursor(created_at, row_id):
+    """Opaque keyset cursor for the next page"""
+    return f"{created_at!r}_{row_id}"
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    created_at, row_id = cursor.rsplit('_', 1)
+    return float(created_at), int(row_id)
+
+
+def make_thumbnail(pixels):
+    """Encode a (H, W, 3) uint8 array as a small JPEG"""
+    img = Image.fromarray(pixels)
+    img.thumbnail(THUMBNAIL_SIZE)
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=80)
+    return buffer.getvalue()
+
+
+class PredictionHistory:
+    """SQLite history store with an asynchronous, batched writer"""
+
+    def __init__(self, db_path, class_labels, max_pending=1000):
+        self.db_path = str(db_path)
+        self.class_labels = list(class_labels)
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name='history-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self):
+        """One read connection per request thread; WAL lets reads run alongside the writer"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    # Writes
+
+    def record(self, study_id, user_id, class_idx, confidence, probabilities, mode, filename=None, thumbnail=None):
+        """
+        Queue a prediction for storage without blocking.
+        `thumbnail` is an optional (H, W, 3) uint8 array; encoding happens on the writer thread.
+        Returns False if the queue is full and the record was dropped.
+        """
+        item = {
+            "study_id": study_id,
+            "user_id": user_id,
+            "created_at": time.time(),
+            "class_idx": int(class_idx),
+            "confidence": float(confidence),
+            "probabilities": np.asarray(probabilities, dtype=np.float32).tobytes(),
+            "mode": mode,
+            "filename": filename,
+            "thumbnail": thumbnail,
+        }
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _write_loop(self):
+        conn = self._connect()
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            taken = len(batch)
+            # None is the shutdown sentinel queued by close()
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+            try:
+                if batch:
+                    self._write_batch(conn, batch)
+            finally:
+                # Only now do the taken records stop counting as in flight for flush()
+                for _ in range(taken):
+                    self._queue.task_done()
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        try:
+            with conn:
+                for item in batch:
+                    thumbnail_hash = None
+                    if item["thumbnail"] is not None:
+                        # Identical images share one stored thumbnail
+                        thumbnail_hash = hashlib.sha256(item["thumbnail"].tobytes()).hexdigest()
+                        exists = conn.execute(
+                            'SELECT 1 FROM thumbnails WHERE hash = ?', (thumbnail_hash,)
+                        ).fetchone()
+                        if not exists:
+                            jpeg = make_thumbnail(item["thumbnail"])
+                            conn.execute('INSERT OR IGNORE INTO thumbnails (hash, data) VALUES (?, ?)',
+                                         (thumbnail_hash, jpeg))
+                    inserted = conn.execute(
+                        'INSERT OR IGNORE INTO predictions '
+                        '(study_id, user_id, created_at, class_idx, confidence, probabilities, mode, filename, thumbnail_hash) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (item["study_id"], item["user_id"], item["created_at"], item["class_idx"],
+                         item["confidence"], item["probabilities"], item["mode"], item["filename"], thumbnail_hash)
+                    ).rowcount
+                    if not inserted:
+                        continue
+                    conn.execute(
+                        'INSERT INTO class_counts (user_id, class_idx, count) VALUES (?, ?, 1) '
+                        'ON CONFLICT (user_id, class_idx) DO UPDATE SET count = count + 1',
+                        (item["user_id"], item["class_idx"])
+                    )
+        except sqlite3.Error as e:
+            print(f"ERR History write failed ({len(batch)} records): {e}")
+
+    def flush(self, timeout=5.0):
+        """Wait until queued records have been written (used by shutdown and offline tools)"""
+        deadline = time.time() + timeout
+        # unfinished_tasks covers records still queued and the batch the writer is committing
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+
+    # Reads
+
+    def _row_to_dict(self, row):
+        row_id, study_id, created_at, class_idx, confidence, probabilities, mode, filename, thumbnail_hash = row
+        probs = np.frombuffer(probabilities, dtype=np.float32)
+        return {
+            "id": row_id,
+            "study_id": study_id,
+            "created_at": created_at,
+            "class": self.class_labels[class_idx] if class_idx < len(self.class_labels) else str(class_idx),
+            "confidence": confidence,
+            "all_predictions": {
+                label: float(probs[i]) for i, label in enumerate(self.class_labels) if i < len(probs)
+            },
+            "mode": mode,
+            "filename": filename,
+            "thumbnail": thumbnail_hash,
+        }
+
+    def list(self, user_id, limit=50, cursor=None, class_idx=None):
+        """Return (records, next_cursor) newest first, using keyset pagination"""
+        sql = ('SELECT id, study_id, created_at, class_idx, confidence, probabilities, mode, filename, thumbnail_hash '
+               'FROM predictions WHERE user_id = ?')
+        params = [user_id]
+        if class_idx is not None:
+            sql += ' AND class_idx = ?'
+            params.append(class_idx)
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            sql += ' AND (created_at, id) < (?, ?)'
+            params.extend([created_at, row_id])
+        sql += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._reader().execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+        return [self._row_to_dict(row) for row in rows], next_cursor
+
+    def class_counts(self, user_id):
+        """Per-class totals read from the incrementally maintained counter table"""
+        rows = self._reader().execute(
+            'SELECT class_idx, count FROM class_counts WHERE user_id = ?', (user_id,)
+        ).fetchall()
+        counts = {label: 0 for label in self.class_labels}
+        for class_idx, count in rows:
+            if class_idx < len(self.class_labels):
+                counts[self.class_labels[class_idx]] = count
+        return counts
+
+    def thumbnail(self, user_id, thumbnail_hash):
+        """JPEG bytes for a thumbnail the user owns, or None"""
+        row = self._reader().execute(
+            'SELECT t.data FROM thumbnails t WHERE t.hash = ? AND EXISTS '
+            '(SELECT 1 FROM predictions p WHERE p.thumbnail_hash = t.hash AND p.user_id = ?)',
+            (thumbnail_hash, user_id)
+        ).fetchone()
+        return row[0] if row else None
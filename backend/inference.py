@@ -0,0 +1,323 @@
+"""
+Shared TFLite inference helpers.
+Kept free of Flask so that offline tools can run the exact same code path as /api/predict.
+
+Models exported by convert_to_tflite.py have a dynamic batch dimension and named
+signatures (classify, classify_with_features, cam). The server wraps them in a
+SignatureModel with one interpreter per preallocated batch size, and older models
+without signatures in a FixedBatchModel that does the same with plain interpreters,
+so a request never resizes or reallocates tensors. Offline tools may still pass bare
+interpreters, which are resized to whatever batch they are given.
+"""
+
+import queue
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+import dicom_io
+
+INPUT_SHAPE = (224, 224, 3)
+INPUT_NAME = 'images'
+SIGNATURE_CLASSIFY = 'classify'
+SIGNATURE_FEATURES = 'classify_with_features'
+SIGNATURE_CAM = 'cam'
+
+
+def import_tflite():
+    """Return the TFLite interpreter module (lightweight tflite_runtime, ~2MB vs ~620MB for full TensorFlow)"""
+    try:
+        import tflite_runtime.interpreter as tflite
+    except ImportError:
+        # Fallback: use full TensorFlow's TFLite interpreter if tflite_runtime not available
+        import tensorflow as tf
+        tflite = tf.lite
+    return tflite
+
+
+def preprocess_image(image_path):
+    """Preprocess image for TFLite inference using Pillow (no TensorFlow needed)"""
+    if dicom_io.is_dicom(image_path):
+        return dicom_io.load_dicom(image_path)
+    img = Image.open(image_path)
+    if img.mode in ('I;16', 'I;16B', 'I;16L', 'I'):
+        # 16-bit radiographs would saturate in a plain RGB conversion; window them instead
+        return dicom_io.load_high_bit_depth(img)
+    img = img.convert('RGB')
+    img = img.resize((224, 224))
+    img_array = np.array(img, dtype=np.float32) / 255.0
+    img_array = np.expand_dims(img_array, axis=0)
+    return img_array
+
+
+def signature_keys(interpreter):
+    """Names of the model's signatures; empty for models exported without them"""
+    get_signature_list = getattr(interpreter, 'get_signature_list', None)
+    return set(get_signature_list()) if get_signature_list is not None else set()
+
+
+def output_indices(interpreter):
+    """
+    Return (class_output_index, embedding_output_index or None).
+    Models converted with the penultimate-layer embedding expose it as a second, wider output.
+    """
+    outputs = interpreter.get_output_details()
+    if len(outputs) == 1:
+        return outputs[0]['index'], None
+    by_width = sorted(outputs, key=lambda detail: detail['shape'][-1])
+    return by_width[0]['index'], by_width[-1]['index']
+
+
+def run_inference(interpreter, batch, with_embeddings=False):
+    """
+    Run a (N, 224, 224, 3) float batch through a TFLite interpreter and return (N, classes) probabilities.
+    With `with_embeddings`, return (probabilities, embeddings or None) instead.
+    """
+    if isinstance(interpreter, (SignatureModel, FixedBatchModel)):
+        return interpreter.classify(batch, with_embeddings)
+    signatures = signature_keys(interpreter)
+    if signatures:
+        # Offline tools load the model directly; the runner resizes to the batch as needed
+        key = SIGNATURE_FEATURES if SIGNATURE_FEATURES in signatures else SIGNATURE_CLASSIFY
+        outputs = interpreter.get_signature_runner(key)(**{INPUT_NAME: np.asarray(batch, dtype=np.float32)})
+        return _split_outputs(outputs, with_embeddings)
+
+    input_details = interpreter.get_input_details()
+    input_index = input_details[0]['index']
+
+    # The converted model has a fixed batch of 1; resize only when the batch shape changes
+    if tuple(input_details[0]['shape']) != tuple(batch.shape):
+        interpreter.resize_tensor_input(input_index, list(batch.shape))
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()
+
+    # Handle float16 quantized models
+    input_dtype = input_details[0]['dtype']
+    if batch.dtype != input_dtype:
+        batch = batch.astype(input_dtype)
+
+    interpreter.set_tensor(input_index, batch)
+    interpreter.invoke()
+    return _read_outputs(interpreter, with_embeddings)
+
+
+def _read_outputs(interpreter, with_embeddings):
+    class_index, embedding_index = output_indices(interpreter)
+    probabilities = np.array(interpreter.get_tensor(class_index), dtype=np.float32)
+    if not with_embeddings:
+        return probabilities
+    embeddings = None
+    if embedding_index is not None:
+        embeddings = np.array(interpreter.get_tensor(embedding_index), dtype=np.float32)
+    return probabilities, embeddings
+
+
+def _split_outputs(outputs, with_embeddings):
+    probabilities = np.array(outputs['probabilities'], dtype=np.float32)
+    if not with_embeddings:
+        return probabilities
+    embeddings = outputs.get('features')
+    return probabilities, np.array(embeddings, dtype=np.float32) if embeddings is not None else None
+
+
+def _run_padded(batch, batch_sizes, staging, call):
+    """
+    Named outputs of `call(size, inputs)` over an (N, 224, 224, 3) batch of any N. Each chunk
+    is padded up to the nearest preallocated size, or split by the largest.
+    """
+    batch = np.asarray(batch, dtype=np.float32)
+    parts = []
+    start = 0
+    while start < len(batch):
+        remaining = len(batch) - start
+        size = next((s for s in batch_sizes if s >= remaining), batch_sizes[-1])
+        count = min(size, remaining)
+        if count == size:
+            inputs = batch[start:start + size]
+        else:
+            # Rows past `count` keep whatever the last call left there; their outputs are dropped
+            inputs = staging[size]
+            inputs[:count] = batch[start:start + count]
+        outputs = call(size, inputs)
+        parts.append({name: np.array(value[:count], dtype=np.float32) for name, value in outputs.items()})
+        start += count
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def top1_margin(probabilities):
+    """Gap between the two highest class probabilities of a single prediction"""
+    top2 = np.partition(np.asarray(probabilities, dtype=np.float32), -2)[-2:]
+    return float(top2[1] - top2[0])
+
+
+def run_in_place(interpreter, fill, with_embeddings=False):
+    """Let `fill` write one (224, 224, 3) image straight into the interpreter's input buffer, then invoke"""
+    if isinstance(interpreter, (SignatureModel, FixedBatchModel)):
+        return interpreter.classify_staged(fill, with_embeddings)
+    if signature_keys(interpreter):
+        image = np.empty(INPUT_SHAPE, dtype=np.float32)
+        fill(image)
+        return run_inference(interpreter, image[None], with_embeddings)
+
+    input_details = interpreter.get_input_details()
+    input_index = input_details[0]['index']
+    if tuple(input_details[0]['shape']) != (1, 224, 224, 3):
+        interpreter.resize_tensor_input(input_index, [1, 224, 224, 3])
+        interpreter.allocate_tensors()
+
+    # interpreter.tensor() returns a view; it must be released before invoke()
+    fill(interpreter.tensor(input_index)()[0])
+    interpreter.invoke()
+    return _read_outputs(interpreter, with_embeddings)
+
+
+class SignatureModel:
+    """
+    One pool slot for a dynamic-batch model: an interpreter per preallocated batch size.
+    Every interpreter runs its signature once at load, so its tensor arena is sized for
+    its batch and later calls neither resize nor reallocate. A batch is padded up to the
+    nearest preallocated size, or split by the largest; inputs are staged in buffers
+    owned by the slot. Classification always runs classify_with_features when the model
+    has it, so only one subgraph per interpreter holds an arena on the hot path; cam is
+    allocated on first use.
+    """
+
+    def __init__(self, interpreters):
+        self._interpreters = dict(interpreters)  # batch size -> interpreter
+        self.batch_sizes = sorted(self._interpreters)
+        self.signatures = signature_keys(self._interpreters[self.batch_sizes[0]])
+        self.primary = SIGNATURE_FEATURES if SIGNATURE_FEATURES in self.signatures else SIGNATURE_CLASSIFY
+        self._staging = {size: np.zeros((size,) + INPUT_SHAPE, dtype=np.float32) for size in self.batch_sizes}
+        self._runners = {}
+        for size in self.batch_sizes:
+            self._runner(self.primary, size)(**{INPUT_NAME: self._staging[size]})
+
+    def _runner(self, key, size):
+        runner = self._runners.get((key, size))
+        if runner is None:
+            runner = self._runners[(key, size)] = self._interpreters[size].get_signature_runner(key)
+        return runner
+
+    def run(self, key, batch):
+        """Named outputs of signature `key` for an (N, 224, 224, 3) batch of any N"""
+        return _run_padded(batch, self.batch_sizes, self._staging,
+                           lambda size, inputs: self._runner(key, size)(**{INPUT_NAME: inputs}))
+
+    def classify(self, batch, with_embeddings=False):
+        return _split_outputs(self.run(self.primary, batch), with_embeddings)
+
+    def classify_staged(self, fill, with_embeddings=False):
+        """Single image written by `fill` into the smallest staging buffer"""
+        size = self.batch_sizes[0]
+        fill(self._staging[size][0])
+        outputs = self._runner(self.primary, size)(**{INPUT_NAME: self._staging[size]})
+        return _split_outputs({name: value[:1] for name, value in outputs.items()}, with_embeddings)
+
+    def cam(self, batch):
+        """(probabilities, (N, h, w) Grad-CAM maps in [0, 1]) from the in-graph cam signature"""
+        outputs = self.run(SIGNATURE_CAM, batch)
+        return outputs['probabilities'], outputs['heatmap']
+
+
+class FixedBatchModel:
+    """
+    One pool slot for a model without signatures: a plain interpreter per batch size, each
+    resized and allocated once at load. Batched TTA views run on their own interpreter, so
+    switching between single images and batches never reallocates a tensor arena.
+    """
+
+    signatures = frozenset()
+
+    def __init__(self, interpreters):
+        self._interpreters = dict(interpreters)  # batch size -> interpreter
+        self.batch_sizes = sorted(self._interpreters)
+        self._inputs = {}
+        self._outputs = {}
+        for size, interpreter in self._interpreters.items():
+            detail = interpreter.get_input_details()[0]
+            if tuple(detail['shape']) != (size,) + INPUT_SHAPE:
+                interpreter.resize_tensor_input(detail['index'], [size, *INPUT_SHAPE])
+                interpreter.allocate_tensors()
+                detail = interpreter.get_input_details()[0]
+            self._inputs[size] = (detail['index'], detail['dtype'])
+            self._outputs[size] = output_indices(interpreter)
+        self._staging = {size: np.zeros((size,) + INPUT_SHAPE, dtype=np.float32) for size in self.batch_sizes}
+
+    def _invoke(self, size, inputs):
+        interpreter = self._interpreters[size]
+        input_index, input_dtype = self._inputs[size]
+        # Handle float16 quantized models
+        interpreter.set_tensor(input_index, inputs.astype(input_dtype, copy=False))
+        interpreter.invoke()
+        return self._read(size)
+
+    def _read(self, size):
+        interpreter = self._interpreters[size]
+        class_index, embedding_index = self._outputs[size]
+        outputs = {'probabilities': interpreter.get_tensor(class_index)}
+        if embedding_index is not None:
+            outputs['features'] = interpreter.get_tensor(embedding_index)
+        return outputs
+
+    def classify(self, batch, with_embeddings=False):
+        return _split_outputs(_run_padded(batch, self.batch_sizes, self._staging, self._invoke), with_embeddings)
+
+    def classify_staged(self, fill, with_embeddings=False):
+        """Single image written by `fill` straight into the smallest interpreter's input tensor"""
+        size = self.batch_sizes[0]
+        interpreter = self._interpreters[size]
+        # interpreter.tensor() returns a view; it must be released before invoke()
+        fill(interpreter.tensor(self._inputs[size][0])()[0])
+        interpreter.invoke()
+        return _split_outputs({name: value[:1] for name, value in self._read(size).items()}, with_embeddings)
+
+
+class InterpreterPool:
+    """
+    A fixed set of interpreters shared by request threads.
+    A TFLite interpreter is not thread-safe, so each request leases one for the whole
+    set-invoke-read sequence; invoke() releases the GIL, so leases run in parallel.
+    """
+
+    def __init__(self, interpreters, config=None):
+        self.interpreters = list(interpreters)
+        self.config = dict(config or {})
+        self._idle = queue.Queue()
+        for interpreter in self.interpreters:
+            self._idle.put(interpreter)
+
+    def __len__(self):
+        return len(self.interpreters)
+
+    @contextmanager
+    def acquire(self):
+        interpreter = self._idle.get()
+        try:
+            yield interpreter
+        finally:
+            self._idle.put(interpreter)
+
+    @property
+    def signatures(self):
+        """Signatures served by the pooled models (empty for plain interpreters)"""
+        first = self.interpreters[0] if self.interpreters else None
+        return first.signatures if isinstance(first, SignatureModel) else set()
+
+    def describe(self):
+        return {**self.config, "pool_size": len(self.interpreters), "idle": self._idle.qsize(),
+                "signatures": sorted(self.signatures)}
+
+    def shrink(self, keep=1):
+        """Drop idle interpreters beyond `keep` to free their tensor arenas; returns how many went"""
+        released = 0
+        while len(self.interpreters) > keep:
+            try:
+                interpreter = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.interpreters.remove(interpreter)
+            released += 1
+        return released
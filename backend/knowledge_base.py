@@ -0,0 +1,170 @@
+"""
+Local retrieval over the bundled medical FAQ corpus, used by /api/chat.
+Every *.json file in the knowledge directory holds a list of entries
+{id, topic, questions, answer}; drop in more files to extend the corpus.
+Entries are scored with BM25 over an inverted index whose per-posting term
+weights are precomputed at build time, so a query is a handful of NumPy
+scatter-adds. The index is persisted as a single .npz keyed by a hash of the
+corpus and only rebuilt when the corpus changes.
+"""
+
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+
+import numpy as np
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+QUESTION_WEIGHT = 2  # question text counts twice: it is phrased like user queries
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a about am an and any are as at be been but by can could do does did for from had has have
+how i if in into is it its me my of on or our should so than that the their them then there
+these they this to too was we were what when where which who why will with would you your
+""".split())
+SUFFIXES = ('ment', 'ing', 'ed', 'es', 's')
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords, with light suffix stripping"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        for suffix in SUFFIXES:
+            if len(token) > len(suffix) + 3 and token.endswith(suffix):
+                token = token[:-len(suffix)]
+                break
+        tokens.append(token)
+    return tokens
+
+
+def load_corpus(directory):
+    """All FAQ entries from the directory's JSON files, in a stable order"""
+    entries = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            entries.extend(json.load(f))
+    return entries
+
+
+def corpus_digest(entries):
+    return hashlib.sha256(json.dumps(entries, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class KnowledgeBase:
+    """BM25 inverted index over FAQ entries"""
+
+    def __init__(self, entries, index_path=None):
+        self.entries = entries
+        self.digest = corpus_digest(entries)
+        if not (index_path and self._load(index_path)):
+            self._build()
+            if index_path:
+                self._save(index_path)
+
+    @classmethod
+    def from_directory(cls, directory, index_path=None):
+        return cls(load_corpus(directory), index_path)
+
+    def _build(self):
+        documents = []
+        for entry in self.entries:
+            text = ' '.join([entry.get('topic', '')] + entry.get('questions', []) * QUESTION_WEIGHT + [entry['answer']])
+            documents.append(tokenize(text))
+        lengths = np.array([len(tokens) for tokens in documents], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 1.0
+
+        postings = {}
+        for doc_id, tokens in enumerate(documents):
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((doc_id, tf))
+
+        num_docs = len(documents)
+        self.vocabulary = {}
+        doc_ids, weights, offsets, idfs = [], [], [0], []
+        for term_id, (token, plist) in enumerate(sorted(postings.items())):
+            self.vocabulary[token] = term_id
+            idf = math.log(1 + (num_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            idfs.append(idf)
+            for doc_id, tf in plist:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc_id] / average_length)
+                doc_ids.append(doc_id)
+                weights.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+            offsets.append(len(doc_ids))
+        self.doc_ids = np.array(doc_ids, dtype=np.int32)
+        self.weights = np.array(weights, dtype=np.float32)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.idf = np.array(idfs, dtype=np.float32)
+        self.max_idf = math.log(1 + (num_docs + 0.5) / 0.5)
+
+    def _save(self, index_path):
+        tmp_path = f"{index_path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            digest=self.digest,
+            vocabulary=json.dumps(sorted(self.vocabulary, key=self.vocabulary.get)),
+            doc_ids=self.doc_ids,
+            weights=self.weights,
+            offsets=self.offsets,
+            idf=self.idf,
+            max_idf=self.max_idf,
+        )
+        os.replace(tmp_path, index_path)
+
+    def _load(self, index_path):
+        try:
+            data = np.load(index_path)
+            if str(data['digest']) != self.digest:
+                return False
+            self.vocabulary = {token: i for i, token in enumerate(json.loads(str(data['vocabulary'])))}
+            self.doc_ids = data['doc_ids']
+            self.weights = data['weights']
+            self.offsets = data['offsets']
+            self.idf = data['idf']
+            self.max_idf = float(data['max_idf'])
+            return True
+        except (OSError, KeyError, ValueError):
+            return False
+
+    def search(self, query, k=3):
+        """
+        Return up to k hits {id, topic, answer, score, confidence}, best first.
+        Confidence is the score relative to a perfect match on every query term, so
+        unknown or unmatched words pull it down.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        scores = np.zeros(len(self.entries), dtype=np.float32)
+        ideal = 0.0
+        for token in tokens:
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                ideal += self.max_idf * (BM25_K1 + 1) / 2
+                continue
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            np.add.at(scores, self.doc_ids[start:stop], self.weights[start:stop])
+            ideal += float(self.weights[start:stop].max())
+
+        top = np.argsort(-scores)[:k]
+        return [
+            {
+                "id": self.entries[i]['id'],
+                "topic": self.entries[i].get('topic'),
+                "answer": self.entries[i]['answer'],
+                "score": float(scores[i]),
+                "confidence": min(1.0, float(scores[i]) / ideal) if ideal else 0.0,
+            }
+            for i in top if scores[i] > 0
+        ]
+
+    def stats(self):
+        return {"entries": len(self.entries), "terms": len(self.vocabulary), "corpus": self.digest}
@@ -0,0 +1,24 @@
+"""
+Class label and description tables shared by the API and offline tools.
+LABELS_VERSION changes whenever either table changes, so clients can cache them.
+"""
+
+import hashlib
+import json
+
+# Model classes - must match training order (alphabetical)
+CLASS_LABELS = ["COVID-19", "Lung Cancer", "Normal", "Pleural Effusion", "Pneumonia", "Tuberculosis"]
+
+# Class descriptions
+CLASS_DESCRIPTIONS = {
+    "COVID-19": "The X-ray shows signs consistent with COVID-19 pneumonia. Please consult a healthcare provider immediately.",
+    "Lung Cancer": "The X-ray shows signs that may be consistent with lung cancer (nodules, masses, or abnormal growths). This finding requires urgent medical evaluation. Please consult an oncologist or pulmonologist immediately for further diagnostic imaging and biopsy.",
+    "Normal": "The X-ray appears normal with no significant findings. However, a medical professional should review for confirmation.",
+    "Pleural Effusion": "The X-ray shows signs consistent with pleural effusion (fluid accumulation around the lungs). This can be caused by infections, heart failure, or other conditions. Please seek medical evaluation for proper diagnosis and treatment.",
+    "Pneumonia": "The X-ray shows signs consistent with pneumonia. We recommend immediate medical evaluation.",
+    "Tuberculosis": "The X-ray shows signs consistent with Tuberculosis (TB). TB is a serious but treatable infectious disease. Please seek immediate medical attention for proper diagnosis and treatment."
+}
+
+LABELS_VERSION = hashlib.sha256(
+    json.dumps([CLASS_LABELS, CLASS_DESCRIPTIONS], sort_keys=True).encode('utf-8')
+).hexdigest()[:12]
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Local load generator for /api/predict, /api/chat and /api/report.
+Start the backend with simulated inference, then drive it:
+
+    MOCK_BACKEND=true MOCK_LATENCY_MS=250 INTERPRETER_POOL_SIZE=2 python app.py
+    python loadgen.py --concurrency 1,2,4,8 --duration 30
+    python loadgen.py --rate 5 --concurrency 16 --mix predict=8,chat=1,report=1
+
+Closed loop (the default): each of N workers sends its next request as soon as the last
+one returns, which measures capacity. Open loop (--rate): requests arrive as a Poisson
+process at the given rate whatever the server does, and latency is measured from the
+scheduled arrival time, so queueing delay is included rather than hidden (no
+coordinated omission).
+"""
+
+import argparse
+import io
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import requests
+from PIL import Image
+
+ENDPOINTS = ('predict', 'chat', 'report')
+CHAT_MESSAGES = (
+    "What does pneumonia look like on a chest X-ray?",
+    "How is tuberculosis treated?",
+    "Should I worry about a pleural effusion?",
+    "What are the symptoms of COVID-19?",
+)
+SAMPLE_PREDICTION = {
+    "class": "Normal",
+    "confidence": 0.93,
+    "description": "No significant abnormalities detected.",
+    "all_predictions": {"Normal": 0.93, "Pneumonia": 0.04, "COVID-19": 0.03},
+}
+
+
+def parse_mix(text):
+    """'predict=8,chat=1' -> {'predict': 8.0, 'chat': 1.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint '{name}' (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def load_images(directory, count=16, seed=0):
+    """Encoded images from `directory`, or `count` synthetic PNGs when none is given"""
+    if directory:
+        images = []
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(('.png', '.jpg', '.jpeg', '.dcm')):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    images.append((name, f.read()))
+        if not images:
+            raise SystemExit(f"ERR No images in {directory}")
+        return images
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.fromarray((rng.random((512, 512)) * 255).astype(np.uint8), mode='L').save(buffer, 'PNG')
+        images.append((f"synthetic_{i}.png", buffer.getvalue()))
+    return images
+
+
+class Workload:
+    """Builds and sends one request of a given kind; one instance per worker thread"""
+
+    def __init__(self, base_url, images, timeout, seed, headers=None):
+        self.base_url = base_url.rstrip('/')
+        self.images = images
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        self.rng = random.Random(seed)
+
+    def send(self, endpoint):
+        """Return the HTTP status, or an exception class name for transport errors"""
+        url = f"{self.base_url}/api/{endpoint}"
+        try:
+            if endpoint == 'predict':
+                name, data = self.rng.choice(self.images)
+                # dedupe=false (honoured with --admin-token): the small image set would otherwise be
+                # served from the hash index
+                response = self.session.post(url, files={'image': (name, data)}, data={'dedupe': 'false'},
+                                             timeout=self.timeout)
+            elif endpoint == 'chat':
+                response = self.session.post(url, json={'message': self.rng.choice(CHAT_MESSAGES)}, timeout=self.timeout)
+            else:
+                response = self.session.post(url, json={'prediction': SAMPLE_PREDICTION}, timeout=self.timeout)
+            response.content  # read the whole body so the latency covers the transfer
+            return response.status_code
+        except requests.RequestException as e:
+            return type(e).__name__
+
+
+class Recorder:
+    """Thread-safe latency and status collection per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, endpoint, latency, status):
+        with self._lock:
+            self.latencies[endpoint].append(latency)
+            self.statuses[endpoint][str(status)] += 1
+
+    def summary(self, elapsed):
+        report = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            ms = np.array(latencies) * 1000
+            statuses = dict(self.statuses[endpoint])
+            ok = sum(count for status, count in statuses.items() if status.startswith('2'))
+            report[endpoint] = {
+                "requests": len(ms),
+                "ok": ok,
+                "statuses": statuses,
+                "throughput_rps": ok / elapsed if elapsed else 0.0,
+                "p50_ms": float(np.percentile(ms, 50)),
+                "p90_ms": float(np.percentile(ms, 90)),
+                "p95_ms": float(np.percentile(ms, 95)),
+                "p99_ms": float(np.percentile(ms, 99)),
+                "max_ms": float(ms.max()),
+            }
+        return report
+
+
+def run_closed(base_url, images, mix, concurrency, duration, timeout, seed=0, headers=None):
+    recorder = Recorder()
+    names, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        workload = Workload(base_url, images, timeout, seed + index, headers)
+        while time.perf_counter() < deadline:
+            endpoint = workload.rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            status = workload.send(endpoint)
+            recorder.add(endpoint, time.perf_counter() - start, status)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - start
+
+
+def run_open(base_url, images, mix, rate, concurrency, duration, timeout, seed=0, headers=None):
+    """Poisson arrivals at `rate`/s served by at most `concurrency` client connections"""
+    recorder = Recorder()
+    names, weights = list(mix), list(mix.values())
+    arrivals = queue.Queue()
+    rng = random.Random(seed)
+    backlog = {"max": 0}
+
+    def worker(index):
+        workload = Workload(base_url, images, timeout, seed + index, headers)
+        while True:
+            item = arrivals.get()
+            if item is None:
+                return
+            scheduled, endpoint = item
+            wait = scheduled - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            status = workload.send(endpoint)
+            recorder.add(endpoint, time.perf_counter() - scheduled, status)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    scheduled = start
+    while True:
+        scheduled += rng.expovariate(rate)
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        arrivals.put((scheduled, rng.choices(names, weights)[0]))
+        backlog["max"] = max(backlog["max"], arrivals.qsize())
+    for _ in threads:
+        arrivals.put(None)
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - start, backlog["max"]
+
+
+def print_summary(label, report):
+    print(f"\n{label}")
+    print(f"  {'Endpoint':<10}{'Req':>7}{'OK':>7}{'RPS':>8}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  statuses")
+    for endpoint, row in report.items():
+        print(f"  {endpoint:<10}{row['requests']:>7}{row['ok']:>7}{row['throughput_rps']:>8.2f}"
+              f"{row['p50_ms']:>9.0f}{row['p90_ms']:>9.0f}{row['p95_ms']:>9.0f}{row['p99_ms']:>9.0f}{row['max_ms']:>9.0f}"
+              f"  {row['statuses']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5003')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('predict=6,chat=3,report=1'), help='endpoint weights')
+    parser.add_argument('--concurrency', default='4', help='worker count, or a comma list to sweep')
+    parser.add_argument('--rate', type=float, help='open-loop arrival rate in requests/s')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per level')
+    parser.add_argument('--images', help='directory of images to upload (default: synthetic PNGs)')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--deadline-ms', type=int, help='send X-Request-Timeout-Ms with every request')
+    parser.add_argument('--priority', choices=('batch',), help='send X-Priority to run as the batch class')
+    parser.add_argument('--admin-token', help='send X-Admin-Token so per-request opt-outs such as dedupe=false apply')
+    parser.add_argument('--output', help='write all results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    images = load_images(args.images)
+    headers = {}
+    if args.deadline_ms:
+        headers['X-Request-Timeout-Ms'] = str(args.deadline_ms)
+    if args.priority:
+        headers['X-Priority'] = args.priority
+    if args.admin_token:
+        headers['X-Admin-Token'] = args.admin_token
+    levels = [int(level) for level in args.concurrency.split(',')]
+    results = []
+    for concurrency in levels:
+        if args.rate:
+            recorder, elapsed, max_backlog = run_open(
+                args.url, images, args.mix, args.rate, concurrency, args.duration, args.timeout, headers=headers
+            )
+            label = f"Open loop: {args.rate:g} req/s offered, {concurrency} connections, max client backlog {max_backlog}"
+        else:
+            recorder, elapsed = run_closed(args.url, images, args.mix, concurrency, args.duration, args.timeout, headers=headers)
+            label = f"Closed loop: {concurrency} concurrent clients"
+        report = recorder.summary(elapsed)
+        print_summary(label, report)
+        results.append({"concurrency": concurrency, "rate": args.rate, "elapsed": elapsed, "endpoints": report})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nOK  Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
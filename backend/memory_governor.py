@@ -0,0 +1,231 @@
+"""
+Memory-budget governor for low-RAM deployments (Render's free tier gives 512 MB).
+Tracks the process RSS against a budget and the memory reserved by in-flight
+expensive features. Between a soft and a hard watermark it asks registered shrinkers
+(caches, idle pooled interpreters) to give memory back; a feature whose estimated
+allocation would take the process past the hard watermark is refused with
+MemoryPressure (served as 503 + Retry-After) instead of letting the kernel OOM-kill
+the worker. Per-feature estimates learn from the peak RSS sampled while a lone run is
+in flight (freed or reused memory does not count as headroom), and never drop below the
+configured estimate.
+"""
+
+import ctypes
+import functools
+import gc
+import os
+import resource
+import threading
+import time
+from collections import deque
+
+SOFT_FRACTION = 0.80
+HARD_FRACTION = 0.92
+ESTIMATE_SMOOTHING = 0.2   # weight of a new observation in the per-feature estimate
+SHRINK_INTERVAL = 2.0      # minimum seconds between shrink passes
+SAMPLE_INTERVAL = 0.01     # seconds between RSS samples while a feature runs
+DECISION_LOG_SIZE = 50
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Peak rather than current RSS, but the best that is portable (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def container_limit():
+    """The cgroup memory limit in bytes, or None when unlimited or unknown"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return None
+
+
+def _release_to_os():
+    """Collect garbage and ask glibc to return freed heap pages"""
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class MemoryPressure(Exception):
+    """Raised when a feature is refused to stay under the memory budget"""
+
+    def __init__(self, feature, retry_after):
+        super().__init__(f"Not enough memory for {feature} right now")
+        self.feature = feature
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        return {
+            "success": False,
+            "error": f"The server is low on memory; retry {self.feature} in {self.retry_after}s",
+            "code": "MEMORY_PRESSURE",
+        }
+
+
+class MemoryGovernor:
+    """RSS budget with per-feature reservations, shrinkers and decision metrics"""
+
+    def __init__(self, budget_bytes, soft_fraction=SOFT_FRACTION, hard_fraction=HARD_FRACTION,
+                 retry_after=5, rss_reader=current_rss):
+        self.budget = budget_bytes
+        self.soft_limit = budget_bytes * soft_fraction if budget_bytes else None
+        self.hard_limit = budget_bytes * hard_fraction if budget_bytes else None
+        self.retry_after = retry_after
+        self._rss = rss_reader
+        self._lock = threading.Lock()
+        self._shrinkers = {}
+        self._last_shrink = 0.0
+        self.reserved = 0
+        self.estimates = {}
+        self.in_flight = {}
+        self.admitted = {}
+        self.refused = {}
+        self.shrink_passes = 0
+        self.peak_rss = 0
+        self.decisions = deque(maxlen=DECISION_LOG_SIZE)
+        self._run_peak = 0      # highest RSS sampled since the in-flight count last left zero
+        self._sampler = None
+
+    @property
+    def enabled(self):
+        return self.budget is not None
+
+    def register_shrinker(self, name, shrink):
+        """`shrink()` should release what it can and return a short description (or None)"""
+        self._shrinkers[name] = shrink
+
+    def _log(self, action, feature, rss, **details):
+        self.decisions.append({"time": time.time(), "action": action, "feature": feature,
+                               "rss_mb": round(rss / 2 ** 20, 1), **details})
+
+    def shrink(self, rss=None, force=False):
+        """Run every shrinker once, then hand freed memory back to the OS; returns the new RSS"""
+        now = time.monotonic()
+        if not force and now - self._last_shrink < SHRINK_INTERVAL:
+            return rss if rss is not None else self._rss()
+        self._last_shrink = now
+        before = rss if rss is not None else self._rss()
+        released = {}
+        for name, shrink in list(self._shrinkers.items()):
+            try:
+                result = shrink()
+            except Exception as e:
+                result = f"failed: {e}"
+            if result:
+                released[name] = result
+        _release_to_os()
+        after = self._rss()
+        with self._lock:
+            self.shrink_passes += 1
+            self._log("shrink", None, after, freed_mb=round((before - after) / 2 ** 20, 1), shrinkers=released)
+        print(f"WARN  Memory governor: shrink pass {before / 2 ** 20:.0f} -> {after / 2 ** 20:.0f} MB ({released or 'nothing to release'})")
+        return after
+
+    def _sample_loop(self):
+        """Track the peak RSS while anything is in flight; exits when the governor goes idle"""
+        while True:
+            rss = self._rss()
+            with self._lock:
+                self._run_peak = max(self._run_peak, rss)
+                if not any(self.in_flight.values()):
+                    self._sampler = None
+                    return
+            time.sleep(SAMPLE_INTERVAL)
+
+    def admit(self, feature, estimate_bytes):
+        """
+        Reserve memory for one run of `feature`, or raise MemoryPressure.
+        Returns a token for release(); a learned estimate above `estimate_bytes` wins once known.
+        """
+        rss = self._rss()
+        estimate = int(max(self.estimates.get(feature, 0), estimate_bytes))
+        if self.enabled:
+            if rss + self.reserved + estimate > self.soft_limit:
+                rss = self.shrink(rss)
+            with self._lock:
+                self.peak_rss = max(self.peak_rss, rss)
+                if rss + self.reserved + estimate > self.hard_limit:
+                    self.refused[feature] = self.refused.get(feature, 0) + 1
+                    self._log("refuse", feature, rss, estimate_mb=round(estimate / 2 ** 20, 1),
+                              reserved_mb=round(self.reserved / 2 ** 20, 1))
+                    # Memory held by in-flight work comes back when it finishes; wait longer when idle
+                    raise MemoryPressure(feature, self.retry_after if self.reserved else self.retry_after * 2)
+                self.reserved += estimate
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            self.admitted[feature] = self.admitted.get(feature, 0) + 1
+            self.in_flight[feature] = self.in_flight.get(feature, 0) + 1
+            lone = sum(self.in_flight.values()) == 1
+            if lone:
+                self._run_peak = rss
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name='memory-sampler', daemon=True)
+                self._sampler.start()
+        return feature, estimate, rss, estimate_bytes, lone
+
+    def release(self, token):
+        """Return a reservation and learn from the peak RSS the feature reached"""
+        feature, estimate, rss_before, configured, lone = token
+        rss = self._rss()
+        with self._lock:
+            if self.enabled:
+                self.reserved -= estimate
+            self.in_flight[feature] -= 1
+            self._run_peak = max(self._run_peak, rss)
+            self.peak_rss = max(self.peak_rss, self._run_peak)
+            # Only a lone run's peak is attributable to it; concurrent runs would double count
+            if lone and sum(self.in_flight.values()) == 0:
+                observed = max(self._run_peak - rss_before, 0)
+                previous = self.estimates.get(feature, configured)
+                self.estimates[feature] = max(
+                    (1 - ESTIMATE_SMOOTHING) * previous + ESTIMATE_SMOOTHING * observed,
+                    configured,
+                )
+
+    def guard(self, feature, estimate_mb):
+        """Decorator: admit the wrapped view under `feature`, release when it returns"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapped(*args, **kwargs):
+                token = self.admit(feature, estimate_mb * 2 ** 20)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release(token)
+            return wrapped
+        return decorator
+
+    def stats(self):
+        rss = self._rss()
+        with self._lock:
+            mb = lambda value: None if value is None else round(value / 2 ** 20, 1)
+            return {
+                "enabled": self.enabled,
+                "rss_mb": mb(rss),
+                "peak_rss_mb": mb(max(self.peak_rss, rss)),
+                "budget_mb": mb(self.budget),
+                "soft_limit_mb": mb(self.soft_limit),
+                "hard_limit_mb": mb(self.hard_limit),
+                "reserved_mb": mb(self.reserved),
+                "estimates_mb": {feature: mb(value) for feature, value in self.estimates.items()},
+                "admitted": dict(self.admitted),
+                "refused": dict(self.refused),
+                "in_flight": {feature: n for feature, n in self.in_flight.items() if n},
+                "shrink_passes": self.shrink_passes,
+                "shrinkers": sorted(self._shrinkers),
+                "recent_decisions": list(self.decisions),
+            }
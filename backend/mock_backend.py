@@ -0,0 +1,215 @@
+"""
+Deterministic mock inference backend for capacity testing.
+MockInterpreter implements the subset of the TFLite Interpreter API that inference.py
+uses, so the whole /api/predict path (interpreter pool, TTA, DICOM streaming, cascade,
+embeddings) runs unchanged without the real model. Each invoke costs a configurable
+latency drawn from a distribution, of which a configurable fraction is spent burning
+CPU in NumPy (which, like TFLite, releases the GIL), and each interpreter holds a
+configurable resident memory footprint. Outputs are seeded by a hash of the input, so
+the same image always gets the same prediction. Like a model from convert_to_tflite.py
+it exposes classify / classify_with_features / cam signature runners, and counts tensor
+(re)allocations so the batch-shape behaviour of the serving path can be checked.
+
+The module doubles as a stand-in for the tflite module: autotune.build_pool(mock_backend, ...).
+"""
+
+import hashlib
+import itertools
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from labels import CLASS_LABELS
+
+DISTRIBUTIONS = ('fixed', 'normal', 'lognormal', 'exponential')
+EMBEDDING_DIM = 512
+CAM_GRID = 7  # DenseNet121's last feature map is 7x7 at 224x224
+BURN_SIZE = 128  # side of the matrices multiplied while burning CPU
+
+_latency_seeds = itertools.count()
+
+
+def seeded_probabilities(data, num_classes, peak=(0.70, 0.98)):
+    """Plausible class probabilities derived only from `data` (bytes): same input, same output"""
+    rng = random.Random(hashlib.sha256(data).digest())
+    top = rng.randrange(num_classes)
+    confidence = rng.uniform(*peak)
+    rest = [rng.random() + 1e-3 for _ in range(num_classes - 1)]
+    scale = (1.0 - confidence) / sum(rest)
+    probabilities = [value * scale for value in rest]
+    probabilities.insert(top, confidence)
+    return probabilities
+
+
+class LatencyModel:
+    """Per-invoke latency in seconds drawn from a named distribution"""
+
+    def __init__(self, mean_ms, distribution='lognormal', jitter=0.3, seed=0):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"distribution must be one of {DISTRIBUTIONS}")
+        self.mean = mean_ms / 1000.0
+        self.distribution = distribution
+        self.jitter = jitter
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.distribution == 'fixed' or self.mean <= 0:
+                value = self.mean
+            elif self.distribution == 'normal':
+                value = self._rng.normal(self.mean, self.mean * self.jitter)
+            elif self.distribution == 'lognormal':
+                # Parameterised so the mean stays at mean_ms; jitter is the log-space sigma
+                sigma = self.jitter
+                value = self._rng.lognormal(np.log(self.mean) - sigma ** 2 / 2, sigma)
+            else:
+                value = self._rng.exponential(self.mean)
+        return max(0.0, float(value))
+
+
+def burn_cpu(seconds):
+    """Keep one core busy for `seconds`, mostly inside BLAS with the GIL released"""
+    deadline = time.perf_counter() + seconds
+    a = np.ones((BURN_SIZE, BURN_SIZE), dtype=np.float32)
+    while time.perf_counter() < deadline:
+        a = np.tanh(a @ a * (1.0 / BURN_SIZE))
+
+
+class MockInterpreter:
+    """Stand-in for tflite.Interpreter with a (1, 224, 224, 3) input and softmax (+ embedding) outputs"""
+
+    def __init__(self, model_path=None, num_threads=1, num_classes=len(CLASS_LABELS), latency=None,
+                 cpu_fraction=1.0, memory_mb=0, embeddings=True, signatures=True):
+        self.num_threads = num_threads
+        self.num_classes = num_classes
+        self.latency = latency or LatencyModel(0)
+        self.cpu_fraction = min(max(cpu_fraction, 0.0), 1.0)
+        self.embeddings = embeddings
+        self.signatures = signatures
+        self.allocations = 0
+        self._shape = [1, 224, 224, 3]
+        self._input = np.zeros(self._shape, dtype=np.float32)
+        self._outputs = {}
+        self._runners = {}
+        # Touch every page so the footprint is resident, like loaded model weights
+        self._resident = np.ones(int(memory_mb * 1024 * 1024), dtype=np.uint8) if memory_mb else None
+
+    def allocate_tensors(self):
+        if list(self._input.shape) != self._shape:
+            self._input = np.zeros(self._shape, dtype=np.float32)
+            self.allocations += 1
+
+    def resize_tensor_input(self, index, shape):
+        self._shape = list(shape)
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': np.array(self._shape), 'dtype': np.float32, 'name': 'input'}]
+
+    def get_output_details(self):
+        details = [{'index': 1, 'shape': np.array([self._shape[0], self.num_classes]), 'dtype': np.float32, 'name': 'probabilities'}]
+        if self.embeddings:
+            details.append({'index': 2, 'shape': np.array([self._shape[0], EMBEDDING_DIM]), 'dtype': np.float32, 'name': 'embedding'})
+        return details
+
+    def set_tensor(self, index, value):
+        self._input = np.array(value, dtype=np.float32)
+
+    def tensor(self, index):
+        return lambda: self._input
+
+    def get_signature_list(self):
+        if not self.signatures:
+            return {}
+        outputs = {
+            'classify': ['probabilities'],
+            'classify_with_features': ['probabilities', 'features'],
+            'cam': ['probabilities', 'heatmap'],
+        }
+        if not self.embeddings:
+            del outputs['classify_with_features']
+        return {key: {'inputs': ['images'], 'outputs': names} for key, names in outputs.items()}
+
+    def get_signature_runner(self, key):
+        if key not in self.get_signature_list():
+            raise ValueError(f"Invalid signature_key provided: {key}")
+        return MockSignatureRunner(self, key)
+
+    def invoke(self):
+        self._outputs[1], embeddings = self._compute(self._input)
+        if self.embeddings:
+            self._outputs[2] = embeddings
+
+    def _compute(self, batch):
+        """Spend the simulated latency, then return (probabilities, embeddings) seeded by the images"""
+        cost = self.latency.sample() * len(batch) / max(self.num_threads, 1) ** 0.5
+        burn = cost * self.cpu_fraction
+        if burn:
+            burn_cpu(burn)
+        if cost > burn:
+            time.sleep(cost - burn)
+
+        probabilities = []
+        embeddings = []
+        for image in batch:
+            # Quantise first so float noise from resizing paths does not change the seed
+            digest_input = np.round(image[::8, ::8] * 255).astype(np.uint8).tobytes()
+            probabilities.append(seeded_probabilities(digest_input, self.num_classes))
+            if self.embeddings:
+                seed = int.from_bytes(hashlib.sha256(digest_input).digest()[:8], 'little')
+                embeddings.append(np.random.default_rng(seed).standard_normal(EMBEDDING_DIM))
+        embeddings = np.array(embeddings, dtype=np.float32) if self.embeddings else None
+        return np.array(probabilities, dtype=np.float32), embeddings
+
+    def get_tensor(self, index):
+        return self._outputs[index]
+
+
+class MockSignatureRunner:
+    """Stand-in for a TFLite SignatureRunner: resizes (and counts an allocation) only when the batch shape changes"""
+
+    def __init__(self, interpreter, key):
+        self.interpreter = interpreter
+        self.key = key
+        self._shape = None
+
+    def __call__(self, images):
+        images = np.asarray(images, dtype=np.float32)
+        if self._shape != images.shape:
+            self._shape = images.shape
+            self.interpreter.allocations += 1
+        probabilities, embeddings = self.interpreter._compute(images)
+        outputs = {'probabilities': probabilities}
+        if self.key == 'classify_with_features':
+            outputs['features'] = embeddings
+        elif self.key == 'cam':
+            maps = []
+            for image in images:
+                seed = int.from_bytes(hashlib.sha256(np.round(image[::8, ::8] * 255).astype(np.uint8).tobytes()).digest()[:8], 'little')
+                grid = np.random.default_rng(seed).random((CAM_GRID, CAM_GRID))
+                maps.append(grid / grid.max())
+            outputs['heatmap'] = np.array(maps, dtype=np.float32)
+        return outputs
+
+
+class Interpreter(MockInterpreter):
+    """tflite-compatible constructor configured from MOCK_* environment variables"""
+
+    def __init__(self, model_path=None, num_threads=1):
+        super().__init__(
+            model_path,
+            num_threads=num_threads,
+            latency=LatencyModel(
+                float(os.getenv('MOCK_LATENCY_MS', '250')),
+                os.getenv('MOCK_LATENCY_DISTRIBUTION', 'lognormal'),
+                float(os.getenv('MOCK_LATENCY_JITTER', '0.3')),
+                seed=next(_latency_seeds),
+            ),
+            cpu_fraction=float(os.getenv('MOCK_CPU_FRACTION', '1.0')),
+            memory_mb=float(os.getenv('MOCK_MEMORY_MB', '30')),
+            embeddings=os.getenv('MOCK_EMBEDDINGS', 'true').lower() == 'true',
+            signatures=os.getenv('MOCK_SIGNATURES', 'true').lower() == 'true',
+        )
@@ -0,0 +1,107 @@
+"""
+Near-duplicate detection for uploads.
+A 64-bit difference hash (dHash) is computed with vectorised NumPy from the already
+preprocessed 224x224 image, so a film re-exported at another JPEG quality or size
+hashes to (nearly) the same value. Recent hashes live in a multi-index hash table:
+the hash is split into max_distance + 1 blocks, and by the pigeonhole principle any
+hash within max_distance bits matches at least one block exactly, so a lookup only
+compares the few entries sharing a block instead of scanning the whole index.
+Entries are keyed by owner as well, so a lookup only ever matches the same user's studies.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+HASH_BITS = 64
+
+
+def dhash(image, size=8):
+    """
+    64-bit dHash of an (H, W) or (H, W, C) image: area-average to size x (size + 1) gray
+    cells, then one bit per horizontally adjacent pair (is the right cell brighter?).
+    """
+    gray = np.asarray(image, dtype=np.float32)
+    if gray.ndim == 3:
+        gray = gray.mean(axis=2)
+    rows = np.linspace(0, gray.shape[0], size + 1).astype(np.int64)
+    cols = np.linspace(0, gray.shape[1], size + 2).astype(np.int64)
+    cells = np.add.reduceat(np.add.reduceat(gray, rows[:-1], axis=0), cols[:-1], axis=1)
+    cells /= np.outer(np.diff(rows), np.diff(cols))
+    bits = cells[:, 1:] > cells[:, :-1]
+    return int(np.packbits(bits.ravel()).view('>u8')[0])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateIndex:
+    """Bounded, most-recent-first store of (owner, hash) -> payload with Hamming-radius lookup"""
+
+    def __init__(self, max_distance=2, capacity=10000):
+        self.max_distance = max_distance
+        self.capacity = capacity
+        # Block boundaries: max_distance + 1 nearly equal bit ranges
+        edges = np.linspace(0, HASH_BITS, max_distance + 2).astype(int)
+        self._blocks = [(int(lo), int(hi)) for lo, hi in zip(edges[:-1], edges[1:])]
+        self._tables = [dict() for _ in self._blocks]
+        self._entries = OrderedDict()  # entry id -> (owner, hash, payload), oldest first
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def _keys(self, owner, value):
+        return [(owner, (value >> lo) & ((1 << (hi - lo)) - 1)) for lo, hi in self._blocks]
+
+    def add(self, value, payload, owner=''):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (owner, value, payload)
+            for table, key in zip(self._tables, self._keys(owner, value)):
+                table.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.capacity:
+                self._evict_oldest()
+            return entry_id
+
+    def _evict_oldest(self):
+        entry_id, (owner, value, _) = self._entries.popitem(last=False)
+        for table, key in zip(self._tables, self._keys(owner, value)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[key]
+
+    def lookup(self, value, owner=''):
+        """
+        Return (payload, distance) of the closest entry of `owner` within max_distance
+        (most recent on ties), or None
+        """
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for table, key in zip(self._tables, self._keys(owner, value)):
+                candidates.update(table.get(key, ()))
+            best = None
+            for entry_id in candidates:
+                distance = hamming(value, self._entries[entry_id][1])
+                if distance <= self.max_distance and (best is None or (distance, -entry_id) < (best[1], -best[0])):
+                    best = (entry_id, distance)
+            if best is None:
+                return None
+            self.hits += 1
+            return self._entries[best[0]][2], best[1]
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "capacity": self.capacity,
+            "max_distance": self.max_distance,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+        }
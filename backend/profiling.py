@@ -0,0 +1,236 @@
+"""
+On-demand per-request profiling.
+A request is profiled when it carries X-Profile: sample|cprofile with the admin
+token, or when it is picked by the random sampling rate. 'sample' runs a
+background thread that snapshots the request thread's stack every few
+milliseconds and writes collapsed stacks ("a;b;c count", the input format of
+flamegraph.pl and speedscope); 'cprofile' runs the deterministic profiler and
+writes a pstats dump. Either way a small JSON summary attributes time to
+preprocessing, interpreter invoke, matplotlib and reportlab. Profiles go to a
+bounded on-disk ring. When profiling is not configured the decorator returns
+the view unchanged, so it costs nothing.
+"""
+
+import cProfile
+import functools
+import hmac
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import make_response
+
+MODES = ('sample', 'cprofile')
+PROFILE_HEADER = 'X-Profile'
+TOKEN_HEADER = 'X-Admin-Token'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+NAME_PATTERN = re.compile(r'^[0-9]+_[a-z_]+_(sample|cprofile)\.(folded|prof|json)$')
+
+# Where the time of a slow request usually goes; matched against frame names / file paths
+COMPONENTS = {
+    "preprocessing": ("preprocess_image", "dicom_io.py", "upload_guard.py"),
+    "inference": ("invoke", "run_inference", "run_in_place"),
+    "matplotlib": ("matplotlib/",),
+    "reportlab": ("reportlab/",),
+}
+
+
+def _frame_name(code):
+    path = code.co_filename
+    for marker in ('site-packages/', 'dist-packages/'):
+        if marker in path:
+            path = path.split(marker, 1)[1]
+            break
+    else:
+        path = os.path.basename(path)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(';', ':')
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer into collapsed-stack counts"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def components(self):
+        """Share of samples whose stack passes through each component"""
+        total = sum(self.stacks.values())
+        shares = {}
+        for component, needles in COMPONENTS.items():
+            hits = sum(count for stack, count in self.stacks.items() if any(n in stack for n in needles))
+            shares[component] = round(hits / total, 3) if total else 0.0
+        return shares
+
+
+def _cprofile_components(stats):
+    """Largest cumulative time (seconds) among functions of each component"""
+    seconds = {}
+    for component, needles in COMPONENTS.items():
+        matching = [
+            cumulative for (path, _, name), (_, _, _, cumulative, _) in stats.stats.items()
+            if any(n in path or n == name for n in needles)
+        ]
+        seconds[component] = round(max(matching), 4) if matching else 0.0
+    return seconds
+
+
+class ProfileStore:
+    """Bounded ring of profile files in one directory, oldest deleted first"""
+
+    def __init__(self, directory, max_profiles=50):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _names(self):
+        return sorted(name for name in os.listdir(self.directory) if NAME_PATTERN.match(name))
+
+    def save(self, endpoint, mode, payload, extension, summary):
+        """Write a profile and its JSON summary; returns the profile id (the shared file stem)"""
+        stem = f"{time.time_ns()}_{endpoint}_{mode}"
+        summary = {"id": stem, "file": f"{stem}.{extension}", **summary}
+        with self._lock:
+            with open(os.path.join(self.directory, f"{stem}.{extension}"), 'wb') as f:
+                f.write(payload)
+            with open(os.path.join(self.directory, f"{stem}.json"), 'w') as f:
+                json.dump(summary, f)
+            stems = sorted({name.rsplit('.', 1)[0] for name in self._names()})
+            for old in stems[:max(0, len(stems) - self.max_profiles)]:
+                for name in os.listdir(self.directory):
+                    if name.startswith(old + '.'):
+                        os.remove(os.path.join(self.directory, name))
+        return stem
+
+    def list(self):
+        """Summaries of stored profiles, newest first"""
+        profiles = []
+        for name in reversed(self._names()):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def path(self, name):
+        """Absolute path of a stored file, or None for unknown / unsafe names"""
+        if not NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.exists(path) else None
+
+
+class RequestProfiler:
+    """Decides which requests to profile and runs the chosen profiler around the view"""
+
+    def __init__(self, store, admin_token=None, sample_rate=0.0, default_mode='sample', interval=0.005):
+        self.store = store
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        self.default_mode = default_mode
+        self.interval = interval
+
+    @property
+    def enabled(self):
+        return bool(self.admin_token) or self.sample_rate > 0
+
+    def is_admin(self, headers):
+        token = headers.get(TOKEN_HEADER, '')
+        return bool(self.admin_token) and hmac.compare_digest(token.encode(), self.admin_token.encode())
+
+    def mode_for(self, headers):
+        """Profiling mode for a request, or None"""
+        requested = headers.get(PROFILE_HEADER, '').lower()
+        if requested and self.is_admin(headers):
+            return requested if requested in MODES else self.default_mode
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return self.default_mode
+        return None
+
+    def guard(self, endpoint, headers_source):
+        """Decorator: profile the wrapped view when mode_for(headers_source()) says so"""
+        def decorator(view):
+            if not self.enabled:
+                return view
+
+            @functools.wraps(view)
+            def wrapped(*args, **kwargs):
+                mode = self.mode_for(headers_source())
+                if mode is None:
+                    return view(*args, **kwargs)
+                return self._run(endpoint, mode, view, args, kwargs)
+            return wrapped
+        return decorator
+
+    def _run(self, endpoint, mode, view, args, kwargs):
+        start = time.perf_counter()
+        if mode == 'cprofile':
+            profile = cProfile.Profile()
+            try:
+                result = profile.runcall(view, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+            profile.create_stats()
+            stats = pstats.Stats(profile)
+            dump_path = os.path.join(self.store.directory, f".pending-{threading.get_ident()}.prof")
+            stats.dump_stats(dump_path)
+            with open(dump_path, 'rb') as f:
+                payload = f.read()
+            os.remove(dump_path)
+            extension, components = 'prof', {"seconds": _cprofile_components(stats)}
+        else:
+            sampler = StackSampler(threading.get_ident(), self.interval)
+            sampler.start()
+            try:
+                result = view(*args, **kwargs)
+            finally:
+                sampler.stop()
+                elapsed = time.perf_counter() - start
+            payload = sampler.collapsed().encode('utf-8')
+            extension = 'folded'
+            components = {"share": sampler.components(), "samples": sum(sampler.stacks.values())}
+
+        summary = {"endpoint": endpoint, "mode": mode, "created_at": time.time(),
+                   "duration_ms": round(elapsed * 1000, 1), **components}
+        try:
+            profile_id = self.store.save(endpoint, mode, payload, extension, summary)
+        except OSError as e:
+            print(f"WARN  Could not save {mode} profile for {endpoint}: {e}")
+            return result
+        print(f"OK  Profiled {endpoint} ({mode}, {summary['duration_ms']} ms) -> {profile_id}")
+        response = make_response(result)
+        response.headers[PROFILE_ID_HEADER] = profile_id
+        return response
@@ -0,0 +1,58 @@
+"""
+Fast JSON encoding for API responses.
+Uses orjson when it is installed and falls back to the standard library otherwise;
+both paths understand NumPy scalars and arrays.
+"""
+
+import json
+
+import numpy as np
+from flask import Response
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+COMPACT_MEDIA_TYPE = 'application/vnd.diagnobot.compact+json'
+COMPACT_PRECISION = 5
+
+
+def _default(obj):
+    """Encode NumPy values that neither encoder handles natively"""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Serialise to UTF-8 JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def json_response(payload, status=200, headers=None):
+    """Flask response with a pre-encoded JSON body"""
+    response = Response(dumps(payload), status=status, mimetype='application/json')
+    if headers:
+        response.headers.update(headers)
+    return response
+
+
+def wants_compact(request):
+    """True when the client asked for the compact profile by query, header or Accept type"""
+    if request.args.get('profile', '').lower() == 'compact':
+        return True
+    if request.headers.get('X-Response-Profile', '').lower() == 'compact':
+        return True
+    return COMPACT_MEDIA_TYPE in request.headers.get('Accept', '')
+
+
+def round_probabilities(probabilities):
+    """Probabilities as a float list rounded for the compact profile"""
+    return np.round(np.asarray(probabilities, dtype=np.float64), COMPACT_PRECISION)
@@ -0,0 +1,164 @@
+"""
+Shadow evaluation of a candidate model on live traffic.
+A sample of /api/predict inputs is handed, already preprocessed, to a background
+worker that runs the candidate model and compares it with the answer the primary
+model served. The request thread only does a non-blocking queue put, so the
+primary response never waits for the candidate; when the worker falls behind,
+samples are dropped instead of queued. Comparisons are kept in fixed-size rolling
+windows (top-1 agreement, per-class probability deltas, both models' latency) plus
+a lifetime confusion matrix. The worker runs at a lowered OS priority, so under
+load its latency is an upper bound on what the candidate would cost when serving.
+"""
+
+import os
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+
+from inference import INPUT_SHAPE, run_inference
+
+LOG_EVERY = 100  # comparisons between summary log lines
+WORKER_NICENESS = 10  # the worker yields CPU to request threads where the OS allows it
+
+
+def _percentiles(values):
+    if not len(values):
+        return {"p50": None, "p95": None}
+    p50, p95 = np.percentile(values, [50, 95])
+    return {"p50": round(float(p50) * 1000, 1), "p95": round(float(p95) * 1000, 1)}
+
+
+class ShadowEvaluator:
+    """Runs a candidate model on sampled inputs off the request path and aggregates the comparison"""
+
+    def __init__(self, load_candidate, class_labels, sample_rate, model_name=None, max_pending=32, window=1000):
+        self.load_candidate = load_candidate  # () -> InterpreterPool; called on the worker thread
+        self.class_labels = list(class_labels)
+        self.sample_rate = sample_rate
+        self.model_name = model_name
+        self.window = window
+        self.pool = None
+        self.status = "loading"
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+
+        num_classes = len(self.class_labels)
+        self.submitted = 0
+        self.dropped = 0
+        self.errors = 0
+        self.compared = 0
+        # Rolling windows, written round-robin at compared % window
+        self._deltas = np.zeros((window, num_classes), dtype=np.float32)
+        self._agree = np.zeros(window, dtype=bool)
+        self._latency = np.zeros((window, 2), dtype=np.float64)  # primary, shadow seconds
+        # Rows: primary top-1, columns: candidate top-1, since startup
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+
+        self._worker = threading.Thread(target=self._run, name='shadow-evaluator', daemon=True)
+        self._worker.start()
+
+    def should_sample(self):
+        return self.status == "ready" and self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def submit(self, batch, primary_probabilities, primary_latency):
+        """Queue one (1, 224, 224, 3) input for the candidate; never blocks, False when dropped"""
+        with self._lock:
+            self.submitted += 1
+        try:
+            self._queue.put_nowait((batch, np.asarray(primary_probabilities, dtype=np.float32), primary_latency))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _run(self):
+        if hasattr(os, 'setpriority'):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WORKER_NICENESS)
+            except OSError:
+                pass
+        try:
+            pool = self.load_candidate()
+            with pool.acquire() as interpreter:
+                width = run_inference(interpreter, np.zeros((1,) + INPUT_SHAPE, dtype=np.float32)).shape[-1]
+            if width != len(self.class_labels):
+                raise ValueError(f"candidate has {width} outputs but CLASS_LABELS has {len(self.class_labels)}")
+        except Exception as e:
+            self.status = f"failed: {e}"
+            print(f"ERR Shadow model could not be loaded ({e}); shadow evaluation disabled")
+            return
+        self.pool = pool
+        self.status = "ready"
+        print(f"OK  Shadow model {self.model_name} loaded; sampling {self.sample_rate:.0%} of predictions")
+
+        while True:
+            batch, primary, primary_latency = self._queue.get()
+            try:
+                start = time.perf_counter()
+                with self.pool.acquire() as interpreter:
+                    candidate = run_inference(interpreter, batch)[0]
+                self.record(primary, candidate, primary_latency, time.perf_counter() - start)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"WARN  Shadow inference failed: {e}")
+
+    def record(self, primary, candidate, primary_latency, shadow_latency):
+        primary_top = int(np.argmax(primary))
+        candidate_top = int(np.argmax(candidate))
+        with self._lock:
+            slot = self.compared % self.window
+            self._deltas[slot] = candidate - primary
+            self._agree[slot] = primary_top == candidate_top
+            self._latency[slot] = (primary_latency, shadow_latency)
+            self.confusion[primary_top, candidate_top] += 1
+            self.compared += 1
+            log_now = self.compared % LOG_EVERY == 0
+        if log_now:
+            self.log_summary()
+
+    def stats(self):
+        with self._lock:
+            filled = min(self.compared, self.window)
+            deltas = self._deltas[:filled]
+            agree = self._agree[:filled]
+            latency = self._latency[:filled].copy()
+            lifetime = int(self.confusion.sum())
+            stats = {
+                "model": self.model_name,
+                "status": self.status,
+                "sample_rate": self.sample_rate,
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "compared": self.compared,
+                "pending": self._queue.qsize(),
+                "window": filled,
+                "agreement_rate": float(agree.mean()) if filled else None,
+                "lifetime_agreement_rate": float(np.trace(self.confusion) / lifetime) if lifetime else None,
+                "confusion_matrix": self.confusion.tolist(),
+                # Candidate minus primary, per class, over the window
+                "probability_delta": {
+                    label: {
+                        "mean": float(deltas[:, i].mean()),
+                        "mean_abs": float(np.abs(deltas[:, i]).mean()),
+                        "max_abs": float(np.abs(deltas[:, i]).max()),
+                    } if filled else None
+                    for i, label in enumerate(self.class_labels)
+                },
+            }
+        stats["latency_ms"] = {"primary": _percentiles(latency[:, 0]), "shadow": _percentiles(latency[:, 1])}
+        return stats
+
+    def log_summary(self):
+        stats = self.stats()
+        latency = stats["latency_ms"]
+        print(
+            f"SHADOW compared={stats['compared']} dropped={stats['dropped']} "
+            f"agreement={stats['agreement_rate']:.3f} "
+            f"p50_ms primary={latency['primary']['p50']} shadow={latency['shadow']['p50']}"
+        )
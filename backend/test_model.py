@@ -13,17 +13,9 @@ try:
 except Exception as e:
     print("Direct load failed:", e)
     print("Patch load...")
-    base_model = tf.keras.applications.DenseNet121(include_top=False, weights=None, input_shape=(224, 224, 3))
-    inputs = tf.keras.Input(shape=(224, 224, 3))
-    x = base_model(inputs)
-    x = tf.keras.layers.GlobalAveragePooling2D()(x)
-    x = tf.keras.layers.BatchNormalization()(x)
-    x = tf.keras.layers.Dropout(0.5)(x)
-    x = tf.keras.layers.Dense(512, activation='relu')(x)
-    x = tf.keras.layers.BatchNormalization()(x)
-    x = tf.keras.layers.Dropout(0.3)(x)
-    outputs = tf.keras.layers.Dense(4, activation='softmax')(x)
-    model = tf.keras.Model(inputs, outputs)
+    from labels import CLASS_LABELS
+    from training import build_model
+    model, _ = build_model(len(CLASS_LABELS))
     try:
         model.load_weights(MODEL_PATH, by_name=True, skip_mismatch=True)
     except Exception as patch_e:
@@ -0,0 +1,25 @@
+"""
+Shared pytest setup. The backend is a flat set of modules, so the tests import them
+from the parent directory. Run from backend/ with:
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dicom_io  # noqa: E402
+
+
+@pytest.fixture
+def make_dicom(tmp_path):
+    """Write a synthetic DICOM with dicom_io.write_synthetic_dicom; returns (path, raw pixels)"""
+    def make(name='study.dcm', **options):
+        path = tmp_path / name
+        data = dicom_io.write_synthetic_dicom(str(path), **options)
+        return str(path), data
+    return make
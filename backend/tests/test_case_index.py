@@ -0,0 +1,94 @@
+import threading
+
+import numpy as np
+import pytest
+
+import case_index
+from case_index import CaseIndex
+
+DIM = 16
+
+
+def vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+
+
+def fill(index, embeddings, owner='alice'):
+    for i, embedding in enumerate(embeddings):
+        index.add(f"s{i}", embedding, i % 3, owner=owner)
+
+
+def test_exact_search_finds_the_query_case(tmp_path):
+    index = CaseIndex(tmp_path, DIM)
+    embeddings = vectors(50)
+    fill(index, embeddings)
+
+    [best] = index.search(embeddings[7], k=1)
+
+    assert best["study_id"] == "s7" and best["similarity"] == pytest.approx(1.0, abs=1e-3)
+    assert [r["study_id"] for r in index.search(embeddings[7], k=3, exclude="s7")][0] != "s7"
+
+
+def test_search_is_scoped_to_the_owner(tmp_path):
+    index = CaseIndex(tmp_path, DIM)
+    embeddings = vectors(4)
+    index.add("mine", embeddings[0], 0, owner='alice')
+    index.add("theirs", embeddings[0], 0, owner='bob')
+
+    assert [r["study_id"] for r in index.search(embeddings[0], owner='alice')] == ["mine"]
+    assert index.owner_of("theirs") == 'bob'
+
+
+def test_store_reopens_and_rejects_another_width(tmp_path):
+    index = CaseIndex(tmp_path, DIM)
+    fill(index, vectors(5))
+
+    assert CaseIndex(tmp_path, DIM).count == 5
+    with pytest.raises(ValueError):
+        CaseIndex(tmp_path, DIM * 2)
+
+
+def test_concurrent_inserts_start_one_training_run(tmp_path, monkeypatch):
+    index = CaseIndex(tmp_path, DIM, ivf_threshold=20)
+    started = []
+    release = threading.Event()
+    monkeypatch.setattr(index, 'train_ivf', lambda: (started.append(1), release.wait(5)))
+    embeddings = vectors(200)
+
+    threads = [threading.Thread(target=fill, args=(index, embeddings[i::4]), kwargs={'owner': str(i)})
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    release.set()
+
+    assert len(started) == 1
+
+
+def test_ivf_search_during_inserts(tmp_path, monkeypatch):
+    monkeypatch.setattr(case_index, 'KMEANS_SAMPLE', 500)
+    index = CaseIndex(tmp_path, DIM, ivf_threshold=10 ** 9, nprobe=4)
+    embeddings = vectors(3000)
+    for i, embedding in enumerate(embeddings[:1000]):
+        index.add(f"s{i}", embedding, 0)
+    index.train_ivf()
+    assert index.stats()["index"] == "ivf"
+
+    errors = []
+
+    def search():
+        try:
+            for embedding in embeddings[:200]:
+                index.search(embedding, k=3)
+        except Exception as e:
+            errors.append(e)
+
+    searcher = threading.Thread(target=search)
+    searcher.start()
+    for i, embedding in enumerate(embeddings[1000:], start=1000):
+        index.add(f"s{i}", embedding, 0)
+    searcher.join()
+
+    assert not errors
+    assert index.search(embeddings[2500], k=1)[0]["study_id"] == "s2500"
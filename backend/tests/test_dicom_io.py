@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import dicom_io
+from inference import preprocess_image
+
+SIZE = 448  # exactly 2x2 source pixels per output pixel
+
+
+def reference(raw, slope=1.0, intercept=0.0, center=None, width=None, invert=False):
+    """Full-precision rescale, DICOM linear VOI and block average of one frame"""
+    values = raw.astype(np.float64) * slope + intercept
+    if center is None:
+        low, high = values.min(), values.max()
+        values = (values - low) / (high - low)
+    else:
+        values = (values - (center - 0.5)) / (width - 1) + 0.5
+    values = np.clip(values, 0.0, 1.0)
+    if invert:
+        values = 1.0 - values
+    rows, cols = raw.shape
+    return values.reshape(224, rows // 224, 224, cols // 224).mean(axis=(1, 3))
+
+
+@pytest.mark.parametrize('explicit', [True, False])
+def test_header_is_parsed_without_pixel_data(make_dicom, explicit):
+    path, data = make_dicom(rows=SIZE, cols=SIZE, explicit=explicit, slope=2.0, intercept=-1024.0,
+                            window=(3000, 4000))
+    header = dicom_io.read_header(path)
+
+    assert header['Rows'] == SIZE and header['Columns'] == SIZE
+    assert header['BitsAllocated'] == 16
+    assert header['NumberOfFrames'] == 1
+    assert header['RescaleSlope'] == 2.0 and header['RescaleIntercept'] == -1024.0
+    assert header['WindowCenter'] == 3000.0 and header['WindowWidth'] == 4000.0
+    assert header['PixelDataLength'] == data.nbytes
+
+
+def test_header_stops_before_pixel_bytes(make_dicom):
+    path, _ = make_dicom(rows=SIZE, cols=SIZE)
+    offset = dicom_io.read_header(path)['PixelDataOffset']
+    with open(path, 'r+b') as f:
+        f.truncate(offset + 16)
+
+    header = dicom_io.read_header(path)
+    with pytest.raises(dicom_io.DicomError, match='truncated'):
+        dicom_io.pixel_memmap(header)
+
+
+def test_pixels_are_memory_mapped(make_dicom):
+    path, data = make_dicom(rows=SIZE, cols=SIZE, frames=2)
+    pixels = dicom_io.pixel_memmap(dicom_io.read_header(path))
+
+    assert isinstance(pixels, np.memmap)
+    assert pixels.shape == (2, SIZE, SIZE) and pixels.dtype == np.dtype('<u2')
+    np.testing.assert_array_equal(pixels, data)
+
+
+def test_rescale_and_voi_window(make_dicom):
+    path, data = make_dicom(rows=SIZE, cols=SIZE, slope=2.0, intercept=-1024.0, window=(3000, 4000))
+    batch = dicom_io.load_dicom(path)
+
+    assert batch.shape == (1, 224, 224, 3) and batch.dtype == np.float32
+    expected = reference(data[0], 2.0, -1024.0, 3000, 4000)
+    np.testing.assert_allclose(batch[0, :, :, 0], expected, atol=1e-5)
+    np.testing.assert_array_equal(batch[0, :, :, 0], batch[0, :, :, 2])
+
+
+def test_multi_valued_window_uses_first_preset(make_dicom):
+    path, data = make_dicom(rows=SIZE, cols=SIZE, window=('2000\\1000', '3000\\500'))
+    header = dicom_io.read_header(path)
+
+    assert header['WindowCenter'] == 2000.0 and header['WindowWidth'] == 3000.0
+    np.testing.assert_allclose(dicom_io.load_dicom(path)[0, :, :, 0], reference(data[0], center=2000, width=3000), atol=1e-5)
+
+
+def test_full_range_without_window(make_dicom):
+    path, data = make_dicom(rows=SIZE, cols=SIZE)
+    gray = dicom_io.load_dicom(path)[0, :, :, 0]
+
+    np.testing.assert_allclose(gray, reference(data[0]), atol=1e-5)
+
+
+def test_monochrome1_is_inverted(make_dicom):
+    path, data = make_dicom(rows=SIZE, cols=SIZE, window=(2048, 4096), monochrome1=True)
+    gray = dicom_io.load_dicom(path)[0, :, :, 0]
+
+    np.testing.assert_allclose(gray, reference(data[0], center=2048, width=4096, invert=True), atol=1e-5)
+
+
+def test_small_images_are_upsampled(make_dicom):
+    path, _ = make_dicom(rows=100, cols=120, window=(2048, 4096))
+    batch = dicom_io.load_dicom(path)
+
+    assert batch.shape == (1, 224, 224, 3)
+    assert 0.0 <= batch.min() and batch.max() <= 1.0
+
+
+def test_multi_frame_streams_one_frame_at_a_time(make_dicom):
+    path, data = make_dicom(rows=SIZE, cols=SIZE, frames=3, window=(2048, 4096))
+    header = dicom_io.read_header(path)
+    frames = list(dicom_io.iter_frames(header))
+
+    assert header['NumberOfFrames'] == 3
+    assert [index for index, _ in frames] == [0, 1, 2]
+    for index, gray in frames:
+        assert gray.shape == (224, 224)
+        np.testing.assert_allclose(gray, reference(data[index], center=2048, width=4096), atol=1e-5)
+        np.testing.assert_array_equal(dicom_io.load_dicom(path, frame=index)[0, :, :, 0], gray)
+
+
+def test_write_frame_into_fills_an_input_buffer(make_dicom):
+    path, _ = make_dicom(rows=SIZE, cols=SIZE, frames=2, window=(2048, 4096))
+    header = dicom_io.read_header(path)
+    pixels = dicom_io.pixel_memmap(header)
+    buffer = np.zeros((224, 224, 3), dtype=np.float32)
+
+    dicom_io.write_frame_into(header, pixels, 1, buffer)
+
+    np.testing.assert_array_equal(buffer, dicom_io.load_dicom(path, frame=1)[0])
+
+
+def test_is_dicom(make_dicom, tmp_path):
+    path, _ = make_dicom()
+    other = tmp_path / 'image.png'
+    Image.new('L', (8, 8)).save(other)
+
+    assert dicom_io.is_dicom(path)
+    assert not dicom_io.is_dicom(str(other))
+    assert not dicom_io.is_dicom(str(tmp_path / 'missing.dcm'))
+
+
+def test_encapsulated_pixel_data_is_rejected(make_dicom):
+    path, _ = make_dicom(rows=16, cols=16)
+    offset = dicom_io.read_header(path)['PixelDataOffset']
+    with open(path, 'r+b') as f:
+        f.seek(offset - 4)
+        f.write(b'\xff\xff\xff\xff')  # undefined length: compressed fragments follow
+
+    with pytest.raises(dicom_io.DicomError, match='Encapsulated'):
+        dicom_io.read_header(path)
+
+
+def test_16_bit_png_is_windowed(tmp_path):
+    ramp = np.tile(np.linspace(0, 4095, SIZE).astype(np.uint16), (SIZE, 1))
+    path = tmp_path / 'ramp.png'
+    Image.fromarray(ramp).save(path)
+
+    batch = preprocess_image(str(path))
+
+    assert batch.shape == (1, 224, 224, 3)
+    assert batch.min() == pytest.approx(0.0, abs=5e-3) and batch.max() == pytest.approx(1.0, abs=5e-3)
+    assert np.all(np.diff(batch[0, 0, :, 0]) > 0)
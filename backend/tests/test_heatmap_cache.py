@@ -0,0 +1,61 @@
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import heatmap_cache
+from heatmap_cache import HeatmapCache, heatmap_id
+
+
+def overlay(seed=0):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray((rng.random((224, 224, 3)) * 255).astype(np.uint8))
+
+
+def test_heatmap_id_depends_on_the_model():
+    upload = b'same upload bytes'
+
+    assert heatmap_id(upload, 'v1|aaaa') == heatmap_id(upload, 'v1|aaaa')
+    assert heatmap_id(upload, 'v1|aaaa') != heatmap_id(upload, 'v1|bbbb')
+
+
+def test_png_variant_and_unknown_key():
+    cache = HeatmapCache()
+    png = cache.put('k', overlay(), 'Normal')
+
+    assert cache.variant('k', 'png') == (png, heatmap_cache.etag_for(png))
+    assert cache.variant('missing', 'png') is None
+
+
+@pytest.mark.skipif(not heatmap_cache.WEBP_AVAILABLE, reason='Pillow built without WebP')
+def test_concurrent_webp_requests_encode_once(monkeypatch):
+    cache = HeatmapCache()
+    cache.put('k', overlay(), 'Normal')
+    encode = heatmap_cache.encode
+    calls = []
+
+    def slow_encode(image, fmt):
+        calls.append(fmt)
+        threading.Event().wait(0.05)
+        return encode(image, fmt)
+
+    monkeypatch.setattr(heatmap_cache, 'encode', slow_encode)
+    results, errors = [], []
+
+    def request():
+        try:
+            results.append(cache.variant('k', 'webp'))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert calls == ['webp']
+    assert len(set(results)) == 1 and results[0][0][:4] == b'RIFF'
+    assert cache.stats()["bytes"] == sum(len(data) for data, _ in cache.get('k')["variants"].values())
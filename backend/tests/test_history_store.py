@@ -0,0 +1,116 @@
+import time
+
+import numpy as np
+import pytest
+
+import history_store
+from history_store import PredictionHistory, decode_cursor, encode_cursor
+
+LABELS = ["COVID-19", "Normal", "Pneumonia"]
+
+
+@pytest.fixture
+def history(tmp_path):
+    store = PredictionHistory(tmp_path / 'history.db', LABELS)
+    yield store
+    store.close()
+
+
+def record(store, study_id, user_id='alice', class_idx=1, **options):
+    probabilities = np.full(len(LABELS), 0.1, dtype=np.float32)
+    probabilities[class_idx] = 0.8
+    assert store.record(study_id, user_id, class_idx, 0.8, probabilities, 'real', **options)
+
+
+def all_pages(store, user_id, limit, **options):
+    pages, cursor = [], None
+    while True:
+        records, cursor = store.list(user_id, limit=limit, cursor=cursor, **options)
+        pages.append([r["study_id"] for r in records])
+        if cursor is None:
+            return pages
+
+
+def test_keyset_pages_are_newest_first_without_gaps(history):
+    for i in range(7):
+        record(history, f"s{i}")
+    record(history, "other", user_id='bob')
+    history.flush()
+
+    pages = all_pages(history, 'alice', limit=3)
+
+    assert pages == [["s6", "s5", "s4"], ["s3", "s2", "s1"], ["s0"]]
+
+
+def test_rows_with_the_same_timestamp_are_not_skipped(history, monkeypatch):
+    monkeypatch.setattr(history_store.time, 'time', lambda: 1_700_000_000.0)
+    for i in range(5):
+        record(history, f"s{i}")
+    history.flush()
+
+    pages = all_pages(history, 'alice', limit=2)
+
+    assert sum(pages, []) == ["s4", "s3", "s2", "s1", "s0"]
+
+
+def test_class_filter_and_counts(history):
+    for i, class_idx in enumerate([0, 2, 2, 1, 2]):
+        record(history, f"s{i}", class_idx=class_idx)
+    history.flush()
+
+    assert all_pages(history, 'alice', limit=2, class_idx=2) == [["s4", "s2"], ["s1"]]
+    assert history.class_counts('alice') == {"COVID-19": 1, "Normal": 1, "Pneumonia": 3}
+    assert history.class_counts('bob') == {label: 0 for label in LABELS}
+
+
+def test_records_are_decoded(history):
+    record(history, "s0", class_idx=2, filename='chest.png')
+    history.flush()
+
+    [row], cursor = history.list('alice')
+
+    assert cursor is None
+    assert row["class"] == "Pneumonia" and row["filename"] == 'chest.png'
+    assert row["all_predictions"]["Pneumonia"] == pytest.approx(0.8)
+
+
+def test_duplicate_study_is_counted_once(history):
+    record(history, "s0")
+    record(history, "s0")
+    history.flush()
+
+    assert [r["study_id"] for r in history.list('alice')[0]] == ["s0"]
+    assert history.class_counts('alice')["Normal"] == 1
+
+
+def test_cursor_round_trip_and_malformed_cursor(history):
+    assert decode_cursor(encode_cursor(1700000000.123456, 42)) == (1700000000.123456, 42)
+    with pytest.raises(ValueError):
+        history.list('alice', cursor='not-a-cursor')
+
+
+def test_thumbnails_are_shared_and_scoped_to_their_owner(history):
+    pixels = np.full((224, 224, 3), 90, dtype=np.uint8)
+    record(history, "s0", thumbnail=pixels)
+    record(history, "s1", thumbnail=pixels)
+    history.flush()
+
+    hashes = {r["thumbnail"] for r in history.list('alice')[0]}
+    assert len(hashes) == 1
+    thumbnail_hash = hashes.pop()
+    assert history.thumbnail('alice', thumbnail_hash)[:2] == b'\xff\xd8'
+    assert history.thumbnail('bob', thumbnail_hash) is None
+
+
+def test_flush_waits_for_the_batch_being_written(history, monkeypatch):
+    write_batch = history._write_batch
+
+    def slow_write(conn, batch):
+        time.sleep(0.2)
+        write_batch(conn, batch)
+
+    monkeypatch.setattr(history, '_write_batch', slow_write)
+    record(history, "s0")
+    history.flush()
+
+    assert [r["study_id"] for r in history.list('alice')[0]] == ["s0"]
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+import memory_governor
+from memory_governor import MemoryGovernor, MemoryPressure
+
+MB = 2 ** 20
+
+
+class FakeRss:
+    """Settable RSS reader standing in for /proc/self/statm"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self):
+        return self.value
+
+
+def run(governor, rss, feature, estimate_mb, footprint_mb=0, retained_mb=0):
+    """One guarded run that peaks `footprint_mb` above the starting RSS and keeps `retained_mb`"""
+    @governor.guard(feature, estimate_mb)
+    def view():
+        start = rss.value
+        rss.value = start + footprint_mb * MB
+        time.sleep(memory_governor.SAMPLE_INTERVAL * 5)
+        rss.value = start + retained_mb * MB
+    view()
+
+
+def test_warm_runs_do_not_lower_the_reservation():
+    rss = FakeRss(200 * MB)
+    governor = MemoryGovernor(512 * MB, rss_reader=rss)
+
+    # Warm runs reuse memory: RSS peaks during the run, then returns to where it started
+    for _ in range(10):
+        run(governor, rss, 'predict', 30, footprint_mb=20)
+
+    assert governor.estimates['predict'] == 30 * MB
+    assert governor.stats()["reserved_mb"] == 0
+
+
+def test_estimate_learns_from_the_peak_not_the_net_growth():
+    rss = FakeRss(200 * MB)
+    governor = MemoryGovernor(512 * MB, rss_reader=rss)
+
+    for _ in range(10):
+        run(governor, rss, 'heatmap', 30, footprint_mb=120, retained_mb=0)
+        rss.value = 200 * MB
+
+    assert governor.estimates['heatmap'] > 90 * MB
+    assert governor.stats()["peak_rss_mb"] == 320
+
+
+def test_refuses_past_the_hard_watermark():
+    rss = FakeRss(400 * MB)
+    governor = MemoryGovernor(512 * MB, rss_reader=rss)
+
+    with pytest.raises(MemoryPressure) as excinfo:
+        governor.admit('heatmap', 100 * MB)
+
+    assert excinfo.value.to_dict()["code"] == "MEMORY_PRESSURE"
+    assert governor.stats()["refused"] == {'heatmap': 1}
+
+
+def test_disabled_governor_admits_everything():
+    rss = FakeRss(10 * 1024 * MB)
+    governor = MemoryGovernor(None, rss_reader=rss)
+
+    run(governor, rss, 'report', 40, footprint_mb=500)
+
+    assert governor.stats()["admitted"] == {'report': 1}
@@ -0,0 +1,75 @@
+import numpy as np
+from PIL import Image, ImageFilter
+
+from inference import preprocess_image
+from near_duplicate import NearDuplicateIndex, dhash, hamming
+
+
+def film(seed, size=512):
+    """Smooth, film-like grayscale image with a seed-dependent structure"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    values = 0.5 + 0.2 * np.sin(6 * x + rng.uniform(0, 6)) * np.cos(4 * y + rng.uniform(0, 6))
+    values += rng.normal(0, 0.05, (size, size))
+    return Image.fromarray((np.clip(values, 0, 1) * 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(8))
+
+
+def upload_hash(image, tmp_path, fmt='PNG', **options):
+    path = tmp_path / f'upload.{fmt.lower()}'
+    image.save(path, fmt, **options)
+    return dhash(preprocess_image(str(path))[0])
+
+
+def test_dhash_bits_follow_horizontal_gradient():
+    ramp = np.tile(np.arange(90, dtype=np.float32), (80, 1))
+
+    assert dhash(ramp) == (1 << 64) - 1
+    assert dhash(ramp[:, ::-1]) == 0
+    assert dhash(np.stack([ramp] * 3, axis=2)) == dhash(ramp)
+
+
+def test_reexported_copy_is_within_default_distance(tmp_path):
+    original = film(0)
+    value = upload_hash(original, tmp_path)
+
+    assert hamming(value, upload_hash(original, tmp_path, 'JPEG', quality=60)) <= 2
+    assert hamming(value, upload_hash(original.resize((300, 300)), tmp_path, 'JPEG', quality=80)) <= 2
+    assert hamming(value, upload_hash(film(1), tmp_path)) > 2
+
+
+def test_lookup_respects_max_distance():
+    index = NearDuplicateIndex(max_distance=2)
+    index.add(0b1011, 'stored')
+
+    assert index.lookup(0b1011) == ('stored', 0)
+    assert index.lookup(0b1000) == ('stored', 2)
+    assert index.lookup(0b0100) is None
+    assert index.stats()["hits"] == 2 and index.stats()["lookups"] == 3
+
+
+def test_lookup_prefers_closest_then_most_recent():
+    index = NearDuplicateIndex(max_distance=4)
+    index.add(0b1111, 'far')
+    index.add(0b0001, 'old')
+    index.add(0b0001, 'new')
+
+    assert index.lookup(0b0000) == ('new', 1)
+
+
+def test_lookup_is_scoped_to_the_owner():
+    index = NearDuplicateIndex()
+    index.add(42, 'alice study', owner='alice')
+
+    assert index.lookup(42, owner='alice') == ('alice study', 0)
+    assert index.lookup(42, owner='bob') is None
+    assert index.lookup(42) is None
+
+
+def test_oldest_entries_are_evicted():
+    index = NearDuplicateIndex(max_distance=0, capacity=2)
+    for value in (1, 2, 3):
+        index.add(value, value)
+
+    assert index.lookup(1) is None
+    assert index.lookup(3) == (3, 0)
+    assert index.stats()["entries"] == 2
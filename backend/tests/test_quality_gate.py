@@ -0,0 +1,127 @@
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import quality_gate
+from inference import preprocess_image
+from quality_gate import QualityGate, QualityRejected, measure
+
+FILM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test.png')
+ADMIN_TOKEN = 'test-admin-token'
+
+
+def batch(pixels):
+    """A preprocessed (1, 224, 224, 3) batch from an (H, W) or (H, W, 3) array in [0, 1]"""
+    pixels = np.asarray(pixels, dtype=np.float32)
+    if pixels.ndim == 2:
+        pixels = np.stack([pixels] * 3, axis=2)
+    return pixels[None]
+
+
+def rejection(pixels, width=224, height=224, **options):
+    with pytest.raises(QualityRejected) as excinfo:
+        QualityGate(**options).check(batch(pixels), width, height)
+    return excinfo.value
+
+
+def png_bytes(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray((np.clip(pixels, 0, 1) * 255).astype(np.uint8)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_film_fixture_passes():
+    film = preprocess_image(FILM)
+    measurements = QualityGate().check(film, 512, 512)
+
+    assert measurements == measure(film, 512, 512)
+    assert measurements["chroma_mean"] == 0.0 and measurements["aspect_ratio"] == 1.0
+
+
+def test_measure_of_a_flat_grey_image():
+    measurements = measure(batch(np.full((224, 224), 0.5)))
+
+    assert measurements["brightness"] == pytest.approx(0.5)
+    assert measurements["contrast"] == 0.0 and measurements["sharpness"] == 0.0
+    assert measurements["entropy"] == 0.0
+    assert "aspect_ratio" not in measurements
+
+
+def test_black_frame_is_underexposed():
+    error = rejection(np.zeros((224, 224)))
+
+    assert error.code == "UNUSABLE_IMAGE" and error.status == 422
+    assert error.reason == {"check": "exposure", "measurement": "brightness", "value": 0.0,
+                            "limit": quality_gate.DEFAULT_LIMITS["min_brightness"]}
+
+
+def test_flat_image_has_no_contrast():
+    assert rejection(np.full((224, 224), 0.5)).check == "contrast"
+
+
+def test_colour_photo_is_not_a_radiograph():
+    rng = np.random.default_rng(0)
+    error = rejection(rng.random((224, 224, 3)))
+
+    assert error.check == "colour" and error.code == "NOT_A_RADIOGRAPH"
+
+
+def test_aspect_ratio_is_checked_first():
+    error = rejection(np.zeros((224, 224)), width=900, height=300)
+
+    assert error.check == "aspect_ratio" and error.reason["value"] == 3.0
+
+
+def test_limits_can_be_overridden_and_rejections_are_counted():
+    gate = QualityGate(limits={"min_contrast": 0.5})
+
+    with pytest.raises(QualityRejected) as excinfo:
+        gate.check(preprocess_image(FILM), 512, 512)
+
+    assert excinfo.value.check == "contrast"
+    assert gate.rejected["contrast"] == 1 and gate.checked == 1
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    root = tmp_path_factory.mktemp('app')
+    with pytest.MonkeyPatch.context() as env:
+        for name, value in {
+            'MOCK_BACKEND': 'true', 'MOCK_LATENCY_MS': '0', 'MOCK_MEMORY_MB': '0', 'AUDIT_ENABLED': 'false',
+            'HISTORY_DB_PATH': str(root / 'history.db'), 'CASE_INDEX_DIR': str(root / 'cases'),
+            'KNOWLEDGE_INDEX_PATH': str(root / 'knowledge.npz'), 'PROFILE_DIR': str(root / 'profiles'),
+            'ADMIN_TOKEN': ADMIN_TOKEN, 'QUALITY_GATE_ENABLED': 'true',
+        }.items():
+            env.setenv(name, value)
+        import app
+        yield app.app.test_client()
+
+
+def predict(client, data, headers=None, **values):
+    return client.post('/api/predict', data={'image': (io.BytesIO(data), 'scan.png'), **values},
+                       content_type='multipart/form-data', headers=headers or {})
+
+
+def test_predict_rejects_unusable_images_with_422(client):
+    response = predict(client, png_bytes(np.zeros((224, 224))))
+
+    assert response.status_code == 422
+    assert response.json["code"] == "UNUSABLE_IMAGE" and response.json["reason"]["check"] == "exposure"
+
+
+def test_only_admins_can_skip_the_gate(client):
+    black = png_bytes(np.zeros((224, 224)))
+
+    assert predict(client, black, quality_gate='false').status_code == 422
+    assert predict(client, black, headers={'X-Admin-Token': 'wrong'}, quality_gate='false').status_code == 422
+    assert predict(client, black, headers={'X-Admin-Token': ADMIN_TOKEN}, quality_gate='false').status_code == 200
+
+
+def test_predict_accepts_the_film_fixture(client):
+    with open(FILM, 'rb') as f:
+        response = predict(client, f.read())
+
+    assert response.status_code == 200 and response.json["success"]
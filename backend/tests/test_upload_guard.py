@@ -0,0 +1,139 @@
+import io
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import upload_guard
+
+
+def upload(data, filename='scan.png'):
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+
+def png_bytes(width=64, height=48, mode='L'):
+    buffer = io.BytesIO()
+    Image.new(mode, (width, height), 128).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def png_header_only(width, height):
+    """A PNG whose IHDR claims `width` x `height` but carries no pixel data"""
+    def chunk(kind, body):
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IEND', b'')
+
+
+def rejection(data, filename='scan.png'):
+    with pytest.raises(upload_guard.UploadRejected) as excinfo:
+        upload_guard.admit_upload(upload(data, filename))
+    return excinfo.value
+
+
+def test_admits_png_and_rewinds():
+    file = upload(png_bytes(64, 48))
+
+    info = upload_guard.admit_upload(file)
+
+    assert info == {"format": "png", "width": 64, "height": 48, "frames": 1, "size": len(png_bytes(64, 48))}
+    assert file.stream.tell() == 0
+
+
+@pytest.mark.parametrize('fmt, name', [('JPEG', 'jpeg'), ('GIF', 'gif'), ('BMP', 'bmp'), ('TIFF', 'tiff')])
+def test_sniffs_other_formats(fmt, name):
+    buffer = io.BytesIO()
+    Image.new('L', (40, 40), 90).save(buffer, fmt)
+
+    assert upload_guard.admit_upload(upload(buffer.getvalue(), 'scan.bin'))["format"] == name
+
+
+def test_no_file_selected():
+    error = rejection(png_bytes(), filename='')
+
+    assert error.code == "NO_FILE_SELECTED" and error.status == 400
+
+
+def test_empty_file():
+    assert rejection(b'').code == "EMPTY_FILE"
+
+
+def test_file_too_large(monkeypatch):
+    monkeypatch.setattr(upload_guard, 'MAX_UPLOAD_SIZE', 10)
+    error = rejection(png_bytes())
+
+    assert error.code == "FILE_TOO_LARGE" and error.status == 413
+
+
+def test_extension_is_not_trusted():
+    error = rejection(b'%PDF-1.4 not an image at all', filename='scan.png')
+
+    assert error.code == "UNSUPPORTED_FORMAT" and error.status == 415
+    assert error.to_dict() == {"success": False, "error": error.message, "code": "UNSUPPORTED_FORMAT"}
+
+
+def test_corrupt_header():
+    error = rejection(b'\x89PNG\r\n\x1a\n' + b'\x00' * 64)
+
+    assert error.code == "CORRUPT_IMAGE" and error.status == 400
+
+
+def test_image_too_small():
+    assert rejection(png_bytes(16, 16)).code == "IMAGE_TOO_SMALL"
+
+
+def test_dimensions_too_large_are_caught_from_the_header():
+    error = rejection(png_header_only(upload_guard.MAX_IMAGE_SIDE + 1, 64))
+
+    assert error.code == "IMAGE_DIMENSIONS_TOO_LARGE" and error.status == 413
+
+
+def test_decompression_bomb(monkeypatch):
+    monkeypatch.setattr(upload_guard, 'MAX_IMAGE_PIXELS', 10_000)
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 10_000)
+    error = rejection(png_header_only(1000, 1000))
+
+    assert error.code == "IMAGE_DIMENSIONS_TOO_LARGE" and error.status == 413
+
+
+def test_admits_dicom(make_dicom):
+    path, _ = make_dicom(rows=64, cols=80, frames=2)
+    with open(path, 'rb') as f:
+        info = upload_guard.admit_upload(upload(f.read(), 'study.dcm'))
+
+    assert (info["format"], info["width"], info["height"], info["frames"]) == ("dicom", 80, 64, 2)
+
+
+def test_truncated_dicom(make_dicom):
+    path, _ = make_dicom(rows=64, cols=64)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    assert rejection(data[:-100], 'study.dcm').code == "INVALID_DICOM"
+
+
+def test_too_many_frames(make_dicom, monkeypatch):
+    monkeypatch.setattr(upload_guard, 'MAX_DICOM_FRAMES', 2)
+    path, _ = make_dicom(rows=64, cols=64, frames=3)
+    with open(path, 'rb') as f:
+        error = rejection(f.read(), 'study.dcm')
+
+    assert error.code == "TOO_MANY_FRAMES" and error.status == 413
+
+
+def test_app_simple_sniffs_instead_of_trusting_the_extension(tmp_path, monkeypatch):
+    import app_simple
+    monkeypatch.setattr(app_simple, 'UPLOAD_FOLDER', str(tmp_path))
+    client = app_simple.app.test_client()
+
+    def post(data, filename):
+        return client.post('/api/predict', data={'image': (io.BytesIO(data), filename)},
+                           content_type='multipart/form-data')
+
+    rejected = post(b'plain text', 'scan.png')
+    assert rejected.status_code == 415 and rejected.json["code"] == "UNSUPPORTED_FORMAT"
+
+    accepted = post(png_bytes(), 'scan.bin')
+    assert accepted.status_code == 200 and accepted.json["success"]
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Train the chest X-ray classifier from a script instead of the Colab notebooks.
+Run this LOCALLY (it needs full TensorFlow); it is tuned for multi-core CPUs.
+
+    python training.py dataset --epochs 30
+
+The dataset has one folder per entry in labels.CLASS_LABELS (the layout built by
+Medical_AI_Training_6Class.ipynb). Images are decoded with the serving
+preprocessing (inference.preprocess_image), so training and inference see the same
+pixels, and are kept as uint8 until after the cache. For repeated runs, decode
+once into shards and train from those:
+
+    python training.py dataset --write-shards shards --format tfrecord
+    python training.py --shards shards --epochs 30
+
+Interrupted runs resume from the last completed epoch (--checkpoint-dir). The best
+weights are saved to --model and exported straight to TFLite (dynamic-batch
+signatures, with the embedding output) through convert_to_tflite.convert(). build_model() here is the single
+definition of the architecture; convert_to_tflite, distill and test_model import it.
+
+Quick end-to-end check on a tiny synthetic dataset:
+
+    python training.py --synthetic 8 --epochs 1 --weights none --output /tmp/model.tflite
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')
+
+import numpy as np
+
+from distill import make_synthetic_dataset, split_holdout
+from evaluate import discover
+from inference import preprocess_image
+from labels import CLASS_LABELS
+
+IMG_SIZE = (224, 224)
+ARCHITECTURES = ('densenet121', 'mobilenetv3small')
+FINE_TUNE_LAYERS = 40  # trailing backbone layers left trainable on top of ImageNet weights
+SHARD_SIZE = 1024      # images per shard
+SHARD_FORMATS = ('tfrecord', 'npy')
+
+
+def build_model(num_classes=len(CLASS_LABELS), arch='densenet121', weights=None, fine_tune_layers=None):
+    """
+    The training architecture; returns (model, embedding_model).
+    `weights='imagenet'` starts the backbone from ImageNet and, with `fine_tune_layers`,
+    freezes all but its last layers.
+    """
+    import tensorflow as tf
+
+    inputs = tf.keras.Input(shape=IMG_SIZE + (3,))
+    if arch == 'mobilenetv3small':
+        # Inputs arrive scaled to [0, 1]; MobileNetV3 expects [-1, 1] without its own rescaling
+        base_model = tf.keras.applications.MobileNetV3Small(
+            include_top=False,
+            weights=weights,
+            input_shape=IMG_SIZE + (3,),
+            include_preprocessing=False
+        )
+        x = base_model(tf.keras.layers.Rescaling(2.0, offset=-1.0)(inputs))
+    else:
+        base_model = tf.keras.applications.DenseNet121(
+            include_top=False,
+            weights=weights,
+            input_shape=IMG_SIZE + (3,)
+        )
+        x = base_model(inputs)
+    if fine_tune_layers is not None:
+        base_model.trainable = True
+        for layer in base_model.layers[:-fine_tune_layers]:
+            layer.trainable = False
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    x = tf.keras.layers.BatchNormalization()(x)
+    x = tf.keras.layers.Dropout(0.5)(x)
+    x = tf.keras.layers.Dense(512, activation='relu')(x)
+    embedding = x
+    x = tf.keras.layers.BatchNormalization()(x)
+    x = tf.keras.layers.Dropout(0.3)(x)
+    outputs = tf.keras.layers.Dense(num_classes, activation='softmax')(x)
+    model = tf.keras.Model(inputs, outputs)
+
+    # Shares every layer with `model`, so weights loaded into one are seen by both
+    embedding_model = tf.keras.Model(inputs, [outputs, embedding])
+    return model, embedding_model
+
+
+def configure_cpu(threads=None):
+    """Use every core for op-level parallelism; must run before TensorFlow executes anything"""
+    import tensorflow as tf
+
+    threads = threads or os.cpu_count() or 1
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+    return threads
+
+
+# Decoding
+
+def load_uint8(path):
+    """Serving preprocessing, stored compactly: (224, 224, 3) uint8"""
+    return np.round(preprocess_image(path)[0] * 255.0).astype(np.uint8)
+
+
+def _load_sample(sample):
+    path, class_idx = sample
+    try:
+        return load_uint8(path), class_idx
+    except Exception as e:
+        print(f"WARN  Skipping {path}: {e}")
+        return None, class_idx
+
+
+def write_shards(samples, out_dir, prefix, fmt='tfrecord', shard_size=SHARD_SIZE, workers=None):
+    """Decode samples in parallel once and write `prefix`-NNNNN shards; returns the shard paths"""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    with Pool(workers or os.cpu_count()) as pool:
+        for shard, start in enumerate(range(0, len(samples), shard_size)):
+            decoded = [(image, label) for image, label in
+                       pool.map(_load_sample, samples[start:start + shard_size], chunksize=16) if image is not None]
+            if not decoded:
+                continue
+            images = np.stack([image for image, _ in decoded])
+            labels = np.array([label for _, label in decoded], dtype=np.int64)
+            base = os.path.join(out_dir, f"{prefix}-{shard:05d}")
+            if fmt == 'npy':
+                np.save(f"{base}.npy", images)
+                np.save(f"{base}.labels.npy", labels)
+                paths.append(f"{base}.npy")
+            else:
+                paths.append(_write_tfrecord(f"{base}.tfrecord", images, labels))
+            print(f"  {os.path.basename(paths[-1])}: {len(labels)} images")
+    return paths
+
+
+def _write_tfrecord(path, images, labels):
+    import tensorflow as tf
+
+    with tf.io.TFRecordWriter(path) as writer:
+        for image, label in zip(images, labels):
+            example = tf.train.Example(features=tf.train.Features(feature={
+                "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+                "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[int(label)])),
+            }))
+            writer.write(example.SerializeToString())
+    return path
+
+
+def find_shards(shard_dir, prefix):
+    """(format, paths) of the `prefix` shards in a directory"""
+    for fmt, pattern in (('tfrecord', '*.tfrecord'), ('npy', '*[0-9].npy')):
+        paths = sorted(glob.glob(os.path.join(shard_dir, f"{prefix}-{pattern}")))
+        if paths:
+            return fmt, paths
+    raise SystemExit(f"ERR No {prefix} shards in {shard_dir}")
+
+
+# Input pipeline
+
+def _decoded_dataset(tf, samples):
+    """(uint8 image, label) from image files, decoded in parallel with the serving preprocessing"""
+    paths = [path for path, _ in samples]
+    labels = [class_idx for _, class_idx in samples]
+
+    def load(path):
+        return load_uint8(path.decode('utf-8'))
+
+    def decode(path, label):
+        image = tf.numpy_function(load, [path], tf.uint8)
+        image.set_shape(IMG_SIZE + (3,))
+        return image, label
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, tf.constant(labels, dtype=tf.int64)))
+    return dataset.map(decode, num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+
+
+def _tfrecord_dataset(tf, paths):
+    spec = {"image": tf.io.FixedLenFeature([], tf.string), "label": tf.io.FixedLenFeature([], tf.int64)}
+
+    def parse(record):
+        example = tf.io.parse_single_example(record, spec)
+        image = tf.reshape(tf.io.decode_raw(example["image"], tf.uint8), IMG_SIZE + (3,))
+        return image, example["label"]
+
+    files = tf.data.Dataset.from_tensor_slices(paths)
+    records = files.interleave(tf.data.TFRecordDataset, cycle_length=min(len(paths), 8),
+                               num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+    return records.map(parse, num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+
+
+def _npy_dataset(tf, paths):
+    def rows(path):
+        path = path.decode('utf-8')
+        images = np.load(path, mmap_mode='r')
+        labels = np.load(path[:-len('.npy')] + '.labels.npy')
+        for image, label in zip(images, labels):
+            yield np.asarray(image), label
+
+    signature = (tf.TensorSpec(IMG_SIZE + (3,), tf.uint8), tf.TensorSpec((), tf.int64))
+    files = tf.data.Dataset.from_tensor_slices(paths)
+    return files.interleave(lambda path: tf.data.Dataset.from_generator(rows, output_signature=signature, args=(path,)),
+                            cycle_length=min(len(paths), 8), num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+
+
+def make_dataset(source, num_classes, batch_size, training, cache='memory', shuffle_buffer=2000, seed=0):
+    """
+    Batched (float image in [0, 1], one-hot label) dataset.
+    `source` is a list of (path, class_idx) samples or a ('tfrecord'|'npy', shard_paths) pair.
+    Images stay uint8 up to the cache (a quarter of the float32 memory); augmentation runs after it.
+    """
+    import tensorflow as tf
+
+    if isinstance(source, tuple):
+        fmt, paths = source
+        dataset = _npy_dataset(tf, paths) if fmt == 'npy' else _tfrecord_dataset(tf, paths)
+    else:
+        dataset = _decoded_dataset(tf, source)
+
+    if cache == 'memory':
+        dataset = dataset.cache()
+    elif cache and cache != 'none':
+        dataset = dataset.cache(cache)
+    if training:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    def to_float(image, label):
+        image = tf.image.convert_image_dtype(image, tf.float32)
+        if training:
+            image = tf.image.random_flip_left_right(image)
+            image = tf.clip_by_value(tf.image.random_brightness(image, 0.2), 0.0, 1.0)
+        return image, tf.one_hot(label, num_classes)
+
+    dataset = dataset.map(to_float, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not training)
+    dataset = dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    options = tf.data.Options()
+    options.deterministic = not training
+    return dataset.with_options(options)
+
+
+# Training
+
+def train(train_ds, val_ds, num_classes, epochs, learning_rate=1e-4, arch='densenet121', weights='imagenet',
+          checkpoint_dir='training_checkpoints', model_path='model.h5', steps_per_execution=8, jit_compile=False):
+    """Fit with resumable per-epoch backups; returns (model, embedding_model) holding the best weights"""
+    import tensorflow as tf
+
+    model, embedding_model = build_model(num_classes, arch, weights, FINE_TUNE_LAYERS if weights else None)
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+        loss='categorical_crossentropy',
+        metrics=['accuracy'],
+        steps_per_execution=steps_per_execution,
+        jit_compile=jit_compile
+    )
+    callbacks = [
+        # Restores model, optimizer and epoch after an interruption; removed when fit() completes
+        tf.keras.callbacks.BackupAndRestore(checkpoint_dir),
+        tf.keras.callbacks.ModelCheckpoint(model_path, monitor='val_accuracy', save_best_only=True, mode='max', verbose=1),
+        tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=8, verbose=1, restore_best_weights=True),
+        tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=3, min_lr=1e-6, verbose=1),
+    ]
+    model.fit(train_ds, epochs=epochs, validation_data=val_ds, callbacks=callbacks)
+    if os.path.exists(model_path):
+        model.load_weights(model_path)
+    return model, embedding_model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data_dir', nargs='?', help='dataset with one folder per class')
+    parser.add_argument('--shards', help='train from shards written by --write-shards instead of data_dir')
+    parser.add_argument('--write-shards', metavar='DIR', help='decode data_dir into train/val shards and exit')
+    parser.add_argument('--format', choices=SHARD_FORMATS, default='tfrecord', help='shard format for --write-shards')
+    parser.add_argument('--synthetic', type=int, default=0, metavar='N', help='generate N synthetic images per class')
+    parser.add_argument('--arch', choices=ARCHITECTURES, default='densenet121')
+    parser.add_argument('--weights', choices=('imagenet', 'none'), default='imagenet')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--holdout', type=float, default=0.2, help='fraction of images used for validation')
+    parser.add_argument('--cache', default='memory', help="'memory', 'none' or a file path for the decoded-image cache")
+    parser.add_argument('--threads', type=int, help='TensorFlow intra-op threads (default: all cores)')
+    parser.add_argument('--steps-per-execution', type=int, default=8, help='batches per compiled call (less Python overhead)')
+    parser.add_argument('--jit', action='store_true', help='XLA-compile the training step')
+    parser.add_argument('--checkpoint-dir', default='training_checkpoints')
+    parser.add_argument('--model', default='model.h5', help='best Keras weights')
+    parser.add_argument('--output', default='model.tflite', help="TFLite export ('' to skip)")
+    parser.add_argument('--no-embeddings', action='store_true', help='export class probabilities only')
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir
+    if args.synthetic:
+        data_dir = os.path.join(tempfile.mkdtemp(prefix='training_'), 'dataset')
+        for class_idx, label in enumerate(CLASS_LABELS):
+            make_synthetic_dataset(os.path.join(data_dir, label), args.synthetic, seed=class_idx)
+    if not args.shards and not data_dir:
+        parser.error('data_dir is required unless --shards or --synthetic is given')
+
+    num_classes = len(CLASS_LABELS)
+    if args.shards:
+        train_source, val_source = find_shards(args.shards, 'train'), find_shards(args.shards, 'val')
+        print(f"Step 1: Reading {len(train_source[1])} train / {len(val_source[1])} val {train_source[0]} shards")
+    else:
+        samples = discover(data_dir, CLASS_LABELS)
+        if len(samples) < 2:
+            raise SystemExit(f"ERR Need at least two labelled images under {data_dir}")
+        train_rows, val_rows = split_holdout(len(samples), args.holdout)
+        train_source = [samples[i] for i in train_rows]
+        val_source = [samples[i] for i in val_rows]
+        print(f"Step 1: {len(train_source)} training / {len(val_source)} validation images in {data_dir}")
+
+        if args.write_shards:
+            start = time.perf_counter()
+            write_shards(train_source, args.write_shards, 'train', args.format)
+            write_shards(val_source, args.write_shards, 'val', args.format)
+            print(f"OK  Wrote {args.format} shards to {args.write_shards} in {time.perf_counter() - start:.1f}s")
+            return 0
+
+    threads = configure_cpu(args.threads)
+    train_ds = make_dataset(train_source, num_classes, args.batch_size, training=True, cache=args.cache)
+    cache_val = args.cache if args.cache in ('memory', 'none') else f"{args.cache}.val"
+    val_ds = make_dataset(val_source, num_classes, args.batch_size, training=False, cache=cache_val)
+
+    print(f"Step 2: Training {args.arch} ({num_classes} classes, {threads} threads)...")
+    model, embedding_model = train(
+        train_ds, val_ds, num_classes, args.epochs, args.learning_rate, args.arch,
+        None if args.weights == 'none' else args.weights, args.checkpoint_dir, args.model,
+        args.steps_per_execution, args.jit
+    )
+    if not os.path.exists(args.model):
+        model.save(args.model)
+
+    if args.output:
+        from convert_to_tflite import convert
+        print(f"Step 3: Exporting to {args.output}...")
+        convert(model, args.output, None if args.no_embeddings else embedding_model)
+        print(f"OK  {args.output}: {os.path.getsize(args.output) / 2 ** 20:.1f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Batched test-time augmentation (TTA).
+All augmented views of a preprocessed (1, 224, 224, 3) tensor are generated with
+vectorised NumPy and pushed through the interpreter as a single batch.
+"""
+
+import numpy as np
+
+from inference import run_inference, top1_margin
+
+TTA_MODES = ('off', 'on', 'auto')
+TTA_AGGREGATIONS = ('mean', 'geometric')
+
+SHIFT_PIXELS = 8
+CROP_FRACTION = 0.9
+CONTRAST_FACTORS = (0.9, 1.1)
+
+
+def _crop_indices(size, fraction):
+    """Nearest-neighbour source indices for a centre crop scaled back to the full size"""
+    crop = int(round(size * fraction))
+    start = (size - crop) // 2
+    return start + (np.arange(size) * crop // size)
+
+
+def augment_views(img):
+    """Return an (8, H, W, C) stack of augmented views; view 0 is always the untouched image"""
+    img = np.asarray(img, dtype=np.float32)
+    if img.ndim == 4:
+        img = img[0]
+    height, width = img.shape[:2]
+
+    # Pad once with edge values so shifted windows are plain slices
+    s = SHIFT_PIXELS
+    padded = np.pad(img, ((s, s), (s, s), (0, 0)), mode='edge')
+    rows = _crop_indices(height, CROP_FRACTION)
+    cols = _crop_indices(width, CROP_FRACTION)
+    cropped = img[rows[:, None], cols[None, :]]
+
+    views = np.empty((8, height, width, img.shape[2]), dtype=np.float32)
+    views[0] = img
+    views[1] = img[:, ::-1]
+    views[2] = padded[:height, :width]
+    views[3] = padded[2 * s:, 2 * s:]
+    views[4] = cropped
+    views[5] = cropped[:, ::-1]
+
+    # Contrast jitter around each image's mean, broadcast over both factors at once
+    factors = np.asarray(CONTRAST_FACTORS, dtype=np.float32)[:, None, None, None]
+    mean = img.mean()
+    views[6:8] = np.clip((img[None] - mean) * factors + mean, 0.0, 1.0)
+    return views
+
+
+def aggregate(probabilities, method='mean'):
+    """Combine per-view probabilities into one distribution plus dispersion statistics"""
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    if method == 'geometric':
+        log_probs = np.log(np.clip(probabilities, 1e-7, 1.0)).mean(axis=0)
+        combined = np.exp(log_probs - log_probs.max())
+    else:
+        combined = probabilities.mean(axis=0)
+    combined = combined / combined.sum()
+
+    # Uncertainty: predictive entropy, per-class spread and how often views agree on top-1
+    entropy = float(-(combined * np.log(np.clip(combined, 1e-12, 1.0))).sum())
+    max_entropy = float(np.log(len(combined)))
+    view_top1 = probabilities.argmax(axis=1)
+    agreement = float((view_top1 == combined.argmax()).mean())
+
+    uncertainty = {
+        "entropy": entropy / max_entropy if max_entropy > 0 else 0.0,
+        "std": probabilities.std(axis=0).astype(np.float32),
+        "view_agreement": agreement,
+    }
+    return combined.astype(np.float32), uncertainty
+
+
+def should_apply(mode, probabilities, margin_threshold):
+    """Decide whether TTA should run for this request"""
+    if mode == 'on':
+        return True
+    if mode == 'auto':
+        return top1_margin(probabilities) < margin_threshold
+    return False
+
+
+def predict_with_tta(interpreter, img, method='mean', base_probabilities=None):
+    """Run all augmented views in one batch and return (probabilities, uncertainty, num_views)"""
+    views = augment_views(img)
+
+    if base_probabilities is not None:
+        # The untouched view was already scored by the single-pass prediction
+        rest = run_inference(interpreter, views[1:])
+        probabilities = np.concatenate([np.asarray(base_probabilities, dtype=np.float32)[None], rest])
+    else:
+        probabilities = run_inference(interpreter, views)
+
+    combined, uncertainty = aggregate(probabilities, method)
+    return combined, uncertainty, len(views)
@@ -0,0 +1,165 @@
+"""
+Upload admission checks that run before an image is saved or decoded.
+The request body size is capped by Flask's MAX_CONTENT_LENGTH while it streams in;
+this module then sniffs magic bytes and reads only the image header to validate
+format and pixel dimensions, so decompression bombs never reach a full decode.
+"""
+
+import os
+import struct
+
+from PIL import Image, UnidentifiedImageError
+
+import dicom_io
+
+MAX_UPLOAD_SIZE = int(float(os.getenv('MAX_UPLOAD_MB', '10')) * 1024 * 1024)
+# Multipart boundaries and form fields ride on top of the file itself
+MAX_CONTENT_LENGTH = MAX_UPLOAD_SIZE + 64 * 1024
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', str(50_000_000)))
+MAX_IMAGE_SIDE = int(os.getenv('MAX_IMAGE_SIDE', '12000'))
+MIN_IMAGE_SIDE = int(os.getenv('MIN_IMAGE_SIDE', '32'))
+MAX_DICOM_FRAMES = int(os.getenv('MAX_DICOM_FRAMES', '64'))
+
+# Pillow's own bomb guard also protects any later full decode
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+SNIFF_BYTES = 132
+
+# Pillow format names accepted after sniffing, keyed by the sniffed format
+ALLOWED_FORMATS = {
+    'png': 'PNG',
+    'jpeg': 'JPEG',
+    'gif': 'GIF',
+    'bmp': 'BMP',
+    'tiff': 'TIFF',
+    'webp': 'WEBP',
+    'dicom': None,
+}
+
+
+class UploadRejected(Exception):
+    """Raised when an upload fails admission; carries a structured error code"""
+
+    def __init__(self, code, message, status=400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+    def to_dict(self):
+        return {"success": False, "error": self.message, "code": self.code}
+
+
+def sniff_format(head):
+    """Identify the container format from the first bytes of the upload"""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head.startswith(b'BM'):
+        return 'bmp'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[128:132] == b'DICM':
+        return 'dicom'
+    return None
+
+
+def _stream_size(stream):
+    """Size of an already-spooled upload stream without reading it"""
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+def _check_dimensions(width, height, frames=1):
+    """Reject images that are too small to diagnose or large enough to be a decompression bomb"""
+    if width < MIN_IMAGE_SIDE or height < MIN_IMAGE_SIDE:
+        raise UploadRejected(
+            "IMAGE_TOO_SMALL",
+            f"Image is {width}x{height}; at least {MIN_IMAGE_SIDE}x{MIN_IMAGE_SIDE} pixels are required.",
+        )
+    if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE or width * height > MAX_IMAGE_PIXELS:
+        raise UploadRejected(
+            "IMAGE_DIMENSIONS_TOO_LARGE",
+            f"Image is {width}x{height}; the limit is {MAX_IMAGE_PIXELS:,} pixels "
+            f"and {MAX_IMAGE_SIDE} pixels per side.",
+            status=413,
+        )
+    if frames > MAX_DICOM_FRAMES:
+        raise UploadRejected(
+            "TOO_MANY_FRAMES",
+            f"Study has {frames} frames; at most {MAX_DICOM_FRAMES} are accepted.",
+            status=413,
+        )
+
+
+def admit_upload(file):
+    """
+    Validate a werkzeug FileStorage before it is saved or decoded.
+    Returns a dict with the sniffed format and pixel dimensions, or raises UploadRejected.
+    """
+    if file is None or not file.filename:
+        raise UploadRejected("NO_FILE_SELECTED", "No file selected")
+
+    stream = file.stream
+    size = _stream_size(stream)
+    if size == 0:
+        raise UploadRejected("EMPTY_FILE", "The uploaded file is empty.")
+    if size > MAX_UPLOAD_SIZE:
+        raise UploadRejected(
+            "FILE_TOO_LARGE",
+            f"File too large. Maximum size: {MAX_UPLOAD_SIZE / 1024 / 1024:.1f}MB",
+            status=413,
+        )
+
+    start = stream.tell()
+    try:
+        head = stream.read(SNIFF_BYTES)
+        stream.seek(start)
+        fmt = sniff_format(head)
+        if fmt is None:
+            raise UploadRejected(
+                "UNSUPPORTED_FORMAT",
+                "Unsupported file type. Upload a PNG, JPEG, GIF, BMP, TIFF, WebP or DICOM image.",
+                status=415,
+            )
+
+        if fmt == 'dicom':
+            try:
+                header = dicom_io.read_header_from(stream)
+            except dicom_io.DicomError as e:
+                raise UploadRejected("INVALID_DICOM", f"Unsupported or corrupt DICOM file: {e}")
+            width, height, frames = header['Columns'], header['Rows'], header['NumberOfFrames']
+            _check_dimensions(width, height, frames)
+            pixel_bytes = width * height * frames * header['SamplesPerPixel'] * (header['BitsAllocated'] // 8)
+            if header['BitsAllocated'] not in (8, 16) or header['PixelDataOffset'] + pixel_bytes > size:
+                raise UploadRejected("INVALID_DICOM", "DICOM pixel data is truncated or uses an unsupported bit depth.")
+            return {"format": fmt, "width": width, "height": height, "frames": frames, "size": size}
+
+        # Image.open is lazy: it parses the header only and defers pixel decoding
+        try:
+            with Image.open(stream) as img:
+                pil_format = img.format
+                width, height = img.size
+        except Image.DecompressionBombError:
+            raise UploadRejected(
+                "IMAGE_DIMENSIONS_TOO_LARGE",
+                f"Image exceeds the limit of {MAX_IMAGE_PIXELS:,} pixels.",
+                status=413,
+            )
+        except (UnidentifiedImageError, OSError, SyntaxError, struct.error):
+            raise UploadRejected("CORRUPT_IMAGE", "The image header could not be read; the file may be corrupt.")
+
+        if pil_format != ALLOWED_FORMATS[fmt]:
+            raise UploadRejected("CORRUPT_IMAGE", "The file contents do not match a supported image format.")
+        _check_dimensions(width, height)
+        return {"format": fmt, "width": width, "height": height, "frames": 1, "size": size}
+    finally:
+        stream.seek(start)